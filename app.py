@@ -1,29 +1,75 @@
 import os
 import io
 import csv
+import hashlib
+import html
+import tempfile
+import json
 import logging
-import requests
+import time
+from datetime import datetime
+from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, Request, HTTPException, Body, Header
-from fastapi.responses import JSONResponse, StreamingResponse, RedirectResponse, FileResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse, RedirectResponse, FileResponse, Response, HTMLResponse
 from dotenv import load_dotenv
 from pydantic import BaseModel, Field
+from psycopg.errors import UniqueViolation
+from botocore.exceptions import ClientError
 from uuid import uuid4
 
 # Storage (síncrono) — mantém seu estado atual
 from storage import (
     init_db, get_conn,
-    mark_processed, add_outbox, add_message,
-    set_pause_bot, get_pause_bot,
-    list_conversations, list_messages
+    mark_processed_many, prune_processed_messages, add_outbox, add_message,
+    add_audit, outbox_stats,
+    filter_handled_message_ids, journal_load_unprocessed, journal_load_range, prune_journal,
+    set_pause_bot, begin_turn, pool_stats, sweep_sessions,
+    list_conversations, list_messages, set_product_image, get_product
 )
 
-# Motor da conversa (FSM)
-from engine import next_reply
+# Motor da conversa (FSM) + fluxos por tenant
+from engine import needs_catalog, next_replies
+import bulk
+import flows
+from catalog import CATALOG_CACHE_CONTROL, catalog_cache, etag_matches, make_etag, public_catalog, public_item
 
 # R2 helpers
-from r2_client import presign_put_url, build_public_url, guess_ext
+from r2_client import ObjectTooLarge, presign_put_url, build_public_url, guess_ext
+
+# Cliente assíncrono da Cloud API (pool keep-alive)
+from whatsapp import WhatsAppClient, SendResult
+from ratelimit import SendLimiter
+
+# Pipeline assíncrona do webhook (modo "queue")
+from pipeline import WebhookPipeline, PipelineFull, PipelineClosed, WEBHOOK_MODE
+
+# Cache de idempotência + tarefas de manutenção
+from idempotency import (
+    RecentIds, PROCESSED_RETENTION_DAYS, PROCESSED_PRUNE_INTERVAL, PROCESSED_PRUNE_BATCH,
+)
+from tasks import PeriodicTask
+from assets import ASSETS_BUILD, AssetFiles, static_assets
+from images import ImageError, image_pipeline
+from menupage import MENU_SSR, menu_pages
+from precompress import pick_encoding
+from snapshots import SNAPSHOT_ENABLED, SNAPSHOT_TICK, pointer_url, snapshot_publisher
+
+# Reenvio de falhas (outbox)
+from outbox import OutboxDispatcher
+
+# Métricas Prometheus (/metrics) e log amostrado
+import metrics
+from metrics import stage
+from dbprofile import DB_SLOW_QUERY_MS, profiler as db_profiler
+from sessioncache import session_cache, SESSION_CONFLICT_RETRIES, SESSION_SWEEP_INTERVAL, SESSION_SWEEP_BATCH
+
+# Journal durável dos webhooks (replay após crash)
+from journal import (
+    EventJournal, tag_messages, REPLAY_KEY, PHONE_KEY,
+    JOURNAL_ENABLED, JOURNAL_REPLAY_GRACE, JOURNAL_RETENTION_DAYS, JOURNAL_PRUNE_INTERVAL,
+)
 
 
 # =======================================
@@ -35,7 +81,43 @@ init_db()
 
 logging.basicConfig(level=logging.INFO)
 
-app = FastAPI(title="BlackBot API")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if ASSETS_BUILD:
+        # Hash + .gz/.br dos estáticos (rápido; no deploy pode vir pronto de `python assets.py`)
+        try:
+            await run_in_threadpool(static_assets.build)
+        except Exception:
+            logging.exception("[assets] build falhou; /static segue sem hash")
+    if JOURNAL_ENABLED:
+        await event_journal.start()
+    # Workers do webhook só sobem no modo "queue"
+    if WEBHOOK_MODE == "queue":
+        await pipeline.start()
+    processed_pruner.start()
+    session_sweeper.start()
+    snapshot_task.start()
+    outbox_dispatcher.start()
+    if JOURNAL_ENABLED:
+        # Reprocessa o que um crash deixou sem marca (e segue verificando)
+        journal_replayer.start()
+        journal_pruner.start()
+    yield
+    # Shutdown: drena a fila antes de encerrar
+    await journal_replayer.stop()
+    await pipeline.stop()
+    await event_journal.stop()
+    await journal_pruner.stop()
+    await processed_pruner.stop()
+    await session_sweeper.stop()
+    await snapshot_task.stop()
+    await outbox_dispatcher.stop()
+    image_pipeline.shutdown()
+    await wa_client.aclose()
+
+
+app = FastAPI(title="BlackBot API", lifespan=lifespan)
 
 VERIFY_TOKEN = os.getenv("VERIFY_TOKEN")
 ACCESS_TOKEN = os.getenv("WHATSAPP_ACCESS_TOKEN")
@@ -51,7 +133,9 @@ ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
 if not os.path.isdir("static"):
     os.makedirs("static/admin", exist_ok=True)
 
-app.mount("/static", StaticFiles(directory="static"), name="static")
+# Arquivos com hash no nome saem do build (pré-comprimidos, immutable);
+# o resto continua vindo direto de static/
+app.mount("/static", AssetFiles(directory="static", pipeline=static_assets), name="static")
 
 # =======================================
 # PUBLIC MENU: /m/{tenant}
@@ -61,56 +145,128 @@ MENU_FILE = os.path.join(STATIC_DIR, "menu", "menu.html")
 os.makedirs(os.path.join(STATIC_DIR, "menu"), exist_ok=True)
 
 @app.get("/m/{tenant}")
-def public_menu_html(tenant: str):
+def public_menu_html(
+    tenant: str,
+    accept_encoding: str = Header(default=None),
+    if_none_match: str = Header(default=None),
+):
     """
     Serve o HTML do cardápio público.
-    O {tenant} é lido pelo menu.js a partir da URL.
+    Com MENU_SSR (padrão), a marca e a primeira página de produtos já vêm
+    no HTML (cache por tenant, gzip/brotli prontos; ETag pela versão do
+    catálogo). O {tenant} é lido pelo menu.js a partir da URL; com snapshots
+    ligados, o HTML leva a URL do ponteiro no R2 (<meta name="bb-snapshot">).
     """
     if not os.path.isfile(MENU_FILE):
         raise HTTPException(status_code=404, detail="menu_html_not_found")
-    return FileResponse(MENU_FILE)
+    meta = ""
+    if SNAPSHOT_ENABLED:
+        meta = f'<meta name="bb-snapshot" content="{html.escape(pointer_url(tenant), quote=True)}" />'
+    if MENU_SSR:
+        try:
+            page = menu_pages.get(tenant, head_extra=meta)
+        except Exception:
+            # Sem banco o cardápio ainda abre (o menu.js tenta a API/snapshot)
+            logging.exception(f"[menu] SSR de {tenant} falhou; servindo o HTML estático")
+        else:
+            encoding = pick_encoding(accept_encoding, page.bodies)
+            etag = page.etag if encoding == "identity" else f'{page.etag[:-1]}-{encoding}"'
+            headers = {"ETag": etag, "Cache-Control": CATALOG_CACHE_CONTROL, "Vary": "Accept-Encoding"}
+            if etag_matches(if_none_match, etag):
+                return Response(status_code=304, headers=headers)
+            if encoding != "identity":
+                headers["Content-Encoding"] = encoding
+            return Response(page.bodies[encoding], media_type="text/html; charset=utf-8", headers=headers)
+    if not meta:
+        return FileResponse(static_assets.built_path(MENU_FILE))
+    with open(static_assets.built_path(MENU_FILE), encoding="utf-8") as f:
+        html_text = f.read()
+    return HTMLResponse(html_text.replace("<!--bb:head-->", meta, 1))
 
 
 @app.get("/m/{tenant}/products.json")
-def public_products_json(tenant: str, limit: int = 200, offset: int = 0):
+def public_products_json(tenant: str, limit: int = 200, offset: int = 0, cursor: str = None,
+                         if_none_match: str = Header(default=None)):
     """
     Endpoint público SOMENTE-LEITURA para o cardápio.
-    NÃO exige X-Admin-Token. Retorna { items, total }.
+    NÃO exige X-Admin-Token. Retorna { items, total, next_cursor }.
+    ETag = versão do catálogo do tenant; If-None-Match igual → 304.
     """
     try:
-        # Import local (evita ciclos caso o arquivo mude de lugar)
-        import storage  # type: ignore
-
         limit = min(max(1, int(limit)), 200)
         offset = max(0, int(offset))
-
-        items = storage.list_products(tenant_slug=tenant, limit=limit, offset=offset)  # type: ignore
-        total = storage.count_products(tenant_slug=tenant)  # type: ignore
-
-        # Sanitização leve
-        safe_items = []
-        for p in items:
-            safe_items.append({
-                "id": p.get("id"),
-                "sku": p.get("sku"),
-                "name": p.get("name") or "",
-                "description": p.get("description") or "",
-                "price_cents": p.get("price_cents") or 0,
-                "currency": p.get("currency") or "BRL",
-                "image_url": p.get("image_url") or "",
-            })
-        return {"items": safe_items, "total": int(total)}
+        if cursor:
+            offset = 0
+            try:
+                storage.decode_cursor(cursor)
+            except ValueError as exc:
+                raise HTTPException(status_code=400, detail=str(exc))
+
+        # Versão em cache: 304 sem tocar no Postgres
+        version = public_catalog.cached_version(tenant)
+        if version is not None:
+            etag = make_etag(version, limit, offset, cursor)
+            if etag_matches(if_none_match, etag):
+                public_catalog.mark_not_modified()
+                return Response(status_code=304, headers={"ETag": etag, "Cache-Control": CATALOG_CACHE_CONTROL})
+
+        version, body = public_catalog.page(tenant, limit, offset, cursor)
+        etag = make_etag(version, limit, offset, cursor)
+        headers = {"ETag": etag, "Cache-Control": CATALOG_CACHE_CONTROL}
+        if etag_matches(if_none_match, etag):
+            public_catalog.mark_not_modified()
+            return Response(status_code=304, headers=headers)
+        return Response(content=body, media_type="application/json", headers=headers)
+    except HTTPException:
+        raise
     except Exception as exc:
         logging.exception("public_products_json failed")
         raise HTTPException(status_code=500, detail=f"public_products_failed: {exc}")
 
+@app.get("/m/{tenant}/search.json")
+def public_search_json(tenant: str, q: str = "", limit: int = 20, cursor: str = None,
+                       if_none_match: str = Header(default=None)):
+    """
+    Busca pública no cardápio (nome, SKU, descrição; tolera acentos e,
+    com pg_trgm, erros de digitação). Retorna { items, next_cursor }.
+    """
+    limit = min(max(1, int(limit)), 50)
+    q = (q or "").strip()[:200]
+    if not q:
+        return {"items": [], "next_cursor": None}
+    # Mesma versão do catálogo do products.json: 304 sem ir ao banco
+    version = public_catalog.cached_version(tenant)
+    etag = None
+    if version is not None:
+        etag = make_etag(version, limit, "s" + hashlib.sha1(f"{q}\n{cursor or ''}".encode()).hexdigest()[:16])
+        if etag_matches(if_none_match, etag):
+            public_catalog.mark_not_modified()
+            return Response(status_code=304, headers={"ETag": etag, "Cache-Control": CATALOG_CACHE_CONTROL})
+    try:
+        page = storage.search_products(tenant_slug=tenant, q=q, limit=limit, cursor=cursor)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    except Exception as exc:
+        logging.exception("public_search_json failed")
+        raise HTTPException(status_code=500, detail=f"public_search_failed: {exc}")
+    headers = {"Cache-Control": CATALOG_CACHE_CONTROL}
+    if etag:
+        headers["ETag"] = etag
+    return JSONResponse({"items": [public_item(p) for p in page.items], "next_cursor": page.next_cursor},
+                        headers=headers)
+
 @app.get("/m/{tenant}/cart", include_in_schema=False)
-async def cart_page(tenant: str):
+async def cart_page(
+    tenant: str,
+    accept_encoding: str = Header(default=None),
+    if_none_match: str = Header(default=None),
+):
     """
     Página pública do carrinho (HTML).
     O JS desta página lê o carrinho do localStorage por tenant e monta o pedido.
     """
-    return FileResponse("static/menu/cart.html")
+    response = static_assets.response("menu/cart.html", accept_encoding, if_none_match)
+    return response or FileResponse("static/menu/cart.html")
 
 @app.get("/")
 def root_redirect():
@@ -143,26 +299,25 @@ def healthz():
 # =======================================
 # ENVIO DE TEXTO
 # =======================================
-def send_text(to_wa_id: str, text: str):
-    url = f"https://graph.facebook.com/{GRAPH_VERSION}/{PHONE_NUMBER_ID}/messages"
-    headers = {
-        "Authorization": f"Bearer {ACCESS_TOKEN}",
-        "Content-Type": "application/json",
-    }
-    payload = {
-        "messaging_product": "whatsapp",
-        "to": to_wa_id,
-        "type": "text",
-        "text": {"body": text},
-    }
+wa_client = WhatsAppClient(
+    access_token=ACCESS_TOKEN,
+    phone_number_id=PHONE_NUMBER_ID,
+    graph_version=GRAPH_VERSION,
+)
+
+
+# Token bucket por número e por par número→contato (suaviza rajadas)
+send_limiter = SendLimiter()
+
+
+async def send_text(to_wa_id: str, text: str) -> SendResult:
+    with stage("send"):
+        result = await send_limiter.send_text(wa_client, to_wa_id, text)
+    metrics.count_send(result.status)
+    return result
 
-    try:
-        r = requests.post(url, headers=headers, json=payload, timeout=20)
-        logging.info(f"[send_text] {r.status_code} {r.text}")
-        return r.status_code, r.text
-    except Exception as e:
-        logging.error(f"[send_text:error] {e}")
-        return 500, str(e)
+
+outbox_dispatcher = OutboxDispatcher(sender=send_text)
 
 
 # =======================================
@@ -187,54 +342,307 @@ async def webhook_verify(request: Request):
 # =======================================
 # WEBHOOK RECEIVE
 # =======================================
+recent_ids = RecentIds()
+
+processed_pruner = PeriodicTask(
+    "prune_processed_messages",
+    lambda: prune_processed_messages(PROCESSED_RETENTION_DAYS, batch_size=PROCESSED_PRUNE_BATCH),
+    interval=PROCESSED_PRUNE_INTERVAL,
+    initial_delay=60,
+)
+
+# Apaga/reinicia sessões paradas há mais que o timeout (mantém sessions enxuta)
+session_sweeper = PeriodicTask(
+    "sweep_sessions",
+    lambda: sweep_sessions(batch_size=SESSION_SWEEP_BATCH),
+    interval=SESSION_SWEEP_INTERVAL,
+    initial_delay=90,
+)
+
+# Publica no R2 o snapshot dos cardápios alterados (debounce em snapshots.py)
+snapshot_task = PeriodicTask(
+    "publish_snapshots",
+    snapshot_publisher.run_due,
+    interval=SNAPSHOT_TICK if SNAPSHOT_ENABLED else 0,
+)
+
+
+event_journal = EventJournal()
+
+
+async def dedupe_messages(msgs: list) -> list:
+    """
+    Idempotência em lote. Duplicatas já confirmadas pelo banco são
+    descartadas pelo cache em memória; o resto vai num único
+    INSERT ... ON CONFLICT DO NOTHING RETURNING. Devolve só as novas.
+
+    Mensagens de replay do journal já constam em processed_messages; para
+    elas vale "a mensagem de entrada ainda não foi gravada" (turno não concluído).
+    """
+    fresh = [m for m in msgs if not m.get(REPLAY_KEY)]
+    replayed = [m for m in msgs if m.get(REPLAY_KEY) and m.get("id")]
+
+    pairs = [
+        (m["id"], m["from"]) for m in fresh
+        if m.get("id") and m.get("from") and not recent_ids.seen(m["id"])
+    ]
+    with stage("idempotency"):
+        new_ids = await run_in_threadpool(mark_processed_many, pairs) if pairs else set()
+    # Tudo que o banco respondeu (novo ou já existente) passa a ser "visto"
+    recent_ids.add_many(p[0] for p in pairs)
+
+    if replayed:
+        ids = [m["id"] for m in replayed]
+        handled = await run_in_threadpool(filter_handled_message_ids, ids)
+        new_ids |= set(ids) - handled
+        await run_in_threadpool(
+            mark_processed_many, [(m["id"], m["from"]) for m in replayed if m.get("from")]
+        )
+
+    kept, seen = [], set()
+    for m in msgs:
+        msg_id = m.get("id")
+        if msg_id and m.get("from"):
+            if msg_id not in new_ids or msg_id in seen:
+                event_journal.ack(m)
+                continue
+            seen.add(msg_id)
+        kept.append(m)
+    return kept
+
+
+async def process_message(msg: dict):
+    """
+    Processa UMA mensagem recebida (já filtrada por dedupe_messages):
+    histórico, FSM e envio.
+    Storage é síncrono e roda no threadpool; o envio é assíncrono.
+    """
+    wa_id = msg.get("from")
+    msg_id = msg.get("id")
+    msg_type = msg.get("type")
+
+    # TEXTO
+    if msg_type == "text":
+        body = (msg.get("text") or {}).get("body", "").strip()
+
+        tenant = flows.tenant_for(msg.get(PHONE_KEY))
+        # Turno: sessão + pause do session_cache (ou uma query). As escritas
+        # são gravadas ANTES do envio, conferindo a versão: se outro worker
+        # mexeu na sessão no meio, nada é gravado nem enviado e o turno é
+        # refeito sobre o estado do banco.
+        for attempt in range(SESSION_CONFLICT_RETRIES + 1):
+            with stage("pause_check"):
+                turn = await run_in_threadpool(begin_turn, wa_id, attempt > 0)
+            turn.add_message(wa_id, "in", "text", body, wa_message_id=msg_id)
+
+            # Se pausado, humano responde
+            if turn.pause_bot:
+                with stage("persist"):
+                    await run_in_threadpool(turn.commit)
+                return
+
+            # Fluxo do tenant (compilado e em cache; só vai ao banco num miss)
+            flow = flows.registry.cached(tenant) or await run_in_threadpool(flows.registry.get, tenant)
+            # Catálogo pré-renderizado do tenant: só quando a resposta é o catálogo
+            catalog = None
+            if needs_catalog(wa_id, body, turn=turn, flow=flow):
+                catalog = catalog_cache.cached(tenant)
+                if catalog is None:
+                    catalog = await run_in_threadpool(catalog_cache.get, tenant)
+
+            # FSM (sem I/O: roda contra o turno)
+            with stage("next_reply"):
+                replies = next_replies(wa_id, body, turn=turn, flow=flow, catalog=catalog)
+            for reply in replies:
+                turn.add_message(wa_id, "out-bot", "text", reply)
+
+            with stage("persist"):
+                if await run_in_threadpool(turn.commit, True):
+                    break
+        else:
+            # Sessão mudando sem parar: guarda a mensagem e não responde
+            logging.warning(f"[session] {wa_id}: {SESSION_CONFLICT_RETRIES + 1} conflitos seguidos, sem resposta")
+            with stage("persist"):
+                await run_in_threadpool(add_message, wa_id, "in", "text", body, wa_message_id=msg_id)
+            return
+
+        # Envia em ordem; se uma falhar, ela e as seguintes vão para a outbox
+        failed = None
+        for reply in replies:
+            if failed is None:
+                result = await send_text(wa_id, reply)
+                if not result.ok:
+                    failed = result.error or result.body
+            if failed is not None:
+                turn.add_outbox(wa_id, reply, reason=failed)
+        if turn.dirty:
+            with stage("persist"):
+                await run_in_threadpool(turn.commit)
+
+    # NÃO TEXTO
+    else:
+        with stage("persist"):
+            await run_in_threadpool(
+                add_message, wa_id, "in", msg_type, "<conteúdo não-texto>", wa_message_id=msg_id
+            )
+        await send_text(
+            wa_id,
+            "Recebi seu arquivo/figura/áudio. No momento só entendo texto. 😊"
+        )
+
+
+async def handle_message(msg: dict):
+    # Avisa o journal quando a mensagem termina (ou falha, para o replay pegar)
+    try:
+        await process_message(msg)
+    except Exception:
+        event_journal.ack(msg, ok=False)
+        raise
+    event_journal.ack(msg)
+
+
+def drop_message(msg: dict):
+    # Prefilter falhou (banco fora?): evento fica sem marca e o replay entrega de novo
+    event_journal.ack(msg, ok=False)
+
+
+pipeline = WebhookPipeline(handler=handle_message, prefilter=dedupe_messages, on_drop=drop_message)
+
+
+async def dispatch_messages(msgs: list, timeout: float = None):
+    """
+    Entrega as mensagens à pipeline: fila (modo "queue") ou inline.
+    Levanta PipelineFull/PipelineClosed se a fila não aceitar.
+    """
+    if WEBHOOK_MODE == "queue" and pipeline.running:
+        if timeout is None:
+            await pipeline.submit(msgs)
+        else:
+            await pipeline.submit(msgs, timeout=timeout)
+    else:
+        await pipeline.run_inline(msgs)
+
+
 @app.post("/webhook")
 async def webhook_receive(request: Request):
-    data = await request.json()
-    logging.info(f"WEBHOOK EVENT: {data}")
+    t0 = time.perf_counter()
+    try:
+        return await _webhook_receive(request)
+    finally:
+        metrics.WEBHOOK_REQUEST_SECONDS.observe(time.perf_counter() - t0)
 
-    for entry in data.get("entry", []):
-        for change in entry.get("changes", []):
-            value = change.get("value", {})
 
-            for msg in value.get("messages", []):
-                wa_id = msg.get("from")
-                msg_id = msg.get("id")
-                msg_type = msg.get("type")
+async def _webhook_receive(request: Request):
+    with stage("parse"):
+        raw = await request.body()
+        data = json.loads(raw)
 
-                # Idempotência
-                if wa_id and msg_id and not mark_processed(msg_id, wa_id):
-                    continue
+    # 1º passo: journal durável (group commit) antes de qualquer processamento
+    event_id = None
+    if JOURNAL_ENABLED:
+        try:
+            with stage("journal"):
+                event_id = await event_journal.append(raw.decode("utf-8"))
+        except Exception:
+            logging.exception("[webhook] falha ao gravar journal, devolvendo 503")
+            return JSONResponse(status_code=503, content={"status": "BUSY"})
 
-                # TEXTO
-                if msg_type == "text":
-                    body = (msg.get("text") or {}).get("body", "").strip()
+    metrics.log_webhook_sample(data, event_id)
 
-                    add_message(wa_id, "in", "text", body, wa_message_id=msg_id)
+    msgs = tag_messages(event_id, data)
+    if event_id is not None:
+        event_journal.expect(event_id, len(msgs))
+    for m in msgs:
+        metrics.count_message(m.get("type"))
 
-                    # Se pausado, humano responde
-                    if get_pause_bot(wa_id):
-                        continue
+    try:
+        # Modo "queue": só enfileira e responde ao Meta na hora
+        # Modo "inline": processa dentro do request, em ordem por contato
+        await dispatch_messages(msgs)
+    except (PipelineFull, PipelineClosed):
+        # Backpressure: o Meta reenvia e a idempotência descarta o que já entrou
+        logging.warning("[webhook] pipeline cheia/parada, devolvendo 503")
+        if event_id is not None:
+            event_journal.discard(event_id)
+        return JSONResponse(status_code=503, content={"status": "BUSY"})
 
-                    # FSM
-                    reply = next_reply(wa_id, body)
-                    status, resp = send_text(wa_id, reply)
+    return {"status": "EVENT_RECEIVED"}
 
-                    add_message(wa_id, "out-bot", "text", reply)
 
-                    if status >= 400:
-                        add_outbox(wa_id, reply, reason=resp)
+async def replay_events(rows) -> dict:
+    """
+    Reinjeta eventos do journal na pipeline. Mensagens cujo turno já foi
+    gravado são descartadas no dedupe; as demais são processadas de novo
+    (at-least-once: um crash entre o envio e o commit pode repetir a resposta).
+    """
+    events = messages = 0
+    for event_id, payload in rows:
+        if event_journal.in_flight(event_id):
+            continue
+        msgs = tag_messages(event_id, payload, replay=True)
+        event_journal.expect(event_id, len(msgs))
+        try:
+            await dispatch_messages(msgs, timeout=30)
+        except (PipelineFull, PipelineClosed):
+            event_journal.discard(event_id)
+            logging.warning(f"[journal] replay interrompido no evento {event_id}: pipeline cheia/parada")
+            break
+        events += 1
+        messages += len(msgs)
+    event_journal.replayed_events += events
+    return {"events": events, "messages": messages}
+
+
+async def replay_unprocessed() -> dict:
+    total = {"events": 0, "messages": 0}
+    after_id = 0
+    while True:
+        rows = await run_in_threadpool(journal_load_unprocessed, JOURNAL_REPLAY_GRACE, after_id, 500)
+        if not rows:
+            break
+        after_id = rows[-1][0]
+        r = await replay_events(rows)
+        total["events"] += r["events"]
+        total["messages"] += r["messages"]
+    if total["events"]:
+        logging.info(f"[journal] replay: {total['events']} eventos, {total['messages']} mensagens")
+    return total
+
+
+journal_replayer = PeriodicTask("journal_replay", replay_unprocessed, interval=JOURNAL_REPLAY_GRACE)
+journal_pruner = PeriodicTask(
+    "prune_journal",
+    lambda: prune_journal(JOURNAL_RETENTION_DAYS),
+    interval=JOURNAL_PRUNE_INTERVAL,
+    initial_delay=120,
+)
 
-                # NÃO TEXTO
-                else:
-                    add_message(
-                        wa_id, "in", msg_type, "<conteúdo não-texto>", wa_message_id=msg_id
-                    )
-                    send_text(
-                        wa_id,
-                        "Recebi seu arquivo/figura/áudio. No momento só entendo texto. 😊"
-                    )
 
-    return {"status": "EVENT_RECEIVED"}
+# =======================================
+# MÉTRICAS (Prometheus)
+# =======================================
+@app.get("/metrics", include_in_schema=False)
+def metrics_endpoint(authorization: str = Header(default=None)):
+    # Opcional: protege o scrape com METRICS_TOKEN (Authorization: Bearer ...)
+    if metrics.METRICS_TOKEN and authorization != f"Bearer {metrics.METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    return Response(content=metrics.render_latest(), media_type=metrics.CONTENT_TYPE_LATEST)
+
+
+metrics.stats_collector.register("pipeline", lambda: pipeline.stats())
+metrics.stats_collector.register("idempotency_cache", lambda: recent_ids.stats())
+metrics.stats_collector.register("outbox_dispatcher", lambda: outbox_dispatcher.stats())
+metrics.stats_collector.register("ratelimit", lambda: send_limiter.stats(), labels={"numbers": "phone_number_id"})
+metrics.stats_collector.register("journal", lambda: event_journal.stats())
+metrics.stats_collector.register("db_pool", pool_stats)
+metrics.stats_collector.register("session_cache", session_cache.stats)
+metrics.stats_collector.register("flows", flows.registry.stats)
+metrics.stats_collector.register("catalog", catalog_cache.stats)
+metrics.stats_collector.register("public_catalog", public_catalog.stats)
+metrics.stats_collector.register("snapshots", snapshot_publisher.stats)
+metrics.stats_collector.register("menu_pages", menu_pages.stats)
+metrics.stats_collector.register("static_assets", static_assets.stats)
+metrics.stats_collector.register("images", image_pipeline.stats)
 
 
 # =======================================
@@ -306,15 +714,15 @@ async def inbox_send(wa_id: str, payload: dict = Body(...)):
     if not text:
         raise HTTPException(status_code=400, detail="texto vazio")
 
-    status, resp = send_text(wa_id, text)
+    result = await send_text(wa_id, text)
 
-    add_message(wa_id, "out-human", "text", text)
+    await run_in_threadpool(add_message, wa_id, "out-human", "text", text)
 
-    if status >= 400:
-        add_outbox(wa_id, text, reason=resp)
+    if not result.ok:
+        await run_in_threadpool(add_outbox, wa_id, text, reason=result.error or result.body)
         raise HTTPException(status_code=502, detail="falha ao enviar")
 
-    return {"status": "sent"}
+    return {"status": "sent", "message_id": result.message_id}
 
 
 @app.post("/inbox/pause/{wa_id}")
@@ -381,12 +789,13 @@ async def create_upload_url(
     put_url = presign_put_url(key=key, content_type=ct, expires_in=payload.expires_in)
     public_url = build_public_url(key)
 
-    # Log leve na outbox (sem quebrar o fluxo)
+    # Auditoria leve (sem quebrar o fluxo)
     try:
-        add_outbox(
-            wa_id="admin",
-            message=f"presign:{slug}:{key}",
-            reason=f"ct={ct}|exp={payload.expires_in}",
+        await run_in_threadpool(
+            add_audit,
+            "admin",
+            f"presign:{slug}:{key}",
+            f"ct={ct}|exp={payload.expires_in}",
         )
     except Exception:
         pass
@@ -399,6 +808,57 @@ async def create_upload_url(
         expires_in=payload.expires_in,
     )
 
+class UploadConfirmIn(BaseModel):
+    key: str = Field(..., description="Chave devolvida pelo upload-url")
+    product_id: int | None = Field(default=None, ge=1, description="Produto que passa a usar a foto")
+
+@app.post("/api/t/{slug}/uploads/confirm")
+async def confirm_upload(
+    slug: str,
+    payload: UploadConfirmIn,
+    admin_token: str = Header(..., alias="X-Admin-Token"),
+):
+    """
+    Chamado depois do PUT no R2: gera as variantes (miniatura e média, WebP
+    e JPEG) ao lado do original e, com product_id, grava foto + variantes
+    no produto. Retorna { key, public_url, variants, product }.
+    """
+    if ADMIN_TOKEN and admin_token != ADMIN_TOKEN:
+        raise HTTPException(status_code=401, detail="Token inválido")
+    key = payload.key.strip()
+    # Só chaves do próprio tenant, no formato do upload-url
+    if not key.startswith(f"{slug}/") or ".." in key or "/" in key[len(slug) + 1:]:
+        raise HTTPException(status_code=400, detail="Chave inválida para este tenant")
+    if not image_pipeline.available:
+        raise HTTPException(status_code=503, detail="Processamento de imagens indisponível (Pillow)")
+    # Produto conferido antes de subir variantes (id errado não deixa órfãos no R2)
+    if payload.product_id is not None:
+        if await run_in_threadpool(get_product, slug, payload.product_id) is None:
+            raise HTTPException(status_code=404, detail="Produto não encontrado")
+
+    try:
+        variants = await image_pipeline.process(key)
+    except ImageError as exc:
+        raise HTTPException(status_code=422, detail=str(exc))
+    except ObjectTooLarge as exc:
+        raise HTTPException(status_code=413, detail=str(exc))
+    except ClientError as exc:
+        if exc.response.get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+            raise HTTPException(status_code=404, detail="Upload não encontrado")
+        logging.exception(f"[images] falha ao processar {key}")
+        raise HTTPException(status_code=500, detail=f"Erro ao processar a imagem: {exc}")
+    except Exception as exc:
+        logging.exception(f"[images] falha ao processar {key}")
+        raise HTTPException(status_code=500, detail=f"Erro ao processar a imagem: {exc}")
+
+    public_url = build_public_url(key)
+    product = None
+    if payload.product_id is not None:
+        product = await run_in_threadpool(set_product_image, slug, payload.product_id, public_url, variants)
+        if product is None:
+            raise HTTPException(status_code=404, detail="Produto não encontrado")
+    return {"key": key, "public_url": public_url, "variants": variants, "product": product}
+
 # =========================
 # Products API (MVP) - Router isolado
 # =========================
@@ -409,7 +869,7 @@ async def create_upload_url(
 # - Compatível com o front (products.js) do Admin
 
 import os
-from typing import Optional, Any, Dict, List
+from typing import Optional, Any, Dict
 
 from fastapi import APIRouter, Depends, Header, HTTPException, Path, Query
 
@@ -468,6 +928,12 @@ class ProductUpdate(BaseModel):
     currency: Optional[str] = Field(default=None, pattern=CURRENCY_PATTERN)
     image_url: Optional[str] = None
 
+class BrandingUpdate(BaseModel):
+    # Marca do cardápio público (campos ausentes ficam como estão)
+    brand_name: Optional[str] = Field(default=None, max_length=120)
+    subtitle: Optional[str] = Field(default=None, max_length=200)
+    banner_url: Optional[str] = None
+
 # -------------------------
 # Helpers
 # -------------------------
@@ -493,21 +959,38 @@ def _404_if_none(row: Any, entity: str = "Produto") -> Any:
 def list_products_endpoint(
     slug: str = Path(..., description="tenant_slug"),
     limit: int = Query(50, ge=1, le=200),
-    offset: int = Query(0, ge=0),
+    offset: int = Query(0, ge=0, description="compatibilidade; prefira cursor"),
+    cursor: Optional[str] = Query(None, description="next_cursor da página anterior"),
+    after_id: Optional[int] = Query(None, ge=1),
+    q: Optional[str] = Query(None, max_length=200, description="busca (nome, SKU, descrição)"),
     _: None = Depends(require_admin_token),
 ) -> Dict[str, Any]:
     """
-    Lista produtos de um tenant com paginação.
-    Retorna: { items, total, limit, offset }
+    Lista produtos de um tenant com paginação por cursor.
+    Com `q`, busca ranqueada (cursor da própria busca; total = null).
+    Retorna: { items, total, limit, offset, next_cursor }
     """
     try:
-        items: List[Dict[str, Any]] = storage.list_products(tenant_slug=slug, limit=limit, offset=offset)  # type: ignore
-        total: int = storage.count_products(tenant_slug=slug)  # type: ignore
+        if q and q.strip():
+            try:
+                page = storage.search_products(tenant_slug=slug, q=q, limit=limit, cursor=cursor)  # type: ignore
+            except ValueError as exc:
+                raise HTTPException(status_code=400, detail=str(exc))
+            return {"items": page.items, "total": None, "limit": limit, "offset": 0,
+                    "next_cursor": page.next_cursor, "q": q}
+        try:
+            # Itens + total (contador mantido) numa ida ao banco
+            page = storage.page_products(  # type: ignore
+                tenant_slug=slug, limit=limit, cursor=cursor, after_id=after_id, offset=offset
+            )
+        except ValueError as exc:
+            raise HTTPException(status_code=400, detail=str(exc))
         return {
-            "items": items,
-            "total": total,
+            "items": page.items,
+            "total": page.total,
             "limit": limit,
             "offset": offset,
+            "next_cursor": page.next_cursor,
         }
     except HTTPException:
         raise
@@ -532,9 +1015,97 @@ def create_product_endpoint(
         return _404_if_none(created, "Produto")
     except HTTPException:
         raise
+    except UniqueViolation:
+        raise HTTPException(status_code=409, detail="Já existe um produto com este SKU")
     except Exception as exc:
         raise HTTPException(status_code=500, detail=f"Erro ao criar produto: {exc}")
 
+@router_products.get(
+    "/api/t/{slug}/branding",
+)
+def get_branding_endpoint(slug: str, _: None = Depends(require_admin_token)) -> Dict[str, Any]:
+    """
+    Marca do cardápio público (nome, subtítulo, banner).
+    """
+    row = storage.get_branding(slug)  # type: ignore
+    return row or {k: None for k in storage.BRANDING_FIELDS}  # type: ignore
+
+@router_products.put(
+    "/api/t/{slug}/branding",
+)
+def put_branding_endpoint(
+    slug: str,
+    body: BrandingUpdate,
+    _: None = Depends(require_admin_token),
+) -> Dict[str, Any]:
+    """
+    Atualiza a marca do cardápio; o HTML público é renderizado de novo.
+    """
+    try:
+        return storage.set_branding(slug, body.model_dump(exclude_unset=True))  # type: ignore
+    except Exception as exc:
+        raise HTTPException(status_code=500, detail=f"Erro ao salvar a marca: {exc}")
+
+@router_products.post(
+    "/api/t/{slug}/products/import",
+)
+async def import_products_endpoint(
+    request: Request,
+    slug: str = Path(..., description="tenant_slug"),
+    format: Optional[str] = Query(None, description="csv ou jsonl (padrão: pelo Content-Type)"),
+    dry_run: bool = Query(False, description="só valida; nada é gravado"),
+    _: None = Depends(require_admin_token),
+) -> Dict[str, Any]:
+    """
+    Import em massa (corpo cru em CSV com cabeçalho ou JSONL, um produto
+    por linha). Upsert por SKU; linhas inválidas voltam em `errors` com o
+    número da linha e não impedem as outras.
+    Retorna: { rows, valid, invalid, inserted, updated, unchanged, errors }
+    """
+    try:
+        fmt = bulk.detect_format(request.headers.get("content-type"), format)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    # Corpo vai para um arquivo temporário (memória até IMPORT_SPOOL_BYTES)
+    spool = tempfile.SpooledTemporaryFile(max_size=bulk.IMPORT_SPOOL_BYTES)
+    try:
+        size = 0
+        async for chunk in request.stream():
+            size += len(chunk)
+            if size > bulk.IMPORT_MAX_BYTES:
+                raise HTTPException(status_code=413, detail=f"arquivo acima de {bulk.IMPORT_MAX_BYTES} bytes")
+            spool.write(chunk)
+        spool.seek(0)
+        return await run_in_threadpool(bulk.import_stream, slug, spool, fmt, dry_run)
+    except HTTPException:
+        raise
+    except storage.DuplicateSkus as exc:
+        raise HTTPException(status_code=409, detail=str(exc))
+    except Exception as exc:
+        logging.exception(f"[import] falha no import de {slug}")
+        raise HTTPException(status_code=500, detail=f"Erro no import: {exc}")
+    finally:
+        spool.close()
+
+@router_products.get(
+    "/api/t/{slug}/products/export",
+)
+def export_products_endpoint(
+    slug: str = Path(..., description="tenant_slug"),
+    format: str = Query("csv", pattern="^(csv|jsonl)$"),
+    _: None = Depends(require_admin_token),
+):
+    """
+    Exporta o catálogo do tenant em CSV ou JSONL, em streaming (mesmas
+    colunas do import, mais o id).
+    """
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        storage.export_products(slug, format),  # type: ignore
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename={slug}-products.{format}"},
+    )
+
 @router_products.put(
     "/api/t/{slug}/products/{product_id}",
 )
@@ -555,6 +1126,8 @@ def update_product_endpoint(
         return _404_if_none(updated, "Produto")
     except HTTPException:
         raise
+    except UniqueViolation:
+        raise HTTPException(status_code=409, detail="Já existe um produto com este SKU")
     except Exception as exc:
         raise HTTPException(status_code=500, detail=f"Erro ao atualizar produto: {exc}")
 
@@ -579,5 +1152,154 @@ def delete_product_endpoint(
     except Exception as exc:
         raise HTTPException(status_code=500, detail=f"Erro ao remover produto: {exc}")
 
+# =========================
+# Admin: estado da pipeline do webhook
+# =========================
+@app.get("/admin/pipeline")
+def pipeline_stats_endpoint(_: None = Depends(require_admin_token)) -> Dict[str, Any]:
+    """
+    Nº de shards, profundidade das filas (total e por shard) e contadores.
+    """
+    return pipeline.stats()
+
+@app.get("/admin/idempotency")
+def idempotency_stats_endpoint(_: None = Depends(require_admin_token)) -> Dict[str, Any]:
+    """
+    Acertos/erros do cache de message_ids e estado da poda de processed_messages.
+    """
+    return {
+        "cache": recent_ids.stats(),
+        "pruner": {
+            **processed_pruner.stats(),
+            "retention_days": PROCESSED_RETENTION_DAYS,
+            "batch_size": PROCESSED_PRUNE_BATCH,
+        },
+    }
+
+@app.get("/admin/outbox")
+def outbox_stats_endpoint(_: None = Depends(require_admin_token)) -> Dict[str, Any]:
+    """
+    Fila de reenvio: contagem por status, atraso do pendente mais antigo e
+    vazão/contadores do dispatcher deste processo.
+    """
+    return {**outbox_stats(), "dispatcher": outbox_dispatcher.stats()}
+
+@app.get("/admin/ratelimit")
+def ratelimit_stats_endpoint(_: None = Depends(require_admin_token)) -> Dict[str, Any]:
+    """
+    Tokens disponíveis, fila e tempo de espera dos buckets de envio.
+    """
+    return send_limiter.stats()
+
+@app.get("/admin/journal")
+def journal_stats_endpoint(_: None = Depends(require_admin_token)) -> Dict[str, Any]:
+    """
+    Estado do journal: gravações agrupadas, eventos em voo e replays.
+    """
+    return {**event_journal.stats(), "replayer": journal_replayer.stats()}
+
+@app.get("/admin/db")
+def db_stats_endpoint(
+    reset: bool = Query(default=False),
+    _: None = Depends(require_admin_token),
+) -> Dict[str, Any]:
+    """
+    Pool do Postgres (tamanho, ociosas, fila, timeouts) e, por função do
+    storage, espera de checkout, tempo de query e linhas. reset=true zera o resumo.
+    """
+    out = {"pool": pool_stats(), "slow_query_ms": DB_SLOW_QUERY_MS, "queries": db_profiler.summary()}
+    if reset:
+        db_profiler.reset()
+    return out
+
+@app.get("/admin/sessions")
+def session_cache_stats_endpoint(_: None = Depends(require_admin_token)) -> Dict[str, Any]:
+    """
+    Cache de sessões da FSM (taxa de acerto, expirações, conflitos de versão)
+    e a varredura de sessões expiradas.
+    """
+    return {**session_cache.stats(), "sweeper": session_sweeper.stats()}
+
+@app.get("/admin/snapshots")
+def snapshots_stats_endpoint(_: None = Depends(require_admin_token)) -> Dict[str, Any]:
+    """Publicador de snapshots do cardápio (fila, publicações, erros)."""
+    return {**snapshot_publisher.stats(), "task": snapshot_task.stats()}
+
+@app.post("/admin/snapshots/{slug}")
+def publish_snapshot_endpoint(slug: str, _: None = Depends(require_admin_token)) -> Dict[str, Any]:
+    """
+    Publica o snapshot do tenant agora (ex.: primeira publicação de um
+    catálogo que já existia antes dos snapshots).
+    """
+    try:
+        version = snapshot_publisher.publish(slug)
+    except Exception as exc:
+        logging.exception(f"[snapshots] publicação manual de {slug} falhou")
+        raise HTTPException(status_code=502, detail=f"snapshot_failed: {exc}")
+    return {"tenant": slug, "published": version is not None, "version": version, "pointer": pointer_url(slug)}
+
+# =========================
+# Admin: fluxos de conversa por tenant
+# =========================
+@app.get("/admin/flows/{slug}")
+def get_flow_endpoint(slug: str, _: None = Depends(require_admin_token)) -> Dict[str, Any]:
+    """
+    Definição do fluxo do tenant (ou o fluxo padrão, se ele não tiver um).
+    """
+    row = storage.get_flow(slug)
+    if row is None:
+        return {"tenant": slug, "custom": False, "version": 0, "definition": flows.DEFAULT_FLOW}
+    definition, version = row
+    return {"tenant": slug, "custom": True, "version": version, "definition": definition}
+
+@app.put("/admin/flows/{slug}")
+def put_flow_endpoint(
+    slug: str,
+    definition: Dict[str, Any] = Body(...),
+    _: None = Depends(require_admin_token),
+) -> Dict[str, Any]:
+    """
+    Valida (compila) e grava o fluxo do tenant; o cache deste worker é
+    invalidado na hora, os demais pegam a nova versão em FLOW_CACHE_TTL.
+    """
+    try:
+        flows.CompiledFlow(definition, tenant=slug)
+    except flows.FlowError as exc:
+        raise HTTPException(status_code=400, detail=f"fluxo inválido: {exc}")
+    version = storage.save_flow(slug, definition)
+    flows.registry.invalidate(slug)
+    return {"tenant": slug, "version": version}
+
+@app.delete("/admin/flows/{slug}")
+def delete_flow_endpoint(slug: str, _: None = Depends(require_admin_token)) -> Dict[str, Any]:
+    """
+    Remove o fluxo próprio do tenant (volta ao padrão).
+    """
+    deleted = storage.delete_flow(slug)
+    flows.registry.invalidate(slug)
+    return {"tenant": slug, "deleted": deleted}
+
+
+class JournalReplayIn(BaseModel):
+    since: datetime
+    until: datetime
+    limit: int = Field(default=5000, ge=1, le=50000)
+
+
+@app.post("/admin/journal/replay")
+async def journal_replay_endpoint(
+    body: JournalReplayIn,
+    _: None = Depends(require_admin_token),
+) -> Dict[str, Any]:
+    """
+    Reexecuta os webhooks recebidos no intervalo [since, until).
+    Mensagens já concluídas são ignoradas; só o que ficou pela metade roda de novo.
+    """
+    if body.until <= body.since:
+        raise HTTPException(status_code=400, detail="until deve ser maior que since")
+    rows = await run_in_threadpool(journal_load_range, body.since, body.until, body.limit)
+    result = await replay_events(rows)
+    return {"found": len(rows), **result}
+
 # Registra o router no app principal
 app.include_router(router_products)
\ No newline at end of file
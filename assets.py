@@ -0,0 +1,236 @@
+# assets.py
+"""
+Pipeline dos arquivos estáticos (/static) com fingerprint e pré-compressão.
+
+No build (startup do app ou `python assets.py` no deploy) cada .js/.css/
+.svg de static/ vira uma cópia com o hash do conteúdo no nome, mais as
+variantes .gz/.br ao lado:
+
+    build/static/menu/menu.3f2a9c1b0d4e.js
+    build/static/menu/menu.3f2a9c1b0d4e.js.gz
+    build/static/menu/menu.3f2a9c1b0d4e.js.br
+
+As referências /static/... dos .html são reescritas para os nomes com hash
+(manifest.json guarda o mapa). O AssetFiles, montado em /static, serve a
+variante pelo Accept-Encoding com Cache-Control immutable: o nome muda
+quando o conteúdo muda, então o navegador/CDN nunca precisa revalidar. O
+HTML reescrito sai com no-cache + ETag (é ele que aponta para a versão).
+
+Caminhos sem hash continuam servidos direto de static/, como antes.
+Arquivos de builds anteriores ficam no diretório (HTML antigo em cache
+ainda aponta para eles); o diretório é descartável.
+"""
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from fastapi.responses import FileResponse, Response
+from fastapi.staticfiles import StaticFiles
+
+from precompress import compress_variants, etag_matches, pick_encoding
+
+_BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+ASSETS_BUILD = os.getenv("ASSETS_BUILD", "1").strip().lower() in ("1", "true", "yes")
+ASSETS_SOURCE_DIR = os.getenv("ASSETS_SOURCE_DIR", os.path.join(_BASE_DIR, "static"))
+ASSETS_DIR = os.getenv("ASSETS_DIR", os.path.join(_BASE_DIR, "build", "static"))
+ASSETS_URL_PREFIX = "/" + os.getenv("ASSETS_URL_PREFIX", "/static").strip("/")
+ASSETS_CACHE_CONTROL = os.getenv("ASSETS_CACHE_CONTROL", "public, max-age=31536000, immutable")
+ASSETS_HTML_CACHE_CONTROL = os.getenv("ASSETS_HTML_CACHE_CONTROL", "no-cache")
+
+HASH_LEN = 12
+FINGERPRINT_EXTS = (".js", ".css", ".svg")
+COMPRESS_EXTS = (".js", ".css", ".svg", ".html")
+_SUFFIX = {"gzip": ".gz", "br": ".br"}
+
+_REF_RE = re.compile(r"/static/([A-Za-z0-9_./-]+)")
+
+mimetypes.add_type("text/javascript", ".js")
+
+
+def media_type(path: str) -> str:
+    mt = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    if mt.startswith("text/") or mt in ("image/svg+xml", "application/json"):
+        mt += "; charset=utf-8"
+    return mt
+
+
+def fingerprint(rel_path: str, data: bytes) -> str:
+    """menu/menu.js → menu/menu.<hash>.js"""
+    root, ext = os.path.splitext(rel_path)
+    return f"{root}.{hashlib.sha256(data).hexdigest()[:HASH_LEN]}{ext}"
+
+
+def _write(path: str, data: bytes) -> None:
+    """Escrita atômica (vários workers podem fazer o build ao mesmo tempo)."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+class AssetPipeline:
+    """Build + manifest dos estáticos; consultado pelo AssetFiles e pelo menupage."""
+
+    def __init__(self, source_dir: str = ASSETS_SOURCE_DIR, out_dir: str = ASSETS_DIR,
+                 url_prefix: str = ASSETS_URL_PREFIX):
+        self.source_dir = source_dir
+        self.out_dir = out_dir
+        self.url_prefix = url_prefix
+        self.manifest: Dict[str, str] = {}      # menu/menu.js → menu/menu.<hash>.js
+        self.files: Dict[str, tuple] = {}       # com hash → variantes disponíveis
+        self.pages: Dict[str, Dict[str, Any]] = {}  # html reescrito → {etag, bodies}
+        self.built_at: Optional[float] = None
+        self.build_ms = 0.0
+        self.written = 0
+        self.served: Dict[str, int] = {"identity": 0, "gzip": 0, "br": 0}
+
+    def _walk(self):
+        for root, dirs, names in os.walk(self.source_dir):
+            dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+            for name in sorted(names):
+                full = os.path.join(root, name)
+                yield os.path.relpath(full, self.source_dir).replace(os.sep, "/"), full
+
+    def _emit(self, rel_path: str, data: bytes, compress: bool) -> tuple:
+        """Grava o arquivo e as variantes que ainda não existem; retorna as variantes."""
+        dest = os.path.join(self.out_dir, rel_path)
+        variants = compress_variants(data) if compress else {"identity": data}
+        for enc, body in variants.items():
+            path = dest + _SUFFIX.get(enc, "")
+            if os.path.isfile(path) and os.path.getsize(path) == len(body):
+                with open(path, "rb") as f:
+                    if f.read() == body:
+                        continue
+            _write(path, body)
+            self.written += 1
+        return tuple(variants)
+
+    def rewrite(self, text: str) -> str:
+        """Troca /static/x.js por /static/x.<hash>.js (o que não está no manifest fica igual)."""
+        def sub(m):
+            hashed = self.manifest.get(m.group(1))
+            return f"{self.url_prefix}/{hashed}" if hashed else m.group(0)
+
+        return _REF_RE.sub(sub, text)
+
+    def build(self) -> Dict[str, Any]:
+        t0 = time.perf_counter()
+        manifest, files, pages, html_files = {}, {}, {}, []
+        for rel, full in self._walk():
+            ext = os.path.splitext(rel)[1].lower()
+            if ext == ".html":
+                html_files.append((rel, full))
+            elif ext in FINGERPRINT_EXTS:
+                with open(full, "rb") as f:
+                    data = f.read()
+                hashed = fingerprint(rel, data)
+                files[hashed] = self._emit(hashed, data, ext in COMPRESS_EXTS)
+                manifest[rel] = hashed
+        self.manifest = manifest
+        # HTML depois do manifest completo: as referências já apontam para os hashes
+        for rel, full in html_files:
+            with open(full, encoding="utf-8") as f:
+                data = self.rewrite(f.read()).encode("utf-8")
+            self._emit(rel, data, compress=False)
+            pages[rel] = {
+                "etag": f'"h{hashlib.sha256(data).hexdigest()[:HASH_LEN]}"',
+                "bodies": compress_variants(data),
+            }
+        _write(os.path.join(self.out_dir, "manifest.json"),
+               json.dumps(manifest, indent=2, sort_keys=True).encode("utf-8"))
+        self.files, self.pages = files, pages
+        self.built_at = time.time()
+        self.build_ms = round((time.perf_counter() - t0) * 1000, 1)
+        logging.info(f"[assets] {len(files)} arquivos com hash, {len(pages)} html em {self.build_ms}ms")
+        return {"files": len(files), "pages": len(pages), "written": self.written, "build_ms": self.build_ms}
+
+    def built_path(self, source_path: str) -> str:
+        """Caminho do HTML reescrito (ou o original, se não houve build)."""
+        rel = os.path.relpath(source_path, self.source_dir).replace(os.sep, "/")
+        if rel in self.pages:
+            return os.path.join(self.out_dir, rel)
+        return source_path
+
+    def url(self, rel_path: str) -> str:
+        return f"{self.url_prefix}/{self.manifest.get(rel_path, rel_path)}"
+
+    def response(self, rel_path: str, accept_encoding: Optional[str],
+                 if_none_match: Optional[str] = None) -> Optional[Response]:
+        """Resposta para um arquivo do build; None se o caminho não é do build."""
+        if rel_path in self.files:
+            encoding = pick_encoding(accept_encoding, self.files[rel_path])
+            headers = {"Cache-Control": ASSETS_CACHE_CONTROL, "Vary": "Accept-Encoding"}
+            if encoding != "identity":
+                headers["Content-Encoding"] = encoding
+            self.served[encoding] += 1
+            return FileResponse(
+                os.path.join(self.out_dir, rel_path) + _SUFFIX.get(encoding, ""),
+                media_type=media_type(rel_path), headers=headers,
+            )
+        page = self.pages.get(rel_path)
+        if page is not None:
+            encoding = pick_encoding(accept_encoding, page["bodies"])
+            etag = page["etag"] if encoding == "identity" else f'{page["etag"][:-1]}-{encoding}"'
+            headers = {"ETag": etag, "Cache-Control": ASSETS_HTML_CACHE_CONTROL, "Vary": "Accept-Encoding"}
+            if etag_matches(if_none_match, etag):
+                return Response(status_code=304, headers=headers)
+            if encoding != "identity":
+                headers["Content-Encoding"] = encoding
+            self.served[encoding] += 1
+            return Response(page["bodies"][encoding], media_type=media_type(rel_path), headers=headers)
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        sizes: Dict[str, int] = {"identity": 0, "gzip": 0, "br": 0}
+        for hashed, variants in self.files.items():
+            base = os.path.join(self.out_dir, hashed)
+            for enc in variants:
+                try:
+                    sizes[enc] += os.path.getsize(base + _SUFFIX.get(enc, ""))
+                except OSError:
+                    pass
+        return {
+            "enabled": ASSETS_BUILD,
+            "files": len(self.files),
+            "pages": len(self.pages),
+            "built_at": self.built_at,
+            "build_ms": self.build_ms,
+            "written": self.written,
+            "bytes": sizes,
+            "served": dict(self.served),
+        }
+
+
+class AssetFiles(StaticFiles):
+    """StaticFiles que serve primeiro o build (hash/pré-comprimido) e depois static/."""
+
+    def __init__(self, *args, pipeline: AssetPipeline, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pipeline = pipeline
+
+    async def get_response(self, path: str, scope) -> Response:
+        if scope["method"] in ("GET", "HEAD"):
+            headers = {k.decode("latin-1"): v.decode("latin-1") for k, v in scope.get("headers", [])}
+            response = self.pipeline.response(
+                path.replace(os.sep, "/"), headers.get("accept-encoding"), headers.get("if-none-match")
+            )
+            if response is not None:
+                return response
+        return await super().get_response(path, scope)
+
+
+static_assets = AssetPipeline()
+
+
+if __name__ == "__main__":
+    # Build no deploy: python assets.py
+    logging.basicConfig(level=logging.INFO)
+    print(json.dumps(static_assets.build(), indent=2))
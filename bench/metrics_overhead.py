@@ -0,0 +1,72 @@
+# bench/metrics_overhead.py
+"""
+Mede o custo da instrumentação (metrics.py) por request do webhook: as
+etapas cronometradas, os contadores e o sorteio do log amostrado, sem I/O.
+
+Falha (exit 1) se passar de METRICS_OVERHEAD_BUDGET_US por request.
+
+Uso:
+    python bench/metrics_overhead.py --requests 50000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import metrics
+from metrics import stage
+
+STAGES = ("parse", "journal", "idempotency", "pause_check", "next_reply", "send", "persist")
+
+PAYLOAD = {
+    "object": "whatsapp_business_account",
+    "entry": [{"changes": [{"value": {"messages": [{"from": "5511999999999", "id": "wamid.x", "type": "text"}]}}]}],
+}
+
+
+def one_request() -> None:
+    t0 = time.perf_counter()
+    for name in STAGES:
+        with stage(name):
+            pass
+    metrics.log_webhook_sample(PAYLOAD, 1)
+    metrics.count_message("text")
+    metrics.count_send(200)
+    metrics.WEBHOOK_REQUEST_SECONDS.observe(time.perf_counter() - t0)
+
+
+def baseline() -> None:
+    for _ in STAGES:
+        pass
+
+
+def measure(fn, n: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - t0) / n * 1e6
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--requests", type=int, default=50000)
+    ap.add_argument("--budget-us", type=float, default=metrics.METRICS_OVERHEAD_BUDGET_US)
+    args = ap.parse_args()
+
+    measure(one_request, 1000)  # aquece (cria os filhos dos labels)
+    base = measure(baseline, args.requests)
+    instrumented = measure(one_request, args.requests)
+    overhead = instrumented - base
+
+    print(f"requests={args.requests} sample_rate={metrics.WEBHOOK_LOG_SAMPLE_RATE}")
+    print(f"overhead por request: {overhead:.2f}us (orçamento {args.budget_us:g}us)")
+    if overhead > args.budget_us:
+        print("ACIMA DO ORÇAMENTO")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,141 @@
+# bench/replay_fsm.py
+"""
+Replay offline do engine (só CPU, sem Postgres nem Cloud API).
+
+Empurra conversas pelo next_reply contra um stores.MemoryStore e mede
+mensagens/s. Fontes:
+
+    --source synthetic   conversas geradas (padrão; não precisa de banco)
+    --source file        JSONL com {"wa_id": ..., "text": ...} por linha
+    --source db          mensagens 'in' de texto gravadas em messages (DATABASE_URL)
+
+--golden FILE grava as respostas na primeira execução e, nas seguintes,
+compara e sai com erro se alguma mudou (regressão do fluxo).
+
+Uso:
+    python bench/replay_fsm.py --contacts 2000
+    python bench/replay_fsm.py --source db --limit 50000 --golden /tmp/fsm.golden
+    python bench/replay_fsm.py --flow meu_fluxo.json
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import sys
+import time
+from typing import Iterator, List, Tuple
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import flows
+from engine import next_reply
+from stores import MemoryStore
+
+# Palavras que percorrem o fluxo padrão (inclui comandos globais e ruído)
+VOCAB = [
+    "oi", "1", "2", "3", "Preços", "opcoes", "15/02", "20/03", "festa", "presente",
+    "50", "100", "200", "não", "tema azul", "sim", "ok", "ajuda", "cancelar", "menu", "?",
+]
+
+
+def synthetic(contacts: int, length: int, seed: int) -> Iterator[Tuple[str, str]]:
+    rnd = random.Random(seed)
+    happy = ["oi", "1", "15/02", "festa", "100", "não", "sim"]
+    for i in range(contacts):
+        wa_id = f"5511{i:08d}"
+        # Metade segue o caminho feliz, metade manda texto aleatório
+        script = happy if i % 2 == 0 else [rnd.choice(VOCAB) for _ in range(length)]
+        for text in script:
+            yield wa_id, text
+
+
+def from_file(path: str) -> Iterator[Tuple[str, str]]:
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                row = json.loads(line)
+                yield str(row["wa_id"]), row.get("text") or ""
+
+
+def from_db(limit: int) -> List[Tuple[str, str]]:
+    import storage
+
+    with storage.get_conn() as conn:
+        with conn.cursor() as c:
+            c.execute(
+                """
+                SELECT wa_id, body FROM messages
+                WHERE direction = 'in' AND msg_type = 'text'
+                ORDER BY id
+                LIMIT %s
+                """,
+                (limit,),
+            )
+            return [(w, b or "") for w, b in c.fetchall()]
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--source", choices=["synthetic", "file", "db"], default="synthetic")
+    ap.add_argument("--file")
+    ap.add_argument("--contacts", type=int, default=2000)
+    ap.add_argument("--length", type=int, default=10)
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--limit", type=int, default=100000)
+    ap.add_argument("--flow", help="JSON com a definição do fluxo (padrão: flows.DEFAULT_FLOW)")
+    ap.add_argument("--golden", help="arquivo de respostas esperadas (grava se não existir)")
+    args = ap.parse_args()
+
+    if args.source == "file":
+        if not args.file:
+            ap.error("--source file exige --file")
+        messages = list(from_file(args.file))
+    elif args.source == "db":
+        messages = from_db(args.limit)
+    else:
+        messages = list(synthetic(args.contacts, args.length, args.seed))
+
+    if args.flow:
+        with open(args.flow, encoding="utf-8") as f:
+            flow = flows.CompiledFlow(json.load(f))
+    else:
+        flow = flows.registry.default
+
+    store = MemoryStore()
+    replies: List[str] = []
+    t0 = time.perf_counter()
+    for wa_id, text in messages:
+        replies.append(next_reply(wa_id, text, turn=store, flow=flow))
+    elapsed = time.perf_counter() - t0
+
+    n = len(messages)
+    print(f"mensagens={n} contatos={len({w for w, _ in messages})} pedidos={len(store.orders)}")
+    print(f"tempo={elapsed:.3f}s vazão={n / elapsed if elapsed else 0:,.0f} msg/s "
+          f"({elapsed / n * 1e6 if n else 0:.1f}us/msg)")
+
+    digest = hashlib.sha256("\x1e".join(replies).encode("utf-8")).hexdigest()
+    print(f"digest={digest}")
+    if args.golden:
+        if not os.path.exists(args.golden):
+            with open(args.golden, "w", encoding="utf-8") as f:
+                for (wa_id, text), reply in zip(messages, replies):
+                    f.write(json.dumps({"wa_id": wa_id, "text": text, "reply": reply}, ensure_ascii=False) + "\n")
+            print(f"golden gravado em {args.golden}")
+            return 0
+        with open(args.golden, encoding="utf-8") as f:
+            expected = [json.loads(line) for line in f if line.strip()]
+        if len(expected) != n:
+            print(f"REGRESSÃO: golden tem {len(expected)} mensagens, replay tem {n}")
+            return 1
+        for i, (exp, reply) in enumerate(zip(expected, replies)):
+            if exp["reply"] != reply:
+                print(f"REGRESSÃO na mensagem {i} ({exp['wa_id']}: {exp['text']!r})")
+                print(f"  esperado: {exp['reply']!r}\n  obtido:   {reply!r}")
+                return 1
+        print("golden OK")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
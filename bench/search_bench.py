@@ -0,0 +1,137 @@
+# bench/search_bench.py
+"""
+Latência da busca de produtos (storage.search_products) num catálogo
+grande, contra o Postgres de DATABASE_URL.
+
+Gera --products produtos num tenant próprio (nomes/descrições sintéticos
+de confeitaria, com acentos), roda cada consulta --repeat vezes e mostra
+p50/p95, o tamanho da primeira página e o plano da consulta (o índice GIN
+de search_vector deve aparecer). Compara com o ILIKE '%termo%' que seria a
+alternativa sem índice.
+
+Uso:
+    python bench/search_bench.py --products 100000 --repeat 30
+    python bench/search_bench.py --keep   # não apaga o tenant no final
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import storage
+from dbprofile import profiler
+
+BASES = ["Bolo", "Brigadeiro", "Beijinho", "Torta", "Pão de mel", "Cupcake", "Trufa", "Cookie",
+         "Mousse", "Pudim", "Quindim", "Bem-casado", "Palha italiana", "Macaron", "Cheesecake"]
+FLAVORS = ["chocolate", "limão", "maracujá", "morango", "coco", "doce de leite", "nozes", "pistache",
+           "café", "açaí", "amêndoas", "frutas vermelhas", "caramelo salgado", "ninho", "paçoca"]
+EXTRAS = ["gourmet", "tradicional", "zero açúcar", "sem glúten", "vegano", "recheado", "mini", "festa"]
+
+QUERIES = [
+    "brigadeiro",          # termo comum
+    "maracuja",            # sem acento → maracujá
+    "bolo chocolate",      # dois termos
+    "pist",                # prefixo
+    "brigadero",           # erro de digitação (só com pg_trgm)
+    "palha italiana nozes",
+]
+
+
+def seed(tenant: str, n: int) -> None:
+    rnd = random.Random(42)
+    rows = []
+    for i in range(n):
+        name = f"{rnd.choice(BASES)} de {rnd.choice(FLAVORS)} {rnd.choice(EXTRAS)}"
+        desc = f"{rnd.choice(BASES)} artesanal com {rnd.choice(FLAVORS)} e {rnd.choice(FLAVORS)}."
+        rows.append((tenant, f"SKU-{i:06d}", name, desc, rnd.randint(500, 20000)))
+    t0 = time.perf_counter()
+    with storage.get_conn() as conn:
+        with conn.cursor() as c:
+            with c.copy("COPY products (tenant_slug, sku, name, description, price_cents) FROM STDIN") as cp:
+                for r in rows:
+                    cp.write_row(r)
+            c.execute("ANALYZE products")
+        conn.commit()
+    print(f"seed: {n} produtos em {time.perf_counter() - t0:.1f}s")
+
+
+def timed(fn, repeat: int) -> list:
+    out = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        out.append((time.perf_counter() - t0) * 1000)
+    return out
+
+
+def pct(values: list, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def ilike(tenant: str, q: str):
+    with storage.get_conn() as conn:
+        with conn.cursor() as c:
+            c.execute(
+                "SELECT id FROM products WHERE tenant_slug = %s AND (name ILIKE %s OR description ILIKE %s) "
+                "ORDER BY id DESC LIMIT 21",
+                (tenant, f"%{q}%", f"%{q}%"),
+            )
+            return c.fetchall()
+
+
+def explain(tenant: str, q: str) -> str:
+    terms = storage._search_terms(q)
+    with storage.get_conn() as conn:
+        with conn.cursor() as c:
+            c.execute(
+                "EXPLAIN SELECT id FROM products, to_tsquery('portuguese', %s) query "
+                "WHERE tenant_slug = %s AND search_vector @@ query",
+                (" & ".join(f"{t}:*" for t in terms), tenant),
+            )
+            plan = [r[0] for r in c.fetchall()]
+    return next((line.strip() for line in plan if "idx_products" in line), plan[0].strip())
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--products", type=int, default=100_000)
+    ap.add_argument("--repeat", type=int, default=30)
+    ap.add_argument("--keep", action="store_true")
+    args = ap.parse_args()
+
+    profiler.slow_s = 0  # o ILIKE de comparação é lento de propósito
+    storage.migrate_product_search()
+    print(f"extensões: {sorted(storage._search_features()) or 'nenhuma (sem trigramas, unaccent via translate)'}")
+    tenant = f"bench-search-{uuid.uuid4().hex[:8]}"
+    seed(tenant, args.products)
+    try:
+        print(f"{'consulta':<24}{'itens':>6}{'p50 ms':>9}{'p95 ms':>9}{'ilike p50':>11}  plano")
+        for q in QUERIES:
+            page = storage.search_products(tenant, q, limit=20)
+            lat = timed(lambda: storage.search_products(tenant, q, limit=20), args.repeat)
+            base = timed(lambda: ilike(tenant, q), max(3, args.repeat // 5))
+            print(f"{q:<24}{len(page.items):>6}{statistics.median(lat):>9.2f}{pct(lat, 0.95):>9.2f}"
+                  f"{statistics.median(base):>11.2f}  {explain(tenant, q)}")
+        # Página funda: segue o cursor 5 vezes
+        page, hops = storage.search_products(tenant, "bolo", limit=20), 0
+        t0 = time.perf_counter()
+        while page.next_cursor and hops < 5:
+            page = storage.search_products(tenant, "bolo", limit=20, cursor=page.next_cursor)
+            hops += 1
+        print(f"cursor: {hops} páginas seguintes de 'bolo' em {(time.perf_counter() - t0) * 1000:.1f}ms")
+    finally:
+        if not args.keep:
+            with storage.get_conn() as conn:
+                with conn.cursor() as c:
+                    c.execute("DELETE FROM products WHERE tenant_slug = %s", (tenant,))
+                conn.commit()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+# bench/send_bench.py
+"""
+Compara o envio antigo (requests.post por chamada) com o WhatsAppClient
+(pool keep-alive) contra um mock local da Graph API.
+
+Uso:
+    python bench/send_bench.py --messages 500 --concurrency 20
+    python bench/send_bench.py --base-url http://127.0.0.1:9000   # mock externo
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import requests
+import uvicorn
+from fastapi import FastAPI
+
+from whatsapp import WhatsAppClient
+
+
+def _mock_app(latency_ms: float) -> FastAPI:
+    mock = FastAPI()
+
+    @mock.post("/{version}/{phone_id}/messages")
+    async def messages(version: str, phone_id: str):
+        if latency_ms:
+            await asyncio.sleep(latency_ms / 1000)
+        return {"messaging_product": "whatsapp", "messages": [{"id": "wamid.mock"}]}
+
+    return mock
+
+
+def _start_mock(port: int, latency_ms: float) -> uvicorn.Server:
+    config = uvicorn.Config(_mock_app(latency_ms), host="127.0.0.1", port=port, log_level="warning")
+    server = uvicorn.Server(config)
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+def _summary(name: str, lat: list, elapsed: float) -> None:
+    lat_ms = sorted(x * 1000 for x in lat)
+    p95 = lat_ms[int(len(lat_ms) * 0.95) - 1]
+    print(
+        f"{name:<22} n={len(lat_ms):<5} p50={statistics.median(lat_ms):7.2f}ms "
+        f"p95={p95:7.2f}ms  {len(lat_ms) / elapsed:8.1f} msg/s"
+    )
+
+
+def bench_requests(url: str, n: int, concurrency: int) -> None:
+    payload = {"messaging_product": "whatsapp", "to": "5511999999999", "type": "text", "text": {"body": "oi"}}
+    headers = {"Authorization": "Bearer x", "Content-Type": "application/json"}
+
+    def one(_):
+        t0 = time.perf_counter()
+        requests.post(url, headers=headers, json=payload, timeout=20)
+        return time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as ex:
+        lat = list(ex.map(one, range(n)))
+    _summary("requests.post/call", lat, time.perf_counter() - t0)
+
+
+async def bench_client(base_url: str, n: int, concurrency: int, http2: bool) -> None:
+    client = WhatsAppClient(access_token="x", phone_number_id="123", base_url=base_url, http2=http2)
+    sem = asyncio.Semaphore(concurrency)
+    lat = []
+
+    async def one():
+        async with sem:
+            t0 = time.perf_counter()
+            await client.send_text("5511999999999", "oi")
+            lat.append(time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(n)))
+    elapsed = time.perf_counter() - t0
+    await client.aclose()
+    _summary("WhatsAppClient" + (" (h2)" if client.http2 else ""), lat, elapsed)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--messages", type=int, default=500)
+    ap.add_argument("--concurrency", type=int, default=20)
+    ap.add_argument("--latency-ms", type=float, default=5.0, help="latência simulada do mock")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--base-url", default=None, help="usa um mock já em execução")
+    ap.add_argument("--http2", action="store_true")
+    args = ap.parse_args()
+
+    base_url = args.base_url
+    if not base_url:
+        _start_mock(args.port, args.latency_ms)
+        base_url = f"http://127.0.0.1:{args.port}"
+
+    bench_requests(f"{base_url}/v22.0/123/messages", args.messages, args.concurrency)
+    asyncio.run(bench_client(base_url, args.messages, args.concurrency, args.http2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+# bench/session_bench.py
+"""
+Latência por mensagem do turno da FSM (begin_turn + next_reply + commit
+com conferência de versão, como no app) com e sem o session_cache, contra
+o Postgres de DATABASE_URL. Sem cache são duas idas ao banco por mensagem
+(leitura + commit); com acerto de cache, só o commit.
+
+O Postgres local responde em ~0,1ms; use --rtt-ms para simular a ida e
+volta até o Neon (aplicada a cada checkout do pool).
+
+Cada contato manda uma conversa completa (menu → encomenda → confirmação),
+então a maioria das leituras depois da primeira mensagem é acerto de cache.
+
+Uso:
+    python bench/session_bench.py --contacts 50 --rtt-ms 8
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+import uuid
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import storage
+from engine import next_reply
+from sessioncache import session_cache
+
+CONVERSATION = ["oi", "1", "15/02", "caixa presente", "2", "sem glúten", "1"]
+
+
+def with_rtt(get_conn, rtt_ms: float):
+    @contextmanager
+    def slow_get_conn():
+        time.sleep(rtt_ms / 1000)
+        with get_conn() as conn:
+            yield conn
+    return slow_get_conn
+
+
+def run(contacts: int, cache_size: int) -> tuple:
+    session_cache.maxsize = cache_size
+    prefix = f"bench-{uuid.uuid4().hex[:8]}-"
+    latencies = []
+    checkouts0 = storage.pool.get_stats().get("requests_num", 0)
+    for i in range(contacts):
+        wa_id = f"{prefix}{i}"
+        for text in CONVERSATION:
+            t0 = time.perf_counter()
+            turn = storage.begin_turn(wa_id)
+            turn.add_message(wa_id, "in", "text", text)
+            reply = next_reply(wa_id, text, turn=turn)
+            turn.add_message(wa_id, "out-bot", "text", reply)
+            turn.commit(check_version=True)
+            latencies.append((time.perf_counter() - t0) * 1000)
+    checkouts = storage.pool.get_stats().get("requests_num", 0) - checkouts0
+    _cleanup(prefix)
+    return latencies, checkouts
+
+
+def _cleanup(prefix: str) -> None:
+    with storage.get_conn() as conn:
+        with conn.cursor() as c:
+            for table in ("sessions", "messages", "orders"):
+                c.execute(f"DELETE FROM {table} WHERE wa_id LIKE %s", (prefix + "%",))
+        conn.commit()
+
+
+def report(label: str, result: tuple) -> None:
+    lat, checkouts = result
+    lat = sorted(lat)
+    p95 = lat[int(len(lat) * 0.95) - 1]
+    print(
+        f"{label:<12} n={len(lat)} média={statistics.mean(lat):.2f}ms p50={statistics.median(lat):.2f}ms "
+        f"p95={p95:.2f}ms idas_ao_banco/msg={checkouts / len(lat):.2f}"
+    )
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--contacts", type=int, default=50)
+    ap.add_argument("--rtt-ms", type=float, default=0.0)
+    args = ap.parse_args()
+
+    storage.init_db()
+    size = session_cache.maxsize or 10000
+    run(5, 0)  # aquece o pool
+    if args.rtt_ms:
+        storage.get_conn = with_rtt(storage.get_conn, args.rtt_ms)
+
+    report("sem cache", run(args.contacts, 0))
+    report("com cache", run(args.contacts, size))
+    print(f"cache: {session_cache.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+# bulk.py
+"""
+Import/export em massa do catálogo (CSV ou JSONL).
+
+O upload chega num arquivo temporário (memória até IMPORT_SPOOL_BYTES,
+depois disco); aqui ele é lido linha a linha, cada registro é validado e
+os válidos seguem como gerador para storage.import_products (COPY numa
+tabela temporária + upsert por SKU). Registros inválidos viram erros com o
+número da linha e não impedem o resto do import.
+
+Colunas: sku (obrigatório, chave do upsert), name, price_cents, e
+opcionais description, currency (padrão BRL) e image_url.
+"""
+import csv
+import io
+import json
+import os
+import re
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+import storage
+
+IMPORT_MAX_BYTES = int(os.getenv("IMPORT_MAX_BYTES", str(50 * 1024 * 1024)))
+IMPORT_SPOOL_BYTES = int(os.getenv("IMPORT_SPOOL_BYTES", str(4 * 1024 * 1024)))
+IMPORT_MAX_ERRORS = int(os.getenv("IMPORT_MAX_ERRORS", "1000"))  # erros listados na resposta
+
+CURRENCY_RE = re.compile(r"^[A-Z]{3}$")
+FORMATS = ("csv", "jsonl")
+
+# Content-Type → formato (quando ?format= não vem)
+_CONTENT_TYPES = {
+    "text/csv": "csv",
+    "application/csv": "csv",
+    "application/x-ndjson": "jsonl",
+    "application/jsonl": "jsonl",
+    "application/json-seq": "jsonl",
+}
+
+
+def detect_format(content_type: Optional[str], fmt: Optional[str] = None) -> str:
+    if fmt:
+        fmt = fmt.lower()
+        if fmt not in FORMATS:
+            raise ValueError(f"formato '{fmt}' inválido (use csv ou jsonl)")
+        return fmt
+    base = (content_type or "").split(";")[0].strip().lower()
+    return _CONTENT_TYPES.get(base, "csv")
+
+
+class ImportReport:
+    def __init__(self, max_errors: int = IMPORT_MAX_ERRORS):
+        self.max_errors = max_errors
+        self.rows = 0
+        self.valid = 0
+        self.invalid = 0
+        self.errors: List[Dict[str, Any]] = []
+        self.result: Dict[str, Any] = {}
+
+    def error(self, line: int, sku: Any, message: str) -> None:
+        self.invalid += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({"line": line, "sku": sku, "error": message})
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "rows": self.rows,
+            "valid": self.valid,
+            "invalid": self.invalid,
+            **self.result,
+            "errors": self.errors,
+            "errors_truncated": self.invalid > len(self.errors),
+        }
+
+
+def iter_records(stream: BinaryIO, fmt: str) -> Iterator[Tuple[int, Optional[dict], Optional[str]]]:
+    """(linha, registro, erro de parse) — um por linha de dados."""
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    if fmt == "csv":
+        reader = csv.DictReader(text)
+        for record in reader:
+            yield reader.line_num, record, None
+        return
+    for line_no, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as exc:
+            yield line_no, None, f"JSON inválido: {exc}"
+            continue
+        if not isinstance(record, dict):
+            yield line_no, None, "cada linha deve ser um objeto JSON"
+            continue
+        yield line_no, record, None
+
+
+def _text(value: Any) -> Optional[str]:
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def validate(record: dict) -> Tuple[Optional[tuple], Optional[str]]:
+    """Tupla na ordem de storage.BULK_FIELDS, ou a mensagem de erro."""
+    sku = _text(record.get("sku"))
+    if not sku:
+        return None, "sku obrigatório"
+    name = _text(record.get("name"))
+    if not name:
+        return None, "name obrigatório"
+    raw_price = record.get("price_cents")
+    try:
+        if isinstance(raw_price, bool) or raw_price is None or str(raw_price).strip() == "":
+            raise ValueError
+        price = int(str(raw_price).strip())
+    except ValueError:
+        return None, "price_cents deve ser inteiro"
+    if price < 0:
+        return None, "price_cents deve ser >= 0"
+    currency = (_text(record.get("currency")) or "BRL").upper()
+    if not CURRENCY_RE.match(currency):
+        return None, "currency deve ter 3 letras (ex.: BRL)"
+    return (sku, name, _text(record.get("description")), price, currency, _text(record.get("image_url"))), None
+
+
+def valid_rows(records: Iterator[Tuple[int, Optional[dict], Optional[str]]], report: ImportReport) -> Iterator[tuple]:
+    """Filtra os registros válidos e anota os erros (SKU repetido no arquivo: vale o primeiro)."""
+    seen = set()
+    for line, record, parse_error in records:
+        report.rows += 1
+        if parse_error:
+            report.error(line, None, parse_error)
+            continue
+        row, error = validate(record)
+        if error:
+            report.error(line, record.get("sku"), error)
+            continue
+        if row[0] in seen:
+            report.error(line, row[0], "sku repetido no arquivo")
+            continue
+        seen.add(row[0])
+        report.valid += 1
+        yield row
+
+
+def import_stream(tenant_slug: str, stream: BinaryIO, fmt: str, dry_run: bool = False) -> Dict[str, Any]:
+    report = ImportReport()
+    report.result = storage.import_products(tenant_slug, valid_rows(iter_records(stream, fmt), report), dry_run=dry_run)
+    report.result["dry_run"] = dry_run
+    return report.to_dict()
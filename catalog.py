@@ -0,0 +1,297 @@
+# catalog.py
+"""
+Catálogo do tenant como texto de WhatsApp (resposta da opção "2" do bot).
+
+O texto é montado a partir de products uma vez por tenant, já quebrado em
+mensagens abaixo do limite de 4096 caracteres da Cloud API, e fica em cache
+até uma escrita em products daquele tenant (storage.add_products_listener).
+Outros workers veem a mudança em até CATALOG_CACHE_TTL.
+
+Também guarda o JSON público do cardápio (/m/{tenant}/products.json): cada
+página serializada fica em memória marcada com a versão do catálogo
+(catalog_versions), que vira o ETag. Com a versão em cache, um
+If-None-Match igual responde 304 sem ir ao Postgres.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import storage
+from precompress import etag_matches  # noqa: F401 (usado pelo app)
+
+CATALOG_CHUNK_CHARS = int(os.getenv("CATALOG_CHUNK_CHARS", "4000"))  # limite da API: 4096
+CATALOG_MAX_ITEMS = int(os.getenv("CATALOG_MAX_ITEMS", "500"))
+CATALOG_CACHE_TTL = float(os.getenv("CATALOG_CACHE_TTL", "300"))
+# Falha ao montar (banco fora?) fica em cache por pouco tempo: não tenta a cada mensagem
+CATALOG_ERROR_TTL = float(os.getenv("CATALOG_ERROR_TTL", "30"))
+CATALOG_DESCRIPTION_CHARS = int(os.getenv("CATALOG_DESCRIPTION_CHARS", "120"))
+
+# JSON público: outros workers veem a nova versão em até CATALOG_VERSION_TTL
+CATALOG_VERSION_TTL = float(os.getenv("CATALOG_VERSION_TTL", "10"))
+CATALOG_PAGE_CACHE_SIZE = int(os.getenv("CATALOG_PAGE_CACHE_SIZE", "1000"))  # páginas serializadas
+CATALOG_CACHE_CONTROL = os.getenv("CATALOG_CACHE_CONTROL", "public, max-age=30, stale-while-revalidate=300")
+
+CATALOG_HEADER = "Certo! 💬 Hoje trabalhamos com:"
+CATALOG_FOOTER = "Para fazer uma encomenda, digite 1."
+
+
+def format_price(price_cents: int, currency: str = "BRL") -> str:
+    value = (price_cents or 0) / 100
+    if (currency or "BRL") == "BRL":
+        # 1234.5 -> "R$ 1.234,50"
+        return "R$ " + f"{value:,.2f}".replace(",", "_").replace(".", ",").replace("_", ".")
+    return f"{currency} {value:,.2f}"
+
+
+def _item_block(p: Dict[str, Any]) -> str:
+    line = f"• *{(p.get('name') or '').strip()}* — {format_price(p.get('price_cents'), p.get('currency'))}"
+    desc = " ".join((p.get("description") or "").split())
+    if desc:
+        if len(desc) > CATALOG_DESCRIPTION_CHARS:
+            desc = desc[: CATALOG_DESCRIPTION_CHARS - 1].rstrip() + "…"
+        line += f"\n  {desc}"
+    return line
+
+
+def chunk_blocks(blocks: List[str], limit: int = CATALOG_CHUNK_CHARS, sep: str = "\n\n") -> List[str]:
+    """
+    Junta blocos em mensagens de até `limit` caracteres sem partir um bloco;
+    um bloco maior que o limite é cortado em linhas (e, no pior caso, no meio).
+    """
+    pieces: List[str] = []
+    for block in blocks:
+        if len(block) <= limit:
+            pieces.append(block)
+            continue
+        for line in block.split("\n"):
+            while len(line) > limit:
+                pieces.append(line[:limit])
+                line = line[limit:]
+            pieces.append(line)
+
+    chunks: List[str] = []
+    current = ""
+    for piece in pieces:
+        candidate = f"{current}{sep}{piece}" if current else piece
+        if len(candidate) <= limit:
+            current = candidate
+        else:
+            chunks.append(current)
+            current = piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def render_catalog(products: List[Dict[str, Any]], limit: int = CATALOG_CHUNK_CHARS) -> List[str]:
+    """Mensagens do catálogo (vazio se não há produtos)."""
+    if not products:
+        return []
+    items = sorted(products, key=lambda p: (p.get("name") or "").casefold())
+    blocks = [CATALOG_HEADER] + [_item_block(p) for p in items] + [CATALOG_FOOTER]
+    return chunk_blocks(blocks, limit)
+
+
+def load_products(tenant_slug: str, max_items: int = CATALOG_MAX_ITEMS) -> List[Dict[str, Any]]:
+    products: List[Dict[str, Any]] = []
+    after_id = None
+    while len(products) < max_items:
+        page = storage.list_products(tenant_slug, limit=min(200, max_items - len(products)), after_id=after_id)
+        products.extend(page)
+        if len(page) < 200:
+            break
+        after_id = page[-1]["id"]
+    return products
+
+
+class CatalogCache:
+    """Mensagens renderizadas por tenant. Thread-safe."""
+
+    def __init__(self, ttl: float = CATALOG_CACHE_TTL, error_ttl: float = CATALOG_ERROR_TTL):
+        self.ttl = float(ttl)
+        self.error_ttl = float(error_ttl)
+        self._items: Dict[str, tuple] = {}  # tenant → (mensagens, expira_em)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.renders = 0
+        self.errors = 0
+        self.invalidations = 0
+
+    def cached(self, tenant_slug: str) -> Optional[List[str]]:
+        item = self._items.get(tenant_slug)
+        if item is not None and time.monotonic() <= item[1]:
+            self.hits += 1
+            return item[0]
+        return None
+
+    def get(self, tenant_slug: str) -> List[str]:
+        chunks = self.cached(tenant_slug)
+        if chunks is not None:
+            return chunks
+        self.misses += 1
+        try:
+            chunks = render_catalog(load_products(tenant_slug))
+        except Exception:
+            # Sem catálogo o engine responde com o texto fixo do fluxo; o vazio
+            # fica em cache por error_ttl (cache negativo)
+            logging.exception(f"[catalog] falha ao montar catálogo de {tenant_slug}")
+            self.errors += 1
+            with self._lock:
+                self._items[tenant_slug] = ([], time.monotonic() + self.error_ttl)
+            return []
+        self.renders += 1
+        with self._lock:
+            self._items[tenant_slug] = (chunks, time.monotonic() + self.ttl)
+        return chunks
+
+    def invalidate(self, tenant_slug: str, version: Optional[int] = None) -> None:
+        with self._lock:
+            if self._items.pop(tenant_slug, None) is not None:
+                self.invalidations += 1
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "tenants": len(self._items),
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "renders": self.renders,
+            "errors": self.errors,
+            "invalidations": self.invalidations,
+        }
+
+
+catalog_cache = CatalogCache()
+storage.add_products_listener(catalog_cache.invalidate)
+
+
+# ---------------------------------------------------------------------------
+# JSON público do cardápio
+# ---------------------------------------------------------------------------
+def public_item(p: Dict[str, Any]) -> Dict[str, Any]:
+    """Só os campos que o cardápio público pode ver."""
+    return {
+        "id": p.get("id"),
+        "sku": p.get("sku"),
+        "name": p.get("name") or "",
+        "description": p.get("description") or "",
+        "price_cents": p.get("price_cents") or 0,
+        "currency": p.get("currency") or "BRL",
+        "image_url": p.get("image_url") or "",
+        "images": p.get("image_variants") or None,  # thumb/medium em webp e jpeg (srcset)
+    }
+
+
+def make_etag(version: int, limit: int, offset: int, cursor: Optional[str] = None) -> str:
+    return f'"v{version}.{limit}.{cursor or offset}"'
+
+
+class PublicCatalogCache:
+    """
+    Versão do catálogo por tenant (TTL curto) + LRU das páginas já
+    serializadas, cada uma marcada com a versão em que foi montada.
+    Escrita local atualiza a versão na hora (listener de products).
+    """
+
+    def __init__(self, version_ttl: float = CATALOG_VERSION_TTL, maxsize: int = CATALOG_PAGE_CACHE_SIZE):
+        self.version_ttl = float(version_ttl)
+        self.maxsize = max(0, int(maxsize))
+        self._versions: Dict[str, Tuple[int, float]] = {}
+        self._pages: "OrderedDict[Tuple[str, int, Any], Tuple[int, bytes]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.version_loads = 0
+        self.not_modified = 0
+
+    def cached_version(self, tenant_slug: str) -> Optional[int]:
+        item = self._versions.get(tenant_slug)
+        if item is not None and time.monotonic() - item[1] <= self.version_ttl:
+            return item[0]
+        return None
+
+    def remember_version(self, tenant_slug: str, v: int) -> int:
+        with self._lock:
+            current = self._versions.get(tenant_slug)
+            # Listener pode ter visto uma versão mais nova durante a leitura
+            if current is not None and current[0] > v:
+                v = current[0]
+            self._versions[tenant_slug] = (v, time.monotonic())
+        return v
+
+    def version(self, tenant_slug: str) -> int:
+        v = self.cached_version(tenant_slug)
+        if v is not None:
+            return v
+        self.version_loads += 1
+        return self.remember_version(tenant_slug, storage.get_catalog_version(tenant_slug))
+
+    def page(self, tenant_slug: str, limit: int, offset: int = 0, cursor: Optional[str] = None) -> Tuple[int, bytes]:
+        """
+        (versão, corpo JSON) da página. Com a página no LRU basta conferir a
+        versão (PK em catalog_versions); sem ela, uma query traz itens, total
+        e versão juntos (storage.page_products).
+        """
+        key = (tenant_slug, limit, cursor or offset)
+        item = self._pages.get(key)
+        if item is not None:
+            version = self.version(tenant_slug)
+            with self._lock:
+                item = self._pages.get(key)
+                if item is not None and item[0] == version:
+                    self._pages.move_to_end(key)
+                    self.hits += 1
+                    return item
+        self.misses += 1
+        page = storage.page_products(tenant_slug, limit=limit, cursor=cursor, offset=offset)
+        version = self.remember_version(tenant_slug, page.version)
+        body = json.dumps(
+            {"items": [public_item(p) for p in page.items], "total": page.total, "next_cursor": page.next_cursor},
+            ensure_ascii=False,
+            separators=(",", ":"),
+        ).encode("utf-8")
+        if self.maxsize and version == page.version:
+            with self._lock:
+                self._pages[key] = (version, body)
+                self._pages.move_to_end(key)
+                while len(self._pages) > self.maxsize:
+                    self._pages.popitem(last=False)
+        return version, body
+
+    def mark_not_modified(self) -> None:
+        self.not_modified += 1
+
+    def invalidate(self, tenant_slug: str, version: Optional[int] = None) -> None:
+        with self._lock:
+            if version is None:
+                self._versions.pop(tenant_slug, None)
+            else:
+                self._versions[tenant_slug] = (version, time.monotonic())
+            # Páginas velhas saem sozinhas (versão não bate); libera a memória já
+            for key in [k for k in self._pages if k[0] == tenant_slug]:
+                del self._pages[key]
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "tenants": len(self._versions),
+            "pages": len(self._pages),
+            "maxsize": self.maxsize,
+            "version_ttl": self.version_ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "version_loads": self.version_loads,
+            "not_modified": self.not_modified,
+        }
+
+
+public_catalog = PublicCatalogCache()
+storage.add_products_listener(public_catalog.invalidate)
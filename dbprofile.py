@@ -0,0 +1,150 @@
+# dbprofile.py
+"""
+Profiler de queries do storage.py.
+
+Cada get_conn() é atribuído à função do storage que o chamou. Para cada uma
+registramos a espera pelo pool (checkout), o tempo de cada execute e as
+linhas retornadas/afetadas — em histogramas Prometheus e num resumo em
+memória para o /admin/db. Queries acima de DB_SLOW_QUERY_MS vão para o log.
+"""
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict
+
+import psycopg
+from prometheus_client import Counter, Histogram
+
+DB_PROFILE = os.getenv("DB_PROFILE", "1").strip().lower() in ("1", "true", "yes")
+DB_SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", "200"))  # 0 desliga o log
+
+# Postgres gerenciado: de 0,5ms (pool quente) a 10s
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ROW_BUCKETS = (0, 1, 5, 10, 50, 100, 500, 1000, 5000, 10000)
+
+DB_CHECKOUT_SECONDS = Histogram(
+    "blackbot_db_checkout_seconds",
+    "Espera por uma conexão do pool, por função do storage",
+    ["fn"],
+    buckets=DB_BUCKETS,
+)
+DB_QUERY_SECONDS = Histogram(
+    "blackbot_db_query_seconds",
+    "Duração de cada execute, por função do storage",
+    ["fn"],
+    buckets=DB_BUCKETS,
+)
+DB_QUERY_ROWS = Histogram(
+    "blackbot_db_query_rows",
+    "Linhas retornadas/afetadas por execute, por função do storage",
+    ["fn"],
+    buckets=ROW_BUCKETS,
+)
+DB_CHECKOUT_TIMEOUTS = Counter(
+    "blackbot_db_checkout_timeouts_total",
+    "Checkouts do pool que estouraram DB_POOL_TIMEOUT",
+    ["fn"],
+)
+DB_SLOW_QUERIES = Counter(
+    "blackbot_db_slow_queries_total",
+    "Queries acima de DB_SLOW_QUERY_MS",
+    ["fn"],
+)
+
+# Atributo pendurado na conexão com o nome de quem a pegou do pool
+CALLER_ATTR = "_blackbot_caller"
+
+
+class QueryProfiler:
+    def __init__(self, slow_ms: float = DB_SLOW_QUERY_MS):
+        self.slow_s = slow_ms / 1000.0
+        self._lock = threading.Lock()
+        self._fns: Dict[str, Dict[str, float]] = {}
+
+    def _entry(self, fn: str) -> Dict[str, float]:
+        e = self._fns.get(fn)
+        if e is None:
+            e = self._fns[fn] = {
+                "checkouts": 0, "checkout_s": 0.0, "checkout_max_s": 0.0, "timeouts": 0,
+                "queries": 0, "query_s": 0.0, "query_max_s": 0.0, "rows": 0, "slow": 0,
+            }
+        return e
+
+    def checkout(self, fn: str, seconds: float) -> None:
+        DB_CHECKOUT_SECONDS.labels(fn=fn).observe(seconds)
+        with self._lock:
+            e = self._entry(fn)
+            e["checkouts"] += 1
+            e["checkout_s"] += seconds
+            e["checkout_max_s"] = max(e["checkout_max_s"], seconds)
+
+    def timeout(self, fn: str) -> None:
+        DB_CHECKOUT_TIMEOUTS.labels(fn=fn).inc()
+        with self._lock:
+            self._entry(fn)["timeouts"] += 1
+        logging.warning(f"[db] timeout esperando conexão do pool em {fn}")
+
+    def query(self, fn: str, seconds: float, rows: int, query: Any) -> None:
+        rows = max(0, rows)
+        DB_QUERY_SECONDS.labels(fn=fn).observe(seconds)
+        DB_QUERY_ROWS.labels(fn=fn).observe(rows)
+        slow = self.slow_s > 0 and seconds >= self.slow_s
+        with self._lock:
+            e = self._entry(fn)
+            e["queries"] += 1
+            e["query_s"] += seconds
+            e["query_max_s"] = max(e["query_max_s"], seconds)
+            e["rows"] += rows
+            if slow:
+                e["slow"] += 1
+        if slow:
+            DB_SLOW_QUERIES.labels(fn=fn).inc()
+            sql = " ".join(str(query if isinstance(query, str) else repr(query)).split())[:300]
+            logging.warning(f"[db] query lenta fn={fn} {seconds * 1000:.1f}ms rows={rows} sql={sql}")
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            out = {}
+            for fn, e in sorted(self._fns.items(), key=lambda kv: -kv[1]["query_s"]):
+                out[fn] = {
+                    "checkouts": int(e["checkouts"]),
+                    "avg_checkout_ms": round(e["checkout_s"] / e["checkouts"] * 1000, 3) if e["checkouts"] else 0.0,
+                    "max_checkout_ms": round(e["checkout_max_s"] * 1000, 3),
+                    "timeouts": int(e["timeouts"]),
+                    "queries": int(e["queries"]),
+                    "avg_query_ms": round(e["query_s"] / e["queries"] * 1000, 3) if e["queries"] else 0.0,
+                    "max_query_ms": round(e["query_max_s"] * 1000, 3),
+                    "total_query_s": round(e["query_s"], 3),
+                    "rows": int(e["rows"]),
+                    "slow": int(e["slow"]),
+                }
+            return out
+
+    def reset(self) -> None:
+        with self._lock:
+            self._fns.clear()
+
+
+profiler = QueryProfiler()
+
+
+class ProfiledCursor(psycopg.Cursor):
+    """Cursor que mede cada execute e atribui à função dona da conexão."""
+
+    def _caller(self) -> str:
+        return getattr(self.connection, CALLER_ATTR, None) or "unknown"
+
+    def execute(self, query, params=None, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return super().execute(query, params, **kwargs)
+        finally:
+            profiler.query(self._caller(), time.perf_counter() - t0, self.rowcount, query)
+
+    def executemany(self, query, params_seq, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return super().executemany(query, params_seq, **kwargs)
+        finally:
+            profiler.query(self._caller(), time.perf_counter() - t0, self.rowcount, query)
@@ -1,175 +1,147 @@
-import json
-from datetime import datetime, timedelta
-from storage import load_session_full, save_session, save_order
+from typing import List, Optional, Tuple
 
-TIMEOUT_MINUTES = 90
+import flows
+from flows import CompiledFlow, Transition
+from stores import SESSION_TIMEOUT_MINUTES, postgres_store
 
-RESET_WORDS = {
-    "novo", "novo pedido", "reiniciar", "recomeçar", "menu", "start", "0"
-}
-CANCEL_WORDS = {"cancelar", "cancela", "parar", "sair"}
-HELP_WORDS = {"ajuda", "help", "?"}
+TIMEOUT_MINUTES = SESSION_TIMEOUT_MINUTES
 
 
 # ============================================================
 # UTILITÁRIOS
 # ============================================================
 
-def _now():
-    return datetime.utcnow()
+def _store(turn=None):
+    """
+    Destino das leituras/escritas: qualquer SessionStore + OrderSink (stores.py),
+    ex.: o turno de storage.begin_turn ou um MemoryStore. Sem ele, o Postgres
+    direto (uma ida ao banco por chamada).
+    """
+    return turn if turn is not None else postgres_store
 
 
 # ============================================================
 # CARREGAMENTO DO ESTADO
 # ============================================================
 
-def _load_state_data(wa_id: str):
-    row = load_session_full(wa_id)  # (state, data_json, updated_at)
-
+def _load_state_data(wa_id: str, turn=None, start: str = "START"):
+    # O store já aplica o timeout (no Postgres, decidido no SQL)
+    row = _store(turn).load_session(wa_id)  # (state, data) ou None
     if not row:
-        return "START", {}
-
-    state, data_json, updated_at = row
-
-    # Timeout
-    try:
-        last = datetime.fromisoformat(updated_at)
-        if _now() - last > timedelta(minutes=TIMEOUT_MINUTES):
-            return "START", {}
-    except Exception:
-        pass
-
-    # JSON
-    try:
-        data = json.loads(data_json)
-    except Exception:
-        data = {}
+        return start, {}
+    state, data = row
+    return state, data if isinstance(data, dict) else {}
 
-    return state, data
 
-
-def _set_state_data(wa_id: str, state: str, data: dict):
-    save_session(wa_id, state, json.dumps(data, ensure_ascii=False))
+def _set_state_data(wa_id: str, state: str, data: dict, turn=None):
+    _store(turn).save_session(wa_id, state, data)
 
 
 # ============================================================
 # MENU PRINCIPAL
 # ============================================================
 
-def _menu():
-    return (
-        "Olá! 😊 Sou o atendimento automático.\n"
-        "Como posso ajudar?\n\n"
-        "1) Fazer uma encomenda 🎂\n"
-        "2) Ver opções/preços 💬\n"
-        "3) Falar com a confeiteira 👩‍🍳\n\n"
-        "Digite 1, 2 ou 3."
-    )
+def _menu(flow: CompiledFlow = None):
+    return (flow or flows.registry.default).menu
 
 
 # ============================================================
 # FSM PRINCIPAL
 # ============================================================
 
-def next_reply(wa_id: str, text: str) -> str:
+def _apply(wa_id: str, flow: CompiledFlow, tr: Transition, data: dict, turn=None,
+           catalog: Optional[List[str]] = None) -> List[str]:
+    """
+    Executa a transição: ação (pedido/catálogo), gravação da sessão e
+    mensagens de resposta.
+    """
+    if tr.action == "order":
+        fields = {col: data.get(key) for col, key in flow.order_fields.items()}
+        _store(turn).save_order(
+            wa_id=wa_id,
+            data=fields.get("data"),
+            tipo=fields.get("tipo"),
+            qtd=fields.get("qtd"),
+            status=flow.order_status,
+        )
+
+    if tr.action == "catalog" and catalog:
+        # Texto já renderizado e quebrado em mensagens (catalog.py)
+        messages = list(catalog)
+    else:
+        reply = tr.reply
+        if reply is None:
+            reply = flow.states[tr.goto].prompt
+        messages = [flow.render(reply, data)]
+
+    if tr.goto is not None:
+        _set_state_data(wa_id, tr.goto, {} if tr.clear else data, turn)
+    return messages
+
+
+def _resolve(wa_id: str, text: str, turn=None, flow: CompiledFlow = None) -> Tuple[Optional[Transition], dict]:
+    """
+    Transição que a mensagem dispara e os dados da sessão com a coleta já
+    aplicada. Só lê (nada é gravado); None = estado desconhecido (volta ao menu).
+    """
     t = (text or "").strip()
-    t_low = t.lower()
+    key = flows.normalize(t)
 
     # ------------------ COMANDOS GLOBAIS ------------------
-    if t_low in HELP_WORDS:
-        _set_state_data(wa_id, "START", {})
-        return _menu()
-
-    if t_low in CANCEL_WORDS:
-        _set_state_data(wa_id, "START", {})
-        return "Tudo bem! Pedido cancelado. Se precisar, é só chamar 😊"
-
-    if t_low in RESET_WORDS:
-        _set_state_data(wa_id, "START", {})
-        return _menu()
+    tr = flow.globals.get(key)
+    if tr is not None:
+        return tr, {}
 
     # ------------------ CARREGAR ESTADO -------------------
-    state, data = _load_state_data(wa_id)
-
-    # ------------------ START ------------------------------
-    if state == "START":
-        if t in ("1", "encomenda", "fazer encomenda", "quero encomendar"):
-            _set_state_data(wa_id, "DATA", {})
-            return "Perfeito! Para qual data é a encomenda? (ex: 15/02)"
-
-        if t in ("2", "preço", "precos", "preços", "opções", "opcoes"):
-            return (
-                "Certo! 💬 Hoje trabalhamos com:\n"
-                "- Doces para festa (centena)\n"
-                "- Caixas presente\n"
-                "- Kits personalizados\n\n"
-                "Para fazer uma encomenda, digite 1."
-            )
-
-        if t in ("3", "humano", "atendente", "confeiteira", "falar"):
-            return (
-                "Perfeito! 👩‍🍳 Vou avisar a confeiteira.\n"
-                "Assim que possível ela te responde por aqui. 😊"
-            )
-
-        return _menu()
-
-    # ------------------ DATA ------------------------------
-    if state == "DATA":
-        data["data"] = t
-        _set_state_data(wa_id, "TIPO", data)
-        return "É para Festa 🎉 ou Presente 🎁? (responda: festa/presente)"
-
-    # ------------------ TIPO ------------------------------
-    if state == "TIPO":
-        data["tipo"] = t
-        _set_state_data(wa_id, "QTD", data)
-        return "Quantas unidades (aprox.)? (ex: 50, 100, 200)"
-
-    # ------------------ QTD -------------------------------
-    if state == "QTD":
-        data["qtd"] = t
-        _set_state_data(wa_id, "OBS", data)
-        return (
-            "Tem alguma observação? (tema, sabores, alergias, entrega/retirada).\n"
-            "Se não, digite 'não'."
-        )
-
-    # ------------------ OBS -------------------------------
-    if state == "OBS":
-        data["obs"] = t if t_low not in ("nao", "não", "n") else ""
-        _set_state_data(wa_id, "RESUMO", data)
-
-        return (
-            "Confira se está tudo certo ✅\n"
-            f"- Data: {data.get('data')}\n"
-            f"- Tipo: {data.get('tipo')}\n"
-            f"- Quantidade: {data.get('qtd')}\n"
-            f"- Obs: {data.get('obs') or '—'}\n\n"
-            "Posso enviar para a confeiteira? (sim/não)\n"
-            "Dica: 'não' volta ao menu e você refaz."
-        )
-
-    # ------------------ RESUMO ---------------------------
-    if state == "RESUMO":
-        if t_low in ("sim", "s", "ok", "pode", "confirmo", "confirmar"):
-            save_order(
-                wa_id=wa_id,
-                data=data.get("data"),
-                tipo=data.get("tipo"),
-                qtd=data.get("qtd"),
-                status="AGUARDANDO_HUMANO"
-            )
-            _set_state_data(wa_id, "START", {})
-            return (
-                "Perfeito! ✅ Seu pedido foi registrado.\n"
-                "A confeiteira vai te chamar para combinar os detalhes.\n\n"
-                "Se quiser fazer outro pedido, digite 1. 😊"
-            )
-
-        _set_state_data(wa_id, "START", {})
-        return "Sem problemas! Vamos voltar ao menu. 😊\n\n" + _menu()
+    state, data = _load_state_data(wa_id, turn, flow.start)
+    st = flow.states.get(state)
 
     # ------------------ FALLBACK -------------------------
-    _set_state_data(wa_id, "START", {})
-    return _menu()
\ No newline at end of file
+    if st is None:
+        return None, {}
+
+    # ------------------ COLETA (guarda o texto) ----------
+    if st.capture:
+        data[st.capture] = "" if key in st.empty_words else t
+        return st.next, data
+
+    # ------------------ ESCOLHA (palavra-chave) ----------
+    return st.index.get(key, st.default), data
+
+
+def needs_catalog(wa_id: str, text: str, turn=None, flow: CompiledFlow = None) -> bool:
+    """
+    A mensagem cai na ação "catalog"? Permite montar o catálogo só quando a
+    resposta vai usá-lo (com o turno de begin_turn, sem I/O).
+    """
+    if flow is None:
+        flow = flows.registry.get(flows.DEFAULT_TENANT)
+    tr, _ = _resolve(wa_id, text, turn, flow)
+    return tr is not None and tr.action == "catalog"
+
+
+def next_replies(wa_id: str, text: str, turn=None, flow: CompiledFlow = None,
+                 catalog: Optional[List[str]] = None) -> List[str]:
+    """
+    Calcula a resposta (uma ou mais mensagens) e atualiza a sessão.
+    `turn` é o SessionStore/OrderSink da mensagem: com storage.begin_turn não
+    faz I/O (lê do turno e acumula as escritas para o commit único); com
+    stores.MemoryStore roda sem Postgres. `flow` é o fluxo compilado do tenant
+    (flows.registry); sem ele, usa o do DEFAULT_TENANT. `catalog` são as
+    mensagens pré-renderizadas do catálogo do tenant (ação "catalog", ver
+    needs_catalog); sem ele, vale o texto fixo da transição.
+    """
+    if flow is None:
+        flow = flows.registry.get(flows.DEFAULT_TENANT)
+
+    tr, data = _resolve(wa_id, text, turn, flow)
+    if tr is None:
+        _set_state_data(wa_id, flow.start, {}, turn)
+        return [_menu(flow)]
+    return _apply(wa_id, flow, tr, data, turn, catalog)
+
+
+def next_reply(wa_id: str, text: str, turn=None, flow: CompiledFlow = None,
+               catalog: Optional[List[str]] = None) -> str:
+    """Como next_replies, com as mensagens juntas num único texto."""
+    return "\n\n".join(next_replies(wa_id, text, turn, flow, catalog))
@@ -0,0 +1,368 @@
+# flows.py
+"""
+Fluxos de conversa declarativos por tenant.
+
+Um fluxo é um dict (guardado em JSONB na tabela flows) com estados, prompts,
+transições e palavras-chave. Ao carregar, ele é compilado em tabelas de
+despacho: cada palavra-chave já normalizada (sem acento, minúscula, espaços
+colapsados) aponta direto para a sua transição, então cada mensagem custa
+uma normalização e um lookup em dict, independente do tamanho do fluxo ou
+do número de tenants.
+
+Formato:
+
+    {
+      "start": "START",
+      "menu": "texto do menu",              # disponível como {menu} nos textos
+      "globals": [ <transição com "keywords"> ... ],   # valem em qualquer estado
+      "states": {
+        "NOME": {
+          "prompt": "texto ao entrar no estado",
+          # estado de coleta: guarda o texto em data[capture] e segue
+          "capture": "campo", "empty_words": ["não"], "goto": "PROX",
+          # ou estado de escolha:
+          "intents": [ {"keywords": [...], "reply": "...", "goto": "X"} ],
+          "default": { "reply": "...", "goto": "X" }
+        }
+      },
+      "order": {"fields": {"data": "data", "tipo": "tipo", "qtd": "qtd"}, "status": "NOVO"}
+    }
+
+Transição: reply (opcional; sem reply usa o prompt do destino), goto
+(opcional; sem goto não grava a sessão), clear (zera os dados) e
+action ("order" grava o pedido com os campos de "order"; "catalog" responde
+com o catálogo de produtos do tenant, e o reply vira o fallback). Ir para o
+estado inicial sempre zera os dados. Textos aceitam {menu} e {campo}.
+"""
+import logging
+import os
+import threading
+import time
+import unicodedata
+from typing import Any, Callable, Dict, NamedTuple, Optional, Tuple
+
+FLOW_CACHE_TTL = float(os.getenv("FLOW_CACHE_TTL", "60"))  # outros workers veem a edição em até 60s
+DEFAULT_TENANT = os.getenv("DEFAULT_TENANT", "default")
+# "phone_number_id:slug,phone_number_id:slug" — número da Cloud API → tenant
+TENANT_BY_PHONE_NUMBER = dict(
+    pair.split(":", 1) for pair in os.getenv("TENANT_BY_PHONE_NUMBER", "").replace(" ", "").split(",") if ":" in pair
+)
+
+ACTIONS = {"order", "catalog"}
+
+MENU = (
+    "Olá! 😊 Sou o atendimento automático.\n"
+    "Como posso ajudar?\n\n"
+    "1) Fazer uma encomenda 🎂\n"
+    "2) Ver opções/preços 💬\n"
+    "3) Falar com a confeiteira 👩‍🍳\n\n"
+    "Digite 1, 2 ou 3."
+)
+
+# Fluxo da confeitaria (o que o engine fazia fixo no código)
+DEFAULT_FLOW: Dict[str, Any] = {
+    "start": "START",
+    "menu": MENU,
+    "globals": [
+        {"keywords": ["ajuda", "help", "?"], "reply": "{menu}", "goto": "START"},
+        {
+            "keywords": ["cancelar", "cancela", "parar", "sair"],
+            "reply": "Tudo bem! Pedido cancelado. Se precisar, é só chamar 😊",
+            "goto": "START",
+        },
+        {
+            "keywords": ["novo", "novo pedido", "reiniciar", "recomeçar", "menu", "start", "0"],
+            "reply": "{menu}",
+            "goto": "START",
+        },
+    ],
+    "states": {
+        "START": {
+            "prompt": "{menu}",
+            "intents": [
+                {"keywords": ["1", "encomenda", "fazer encomenda", "quero encomendar"], "goto": "DATA", "clear": True},
+                {
+                    "keywords": ["2", "preço", "preços", "opções"],
+                    # Catálogo do tenant (products); o texto abaixo é o fallback sem produtos
+                    "action": "catalog",
+                    "reply": (
+                        "Certo! 💬 Hoje trabalhamos com:\n"
+                        "- Doces para festa (centena)\n"
+                        "- Caixas presente\n"
+                        "- Kits personalizados\n\n"
+                        "Para fazer uma encomenda, digite 1."
+                    ),
+                },
+                {
+                    "keywords": ["3", "humano", "atendente", "confeiteira", "falar"],
+                    "reply": (
+                        "Perfeito! 👩‍🍳 Vou avisar a confeiteira.\n"
+                        "Assim que possível ela te responde por aqui. 😊"
+                    ),
+                },
+            ],
+            "default": {"reply": "{menu}"},
+        },
+        "DATA": {
+            "prompt": "Perfeito! Para qual data é a encomenda? (ex: 15/02)",
+            "capture": "data",
+            "goto": "TIPO",
+        },
+        "TIPO": {
+            "prompt": "É para Festa 🎉 ou Presente 🎁? (responda: festa/presente)",
+            "capture": "tipo",
+            "goto": "QTD",
+        },
+        "QTD": {
+            "prompt": "Quantas unidades (aprox.)? (ex: 50, 100, 200)",
+            "capture": "qtd",
+            "goto": "OBS",
+        },
+        "OBS": {
+            "prompt": (
+                "Tem alguma observação? (tema, sabores, alergias, entrega/retirada).\n"
+                "Se não, digite 'não'."
+            ),
+            "capture": "obs",
+            "empty_words": ["não", "n"],
+            "goto": "RESUMO",
+        },
+        "RESUMO": {
+            "prompt": (
+                "Confira se está tudo certo ✅\n"
+                "- Data: {data}\n"
+                "- Tipo: {tipo}\n"
+                "- Quantidade: {qtd}\n"
+                "- Obs: {obs}\n\n"
+                "Posso enviar para a confeiteira? (sim/não)\n"
+                "Dica: 'não' volta ao menu e você refaz."
+            ),
+            "intents": [
+                {
+                    "keywords": ["sim", "s", "ok", "pode", "confirmo", "confirmar"],
+                    "action": "order",
+                    "reply": (
+                        "Perfeito! ✅ Seu pedido foi registrado.\n"
+                        "A confeiteira vai te chamar para combinar os detalhes.\n\n"
+                        "Se quiser fazer outro pedido, digite 1. 😊"
+                    ),
+                    "goto": "START",
+                },
+            ],
+            "default": {"reply": "Sem problemas! Vamos voltar ao menu. 😊\n\n{menu}", "goto": "START"},
+        },
+    },
+    "order": {"fields": {"data": "data", "tipo": "tipo", "qtd": "qtd"}, "status": "AGUARDANDO_HUMANO"},
+}
+
+
+class FlowError(ValueError):
+    pass
+
+
+def _optional_str(spec: Dict[str, Any], key: str, where: str) -> Optional[str]:
+    value = spec.get(key)
+    if value is not None and not isinstance(value, str):
+        raise FlowError(f"{where}: '{key}' deve ser texto")
+    return value
+
+
+def _list_of(value: Any, kind: type, where: str, what: str) -> list:
+    """Lista (None = vazia) só com itens do tipo esperado; senão FlowError."""
+    if value is None:
+        return []
+    if not isinstance(value, list) or not all(isinstance(v, kind) for v in value):
+        raise FlowError(f"{where}: {what}")
+    return value
+
+
+def normalize(text: str) -> str:
+    """Minúsculas, sem acentos e com espaços colapsados ("Preços " -> "precos")."""
+    decomposed = unicodedata.normalize("NFKD", text or "")
+    stripped = "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return " ".join(stripped.lower().split())
+
+
+class Transition(NamedTuple):
+    reply: Optional[str]
+    goto: Optional[str]
+    clear: bool
+    action: Optional[str]
+
+
+class CompiledState(NamedTuple):
+    name: str
+    prompt: str
+    capture: Optional[str]
+    empty_words: frozenset
+    next: Optional[Transition]     # estados de coleta
+    index: Dict[str, Transition]   # estados de escolha: palavra normalizada → transição
+    default: Transition
+
+
+class _Defaults(dict):
+    def __missing__(self, key):
+        return "—"
+
+
+class CompiledFlow:
+    def __init__(self, definition: Dict[str, Any], tenant: str = DEFAULT_TENANT, version: int = 0):
+        self.tenant = tenant
+        self.version = version
+        self.definition = definition
+        if not isinstance(definition, dict):
+            raise FlowError("o fluxo deve ser um objeto")
+        self.menu = _optional_str(definition, "menu", "fluxo") or ""
+        states = definition.get("states") or {}
+        if not isinstance(states, dict) or not states:
+            raise FlowError("o fluxo precisa de 'states'")
+        self.start = _optional_str(definition, "start", "fluxo") or next(iter(states))
+        if self.start not in states:
+            raise FlowError(f"estado inicial '{self.start}' não existe")
+
+        order = definition.get("order") or {}
+        if not isinstance(order, dict):
+            raise FlowError("order: deve ser um objeto")
+        fields = order.get("fields") or {}
+        if not isinstance(fields, dict) or not all(
+            isinstance(k, str) and isinstance(v, str) for k, v in fields.items()
+        ):
+            raise FlowError("order.fields: deve mapear texto → texto")
+        self.order_fields: Dict[str, str] = dict(fields)
+        self.order_status = _optional_str(order, "status", "order") or "NOVO"
+
+        self.globals = self._index(definition.get("globals"), states, "globals")
+        self.states: Dict[str, CompiledState] = {}
+        for name, spec in states.items():
+            if not isinstance(spec, dict):
+                raise FlowError(f"estado '{name}' inválido")
+            where = f"states.{name}"
+            capture = _optional_str(spec, "capture", where)
+            if spec.get("goto") is not None and not capture:
+                raise FlowError(f"{where}: 'goto' direto só vale em estado de coleta (capture)")
+            nxt = self._transition(spec, states, where) if capture else None
+            empty_words = _list_of(spec.get("empty_words"), str, where, "'empty_words' deve ser lista de textos")
+            default = spec.get("default") or {"reply": "{menu}", "goto": self.start}
+            self.states[name] = CompiledState(
+                name=name,
+                prompt=_optional_str(spec, "prompt", where) or "",
+                capture=capture,
+                empty_words=frozenset(normalize(w) for w in empty_words),
+                next=nxt,
+                index=self._index(spec.get("intents"), states, f"{where}.intents"),
+                default=self._transition(default, states, f"{where}.default"),
+            )
+
+    def _transition(self, spec: Dict[str, Any], states: Dict[str, Any], where: str) -> Transition:
+        if not isinstance(spec, dict):
+            raise FlowError(f"{where}: transição deve ser um objeto")
+        goto = _optional_str(spec, "goto", where)
+        if goto is not None and goto not in states:
+            raise FlowError(f"{where}: destino '{goto}' não existe")
+        action = _optional_str(spec, "action", where)
+        if action is not None and action not in ACTIONS:
+            raise FlowError(f"{where}: ação '{action}' desconhecida")
+        reply = _optional_str(spec, "reply", where)
+        if reply is None and goto is None:
+            raise FlowError(f"{where}: transição sem reply nem goto")
+        return Transition(
+            reply=reply,
+            goto=goto,
+            clear=bool(spec.get("clear")) or goto == self.start,
+            action=action,
+        )
+
+    def _index(self, intents: Any, states: Dict[str, Any], where: str) -> Dict[str, Transition]:
+        index: Dict[str, Transition] = {}
+        for i, intent in enumerate(_list_of(intents, dict, where, "deve ser lista de objetos")):
+            tr = self._transition(intent, states, f"{where}[{i}]")
+            keywords = _list_of(intent.get("keywords"), str, f"{where}[{i}]", "'keywords' deve ser lista de textos")
+            for kw in keywords:
+                key = normalize(kw)
+                # Primeira definição vence (mesma ordem do if-chain antigo)
+                index.setdefault(key, tr)
+        return index
+
+    def render(self, text: str, data: Dict[str, Any]) -> str:
+        values = _Defaults({k: v for k, v in data.items() if v not in (None, "")})
+        values["menu"] = self.menu
+        try:
+            return text.format_map(values)
+        except (ValueError, IndexError):
+            return text
+
+
+def load_from_storage(tenant: str) -> Optional[Tuple[dict, int]]:
+    import storage  # só quando precisa do banco (o engine roda sem Postgres)
+
+    return storage.get_flow(tenant)
+
+
+class FlowRegistry:
+    """
+    Cache dos fluxos compilados por tenant. Edição local invalida na hora;
+    nos outros workers a entrada expira em FLOW_CACHE_TTL.
+    """
+
+    def __init__(
+        self,
+        ttl: float = FLOW_CACHE_TTL,
+        loader: Callable[[str], Optional[Tuple[dict, int]]] = load_from_storage,
+    ):
+        self.ttl = float(ttl)
+        self.loader = loader
+        self._items: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+        self.default = CompiledFlow(DEFAULT_FLOW)
+        self.hits = 0
+        self.misses = 0
+        self.compiles = 0
+
+    def cached(self, tenant: str) -> Optional[CompiledFlow]:
+        item = self._items.get(tenant)
+        if item is not None and time.monotonic() - item[1] <= self.ttl:
+            self.hits += 1
+            return item[0]
+        return None
+
+    def get(self, tenant: str) -> CompiledFlow:
+        flow = self.cached(tenant)
+        if flow is not None:
+            return flow
+        self.misses += 1
+        row = self.loader(tenant)
+        if row is None:
+            flow = self.default
+        else:
+            definition, version = row
+            try:
+                flow = CompiledFlow(definition, tenant=tenant, version=version)
+                self.compiles += 1
+            except FlowError:
+                logging.exception(f"[flows] fluxo de {tenant} inválido, usando o padrão")
+                flow = self.default
+        with self._lock:
+            self._items[tenant] = (flow, time.monotonic())
+        return flow
+
+    def invalidate(self, tenant: str) -> None:
+        with self._lock:
+            self._items.pop(tenant, None)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "tenants": len(self._items),
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "compiles": self.compiles,
+        }
+
+
+registry = FlowRegistry()
+
+
+def tenant_for(phone_number_id: Optional[str]) -> str:
+    return TENANT_BY_PHONE_NUMBER.get(phone_number_id or "", DEFAULT_TENANT)
@@ -0,0 +1,75 @@
+# idempotency.py
+"""
+Cache em memória de message_ids já vistos (frente da tabela processed_messages).
+
+Só entra no cache o id que o banco já confirmou (inserido agora ou existente),
+então um acerto no cache é sempre uma duplicata real e pode ser descartado
+sem ir ao Postgres. Um miss cai no INSERT ... ON CONFLICT, que continua sendo
+a fonte da verdade.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable
+
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "50000"))
+IDEMPOTENCY_CACHE_TTL = float(os.getenv("IDEMPOTENCY_CACHE_TTL", "86400"))  # segundos
+
+# Retenção/poda de processed_messages
+PROCESSED_RETENTION_DAYS = float(os.getenv("PROCESSED_RETENTION_DAYS", "7"))
+PROCESSED_PRUNE_INTERVAL = float(os.getenv("PROCESSED_PRUNE_INTERVAL", "3600"))  # 0 desliga
+PROCESSED_PRUNE_BATCH = int(os.getenv("PROCESSED_PRUNE_BATCH", "5000"))
+
+
+class RecentIds:
+    """
+    Conjunto LRU limitado com TTL. Thread-safe (usado do event loop e do threadpool).
+    """
+
+    def __init__(self, maxsize: int = IDEMPOTENCY_CACHE_SIZE, ttl: float = IDEMPOTENCY_CACHE_TTL):
+        self.maxsize = max(1, int(maxsize))
+        self.ttl = float(ttl)
+        self._items: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def seen(self, key: str) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            ts = self._items.get(key)
+            if ts is not None and now - ts <= self.ttl:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return True
+            if ts is not None:
+                del self._items[key]
+            self.misses += 1
+            return False
+
+    def add_many(self, keys: Iterable[str]) -> None:
+        now = time.monotonic()
+        with self._lock:
+            for k in keys:
+                self._items[k] = now
+                self._items.move_to_end(k)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+                self.evictions += 1
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._items),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "evictions": self.evictions,
+        }
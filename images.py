@@ -0,0 +1,205 @@
+# images.py
+"""
+Variantes das fotos de produto (miniatura e média, em WebP e JPEG).
+
+O navegador continua subindo o original direto para o R2 (upload-url);
+depois chama POST /api/t/{slug}/uploads/confirm com a chave. Aqui o
+original é baixado do R2, redimensionado num pool de processos (Pillow é
+CPU puro; fora do event loop e sem disputar o GIL com as requisições) e
+as variantes sobem ao lado do original:
+
+    {slug}/{uuid}.jpg               original
+    {slug}/{uuid}.thumb.webp        menor lado = IMAGE_THUMB_SIZE (card do cardápio)
+    {slug}/{uuid}.thumb.jpg
+    {slug}/{uuid}.medium.webp       maior lado = IMAGE_MEDIUM_SIZE
+    {slug}/{uuid}.medium.jpg
+
+As URLs ficam em products.image_variants e o menu.js monta srcset com elas.
+As chaves das variantes derivam da do original (que tem um uuid), então
+são imutáveis e vão com cache de 1 ano.
+
+Pillow é opcional: sem o pacote, o confirm responde 503 e o cardápio
+segue com o original.
+"""
+import asyncio
+import io
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, Optional
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # pacote opcional
+    Image = ImageOps = None
+
+IMAGE_WORKERS = max(1, int(os.getenv("IMAGE_WORKERS", "2")))
+IMAGE_THUMB_SIZE = int(os.getenv("IMAGE_THUMB_SIZE", "240"))    # 2x do card de 110px
+IMAGE_MEDIUM_SIZE = int(os.getenv("IMAGE_MEDIUM_SIZE", "960"))
+IMAGE_WEBP_QUALITY = int(os.getenv("IMAGE_WEBP_QUALITY", "78"))
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "82"))
+IMAGE_MAX_BYTES = int(os.getenv("IMAGE_MAX_BYTES", str(20 * 1024 * 1024)))
+IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", str(40_000_000)))  # acima disso: recusa (bomba de descompressão)
+IMAGE_TIMEOUT = float(os.getenv("IMAGE_TIMEOUT", "60"))
+IMAGE_CACHE_CONTROL = os.getenv("IMAGE_CACHE_CONTROL", "public, max-age=31536000, immutable")
+
+# nome → (lado de referência, tamanho): "short" cobre o card quadrado (object-fit: cover)
+VARIANTS = {
+    "thumb": ("short", IMAGE_THUMB_SIZE),
+    "medium": ("long", IMAGE_MEDIUM_SIZE),
+}
+FORMATS = {"webp": ("WEBP", "image/webp", ".webp"), "jpeg": ("JPEG", "image/jpeg", ".jpg")}
+
+
+class ImageError(ValueError):
+    """Arquivo que não é uma imagem utilizável (vira 422 na API)."""
+
+
+def variant_key(original_key: str, name: str, fmt: str) -> str:
+    """slug/abc.png → slug/abc.thumb.webp"""
+    root = original_key.rsplit(".", 1)[0] if "." in original_key.rsplit("/", 1)[-1] else original_key
+    return f"{root}.{name}{FORMATS[fmt][2]}"
+
+
+def _target_size(width: int, height: int, side: str, size: int) -> tuple:
+    ref = min(width, height) if side == "short" else max(width, height)
+    if ref <= size:
+        return width, height  # nunca amplia
+    scale = size / ref
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def render_variants(data: bytes) -> Dict[str, Dict[str, Any]]:
+    """
+    Roda no processo do pool: bytes do original → {nome: {width, height,
+    webp: bytes, jpeg: bytes}}. Só recebe e devolve bytes (picklable).
+    """
+    Image.MAX_IMAGE_PIXELS = IMAGE_MAX_PIXELS
+    try:
+        img = Image.open(io.BytesIO(data))
+        img.load()
+    except Image.DecompressionBombError:
+        raise ImageError(f"imagem acima de {IMAGE_MAX_PIXELS} pixels") from None
+    except (OSError, SyntaxError):
+        raise ImageError("arquivo não é uma imagem reconhecida") from None
+    img = ImageOps.exif_transpose(img)  # foto de celular "deitada"
+    has_alpha = img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info)
+    img = img.convert("RGBA" if has_alpha else "RGB")
+
+    out: Dict[str, Dict[str, Any]] = {}
+    for name, (side, size) in VARIANTS.items():
+        w, h = _target_size(img.width, img.height, side, size)
+        resized = img.resize((w, h), Image.LANCZOS) if (w, h) != img.size else img
+        webp = io.BytesIO()
+        resized.save(webp, "WEBP", quality=IMAGE_WEBP_QUALITY, method=4)
+        flat = resized
+        if has_alpha:
+            # JPEG não tem transparência: fundo branco
+            flat = Image.new("RGB", resized.size, (255, 255, 255))
+            flat.paste(resized, mask=resized.getchannel("A"))
+        jpeg = io.BytesIO()
+        flat.save(jpeg, "JPEG", quality=IMAGE_JPEG_QUALITY, optimize=True, progressive=True)
+        out[name] = {"width": w, "height": h, "webp": webp.getvalue(), "jpeg": jpeg.getvalue()}
+    return out
+
+
+class ImageVariantPipeline:
+    """
+    Baixa o original, gera as variantes no pool de processos e sobe tudo
+    no R2. O pool nasce na primeira imagem (spawn: nada do app é herdado).
+    """
+
+    def __init__(self, workers: int = IMAGE_WORKERS, storage=None):
+        self.workers = workers
+        self._storage = storage
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self.processed = 0
+        self.failed = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.render_ms = 0.0
+
+    @property
+    def available(self) -> bool:
+        return Image is not None
+
+    @property
+    def storage(self):
+        if self._storage is None:
+            import r2_client  # só com R2 configurado
+
+            self._storage = r2_client
+        return self._storage
+
+    def _executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._pool
+
+    def _upload(self, original_key: str, rendered: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        variants: Dict[str, Dict[str, Any]] = {}
+        for name, item in rendered.items():
+            entry = {"width": item["width"], "height": item["height"]}
+            for fmt, (_, content_type, _) in FORMATS.items():
+                key = variant_key(original_key, name, fmt)
+                self.storage.put_object(key, item[fmt], content_type, cache_control=IMAGE_CACHE_CONTROL)
+                self.bytes_out += len(item[fmt])
+                entry[fmt] = self.storage.build_public_url(key)
+            variants[name] = entry
+        return variants
+
+    async def process(self, original_key: str) -> Dict[str, Dict[str, Any]]:
+        """Variantes do original já no R2 → {nome: {width, height, webp: url, jpeg: url}}."""
+        if not self.available:
+            raise RuntimeError("Pillow não instalado")
+        loop = asyncio.get_running_loop()
+        try:
+            data = await loop.run_in_executor(None, self.storage.get_object, original_key, IMAGE_MAX_BYTES)
+            t0 = time.perf_counter()
+            rendered = await asyncio.wait_for(
+                loop.run_in_executor(self._executor(), render_variants, data), IMAGE_TIMEOUT
+            )
+            self.render_ms += (time.perf_counter() - t0) * 1000
+            variants = await loop.run_in_executor(None, self._upload, original_key, rendered)
+        except BrokenProcessPool:
+            # Worker morreu (OOM numa foto enorme?): o próximo confirm sobe um pool novo
+            self.failed += 1
+            self.shutdown()
+            raise
+        except Exception:
+            self.failed += 1
+            raise
+        self.processed += 1
+        self.bytes_in += len(data)
+        sizes = ", ".join(f"{n} {v['width']}x{v['height']}" for n, v in variants.items())
+        logging.info(f"[images] {original_key}: {sizes}")
+        return variants
+
+    def shutdown(self) -> None:
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "available": self.available,
+            "workers": self.workers,
+            "pool_started": self._pool is not None,
+            "processed": self.processed,
+            "failed": self.failed,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "avg_render_ms": round(self.render_ms / self.processed, 1) if self.processed else 0.0,
+        }
+
+
+image_pipeline = ImageVariantPipeline()
@@ -0,0 +1,204 @@
+# journal.py
+"""
+Journal durável dos webhooks recebidos.
+
+Todo corpo de webhook é gravado cru em webhook_events ANTES do ack ao Meta.
+As gravações são agrupadas (group commit): os webhooks que chegam dentro de
+JOURNAL_LINGER_MS viram um único INSERT. Cada evento sabe quantas mensagens
+carrega; quando todas terminam, ele é marcado como processado (também em
+lote). O que sobrar sem marca após um crash é reprocessado no startup.
+"""
+import asyncio
+import logging
+import os
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+
+import storage
+
+JOURNAL_ENABLED = os.getenv("JOURNAL_ENABLED", "1").strip().lower() in ("1", "true", "yes")
+JOURNAL_BATCH_SIZE = int(os.getenv("JOURNAL_BATCH_SIZE", "200"))
+JOURNAL_LINGER_MS = float(os.getenv("JOURNAL_LINGER_MS", "5"))
+JOURNAL_ACK_FLUSH_INTERVAL = float(os.getenv("JOURNAL_ACK_FLUSH_INTERVAL", "1"))
+# Só reprocessa eventos mais velhos que isso (outra instância pode estar com eles)
+JOURNAL_REPLAY_GRACE = float(os.getenv("JOURNAL_REPLAY_GRACE", "120"))
+JOURNAL_RETENTION_DAYS = float(os.getenv("JOURNAL_RETENTION_DAYS", "7"))
+JOURNAL_PRUNE_INTERVAL = float(os.getenv("JOURNAL_PRUNE_INTERVAL", "3600"))  # 0 desliga
+
+# Chaves internas anexadas às mensagens enfileiradas
+EVENT_KEY = "_event_id"
+REPLAY_KEY = "_replay"
+# phone_number_id que recebeu a mensagem (define o tenant/fluxo)
+PHONE_KEY = "_phone_number_id"
+
+
+class EventJournal:
+    def __init__(self, batch_size: int = JOURNAL_BATCH_SIZE, linger_ms: float = JOURNAL_LINGER_MS):
+        self.batch_size = max(1, int(batch_size))
+        self.linger = max(0.0, linger_ms) / 1000.0
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._ack_task: Optional[asyncio.Task] = None
+        # Mensagens ainda em processamento por evento
+        self._remaining: Dict[int, int] = {}
+        self._failed: Set[int] = set()
+        self._done: List[int] = []
+        self.appended = 0
+        self.flushes = 0
+        self.marked = 0
+        self.replayed_events = 0
+
+    # ---------------- ciclo de vida ----------------
+    async def start(self) -> None:
+        if self._task is not None:
+            return
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._writer(), name="journal-writer")
+        self._ack_task = asyncio.create_task(self._acker(), name="journal-acker")
+
+    async def stop(self) -> None:
+        for t in (self._task, self._ack_task):
+            if t is not None:
+                t.cancel()
+        await asyncio.gather(*(t for t in (self._task, self._ack_task) if t), return_exceptions=True)
+        self._task = self._ack_task = None
+        # Grava o que ficou pendente
+        if self._pending:
+            await self._flush_appends()
+        await self._flush_done()
+
+    # ---------------- append (group commit) ----------------
+    async def append(self, raw: str) -> int:
+        """
+        Grava o corpo cru do webhook e devolve o id do evento.
+        Só retorna depois do commit (o ack ao Meta pode ser dado em seguida).
+        """
+        if self._task is None:
+            ids = await run_in_threadpool(storage.journal_append_many, [raw])
+            self.appended += 1
+            return ids[0]
+        fut = asyncio.get_running_loop().create_future()
+        self._pending.append((raw, fut))
+        self._wake.set()
+        return await fut
+
+    async def _writer(self) -> None:
+        while True:
+            await self._wake.wait()
+            # Espera um pouco para juntar mais webhooks no mesmo INSERT
+            if self.linger and len(self._pending) < self.batch_size:
+                await asyncio.sleep(self.linger)
+            self._wake.clear()
+            while self._pending:
+                await self._flush_appends()
+
+    async def _flush_appends(self) -> None:
+        batch, self._pending = self._pending[: self.batch_size], self._pending[self.batch_size:]
+        try:
+            ids = await run_in_threadpool(storage.journal_append_many, [raw for raw, _ in batch])
+        except Exception as e:
+            logging.exception("[journal] falha ao gravar lote")
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        for (_, fut), event_id in zip(batch, ids):
+            if not fut.done():
+                fut.set_result(event_id)
+        self.appended += len(batch)
+        self.flushes += 1
+
+    # ---------------- cursor de processamento ----------------
+    def expect(self, event_id: int, count: int) -> None:
+        """Registra quantas mensagens o evento carrega."""
+        if count <= 0:
+            self._done.append(event_id)
+        else:
+            self._remaining[event_id] = self._remaining.get(event_id, 0) + count
+
+    def discard(self, event_id: int) -> None:
+        """
+        Evento recusado (503): o Meta reenvia o payload como um evento novo,
+        então este é marcado como processado para o replay não duplicá-lo.
+        """
+        self._remaining.pop(event_id, None)
+        self._failed.discard(event_id)
+        self._done.append(event_id)
+
+    def in_flight(self, event_id: int) -> bool:
+        return event_id in self._remaining
+
+    def ack(self, item: Dict[str, Any], ok: bool = True) -> None:
+        """Uma mensagem do evento terminou (processada, descartada ou falhou)."""
+        event_id = item.get(EVENT_KEY)
+        if event_id is None or event_id not in self._remaining:
+            return
+        if not ok:
+            self._failed.add(event_id)
+        self._remaining[event_id] -= 1
+        if self._remaining[event_id] <= 0:
+            del self._remaining[event_id]
+            if event_id in self._failed:
+                # Fica sem marca: o replay pega de novo
+                self._failed.discard(event_id)
+            else:
+                self._done.append(event_id)
+
+    async def _acker(self) -> None:
+        while True:
+            await asyncio.sleep(JOURNAL_ACK_FLUSH_INTERVAL)
+            await self._flush_done()
+
+    async def _flush_done(self) -> None:
+        if not self._done:
+            return
+        done, self._done = self._done, []
+        try:
+            await run_in_threadpool(storage.journal_mark_processed, done)
+            self.marked += len(done)
+        except Exception:
+            logging.exception("[journal] falha ao marcar eventos processados")
+            self._done.extend(done)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": JOURNAL_ENABLED,
+            "running": self._task is not None,
+            "appended": self.appended,
+            "flushes": self.flushes,
+            "avg_batch": round(self.appended / self.flushes, 2) if self.flushes else 0.0,
+            "pending_writes": len(self._pending),
+            "in_flight_events": len(self._remaining),
+            "marked_processed": self.marked,
+            "replayed_events": self.replayed_events,
+        }
+
+
+def iter_values(data: Dict[str, Any]):
+    for entry in data.get("entry", []) or []:
+        for change in entry.get("changes", []) or []:
+            yield change.get("value", {}) or {}
+
+
+def iter_messages(data: Dict[str, Any]):
+    for value in iter_values(data):
+        for msg in value.get("messages", []) or []:
+            yield msg
+
+
+def tag_messages(event_id: Optional[int], data: Dict[str, Any], replay: bool = False) -> List[Dict[str, Any]]:
+    msgs = []
+    for value in iter_values(data):
+        phone_number_id = (value.get("metadata") or {}).get("phone_number_id")
+        for msg in value.get("messages", []) or []:
+            if phone_number_id:
+                msg[PHONE_KEY] = phone_number_id
+            msgs.append(msg)
+    for msg in msgs:
+        if event_id is not None:
+            msg[EVENT_KEY] = event_id
+        if replay:
+            msg[REPLAY_KEY] = True
+    return msgs
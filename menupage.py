@@ -0,0 +1,200 @@
+# menupage.py
+"""
+HTML do cardápio público renderizado no servidor (/m/{tenant}).
+
+O menu.html vira o template: a marca do tenant (tenant_branding) entra no
+título/cabeçalho, a primeira página de produtos entra pronta na grade e
+os mesmos itens vão num <script type="application/json"> para o menu.js
+continuar dali sem buscar de novo. Resultado: o primeiro produto aparece
+com uma requisição só.
+
+Cada tenant tem uma entrada em cache com o HTML já comprimido (gzip e,
+se houver o pacote, brotli), marcada com a versão do catálogo. Escrita em
+products ou na marca troca a versão (listener + public_catalog), e a
+próxima requisição renderiza de novo.
+"""
+import hashlib
+import html
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, NamedTuple, Optional
+
+import storage
+from assets import static_assets
+from catalog import format_price, public_catalog, public_item
+from precompress import compress_variants
+
+MENU_SSR = os.getenv("MENU_SSR", "1").strip().lower() in ("1", "true", "yes")
+MENU_SSR_ITEMS = int(os.getenv("MENU_SSR_ITEMS", "24"))  # produtos já no HTML
+MENU_CACHE_SIZE = int(os.getenv("MENU_CACHE_SIZE", "500"))  # tenants
+
+MENU_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "menu", "menu.html")
+
+# Trechos do menu.html trocados na renderização (o arquivo continua
+# funcionando sozinho, sem SSR)
+_TITLE = "<title>Cardápio</title>"
+_STORE_NAME = '<h1 id="storeName">Cardápio</h1>'
+_SUBTITLE = '<p id="storeSubtitle" class="subtitle"></p>'
+_BANNER = '<img id="banner" class="banner" alt="Banner da loja" />'
+_HEAD = "<!--bb:head-->"
+CARD_IMAGE_SIZES = "110px"  # largura da foto no card (menu.css)
+_PRODUCTS = "<!--bb:products-->"
+
+
+class RenderedMenu(NamedTuple):
+    version: int
+    bodies: Dict[str, bytes]  # "identity", "gzip", "br"
+    template_tag: str         # hash do menu.html (já com os estáticos com hash): deploy renderiza de novo
+
+    @property
+    def etag(self) -> str:
+        # Deploy que muda menu.html/js/css muda o ETag: nada de 304 com HTML
+        # apontando para estáticos de um build que não existe mais
+        return f'"m{self.version}.{self.template_tag}"'
+
+
+def _picture(p: Dict[str, Any], alt: str) -> str:
+    """<picture> com srcset das variantes (mesmo markup do menu.js); sem elas, o original."""
+    e = lambda v: html.escape(str(v or ""), quote=True)  # noqa: E731
+    images = p.get("images") or {}
+    sizes = [v for v in (images.get("thumb"), images.get("medium")) if v]
+    if not sizes:
+        return f'<img src="{e(p.get("image_url"))}" alt="{e(alt)}" loading="lazy" decoding="async" />'
+    srcset = lambda fmt: ", ".join(f'{v[fmt]} {v["width"]}w' for v in sizes)  # noqa: E731
+    first = sizes[0]
+    return (
+        f'<picture><source type="image/webp" srcset="{e(srcset("webp"))}" sizes="{CARD_IMAGE_SIZES}" />'
+        f'<img src="{e(first["jpeg"])}" srcset="{e(srcset("jpeg"))}" sizes="{CARD_IMAGE_SIZES}" '
+        f'width="{e(first["width"])}" height="{e(first["height"])}" alt="{e(alt)}" loading="lazy" decoding="async" />'
+        "</picture>"
+    )
+
+
+def _card(p: Dict[str, Any]) -> str:
+    e = lambda v: html.escape(str(v or ""), quote=True)  # noqa: E731
+    name = p.get("name") or "Produto"
+    return (
+        '<div class="product-card">'
+        f"{_picture(p, name)}"
+        '<div class="product-info">'
+        f"<h3>{e(name)}</h3>"
+        f'<p class="desc">{e(p.get("description"))}</p>'
+        '<div class="product-meta">'
+        f'<span class="product-price">{e(format_price(p.get("price_cents"), p.get("currency")))}</span>'
+        f'<button class="add-btn" data-id="{e(p.get("id"))}">+ Adicionar ao carrinho</button>'
+        "</div></div></div>"
+    )
+
+
+def render_menu(template: str, tenant_slug: str, items: List[Dict[str, Any]], next_cursor: Optional[str],
+                version: int, branding: Optional[Dict[str, Any]], head_extra: str = "") -> str:
+    branding = branding or {}
+    name = branding.get("brand_name") or tenant_slug
+    initial = {
+        "tenant": tenant_slug,
+        "version": version,
+        "items": items,
+        "next_cursor": next_cursor,
+        "branding": {k: branding.get(k) for k in storage.BRANDING_FIELDS},
+    }
+    # "</" escapado: o JSON não fecha o <script> antes da hora
+    initial_json = json.dumps(initial, ensure_ascii=False, separators=(",", ":")).replace("</", "<\\/")
+    head = head_extra + f'<script id="bb-initial" type="application/json">{initial_json}</script>'
+    if items:
+        cards = "".join(_card(p) for p in items)
+    else:
+        cards = '<div style="color:#94a3b8">Nenhum produto disponível no momento.</div>'
+
+    out = template.replace(_TITLE, f"<title>{html.escape(name)} — Cardápio</title>", 1)
+    out = out.replace(_STORE_NAME, f'<h1 id="storeName">{html.escape(name)}</h1>', 1)
+    if branding.get("subtitle"):
+        out = out.replace(_SUBTITLE, f'<p id="storeSubtitle" class="subtitle">{html.escape(branding["subtitle"])}</p>', 1)
+    if branding.get("banner_url"):
+        out = out.replace(
+            _BANNER,
+            f'<img id="banner" class="banner" alt="Banner da loja" src="{html.escape(branding["banner_url"], quote=True)}" />',
+            1,
+        )
+    out = out.replace(_HEAD, head, 1)
+    return out.replace(_PRODUCTS, cards, 1)
+
+
+class MenuPageCache:
+    """
+    HTML renderizado e comprimido por tenant (LRU), válido enquanto a
+    versão do catálogo não muda. Thread-safe.
+    """
+
+    def __init__(self, maxsize: int = MENU_CACHE_SIZE, items: int = MENU_SSR_ITEMS, template_path: str = MENU_FILE):
+        self.maxsize = max(0, int(maxsize))
+        self.items = max(1, int(items))
+        self.template_path = template_path
+        self._template: Optional[tuple] = None  # (mtime, texto, hash)
+        self._items: "OrderedDict[str, RenderedMenu]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.renders = 0
+
+    def template(self) -> tuple:
+        """(mtime, texto, hash) do menu.html, relido só quando o arquivo muda."""
+        path = static_assets.built_path(self.template_path)  # com os /static/ já com hash
+        mtime = os.path.getmtime(path)
+        if self._template is None or self._template[0] != mtime:
+            with open(path, encoding="utf-8") as f:
+                text = f.read()
+            self._template = (mtime, text, hashlib.sha256(text.encode("utf-8")).hexdigest()[:12])
+        return self._template
+
+    def get(self, tenant_slug: str, head_extra: str = "") -> RenderedMenu:
+        entry = self._items.get(tenant_slug)
+        _, template, tag = self.template()
+        if (entry is not None and entry.template_tag == tag
+                and entry.version == public_catalog.version(tenant_slug)):
+            with self._lock:
+                self._items.move_to_end(tenant_slug)
+                self.hits += 1
+            return entry
+        self.misses += 1
+        page = storage.page_products(tenant_slug, limit=self.items)
+        branding = storage.get_branding(tenant_slug)
+        version = public_catalog.remember_version(tenant_slug, page.version)
+        text = render_menu(
+            template, tenant_slug, [public_item(p) for p in page.items], page.next_cursor,
+            page.version, branding, head_extra,
+        )
+        entry = RenderedMenu(page.version, compress_variants(text.encode("utf-8")), tag)
+        self.renders += 1
+        # Só guarda se ninguém escreveu no meio (senão a próxima renderiza de novo)
+        if self.maxsize and version == page.version:
+            with self._lock:
+                self._items[tenant_slug] = entry
+                self._items.move_to_end(tenant_slug)
+                while len(self._items) > self.maxsize:
+                    self._items.popitem(last=False)
+        return entry
+
+    def invalidate(self, tenant_slug: str, version: Optional[int] = None) -> None:
+        with self._lock:
+            self._items.pop(tenant_slug, None)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        with self._lock:
+            sizes = [{k: len(v) for k, v in e.bodies.items()} for e in self._items.values()]
+        return {
+            "enabled": MENU_SSR,
+            "tenants": len(sizes),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "renders": self.renders,
+            "bytes": {enc: sum(s.get(enc, 0) for s in sizes) for enc in ("identity", "gzip", "br")},
+        }
+
+
+menu_pages = MenuPageCache()
+storage.add_products_listener(menu_pages.invalidate)
@@ -0,0 +1,198 @@
+# metrics.py
+"""
+Métricas Prometheus da pipeline do webhook.
+
+- Histograma por etapa (parse, journal, idempotency, pause_check, next_reply,
+  send, persist) e do request inteiro;
+- Contadores por tipo de mensagem e por status de envio;
+- Gauges lidos na hora do scrape a partir dos stats() já existentes
+  (pipeline, outbox, rate limiter, journal, cache de idempotência);
+- Log do payload do webhook amostrado e estruturado (sem str() do payload
+  inteiro a cada request).
+
+O custo de instrumentação por request é medido em bench/metrics_overhead.py
+e deve ficar abaixo de METRICS_OVERHEAD_BUDGET_US.
+"""
+import json
+import logging
+import os
+import random
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Histogram, REGISTRY, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+
+WEBHOOK_LOG_SAMPLE_RATE = float(os.getenv("WEBHOOK_LOG_SAMPLE_RATE", "0.01"))
+WEBHOOK_LOG_PAYLOAD = os.getenv("WEBHOOK_LOG_PAYLOAD", "0").strip().lower() in ("1", "true", "yes")
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+# Orçamento de overhead de instrumentação por request (microssegundos)
+METRICS_OVERHEAD_BUDGET_US = float(os.getenv("METRICS_OVERHEAD_BUDGET_US", "50"))
+
+# Buckets pensados para I/O de rede (Neon/Graph): 1ms .. 10s
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+WEBHOOK_STAGE_SECONDS = Histogram(
+    "blackbot_webhook_stage_seconds",
+    "Duração de cada etapa do processamento do webhook",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+WEBHOOK_REQUEST_SECONDS = Histogram(
+    "blackbot_webhook_request_seconds",
+    "Duração do POST /webhook até o ack ao Meta",
+    buckets=LATENCY_BUCKETS,
+)
+WEBHOOK_MESSAGES = Counter(
+    "blackbot_webhook_messages_total",
+    "Mensagens recebidas por tipo",
+    ["type"],
+)
+SEND_TOTAL = Counter(
+    "blackbot_send_total",
+    "Envios à Cloud API por status HTTP",
+    ["status"],
+)
+
+# Filhos dos histogramas pré-resolvidos (labels() custa um lookup com lock)
+_STAGES: Dict[str, Any] = {}
+
+
+def _stage(name: str):
+    child = _STAGES.get(name)
+    if child is None:
+        child = _STAGES[name] = WEBHOOK_STAGE_SECONDS.labels(stage=name)
+    return child
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        _stage(name).observe(time.perf_counter() - t0)
+
+
+def observe_stage(name: str, seconds: float) -> None:
+    _stage(name).observe(seconds)
+
+
+def count_message(msg_type: str) -> None:
+    WEBHOOK_MESSAGES.labels(type=msg_type or "unknown").inc()
+
+
+def count_send(status: int) -> None:
+    SEND_TOTAL.labels(status=str(status)).inc()
+
+
+# -------------------------------------------------------------------
+# Gauges lidos no scrape
+# -------------------------------------------------------------------
+class StatsCollector:
+    """
+    Publica como gauges os campos numéricos de funções stats() registradas.
+    Custo zero fora do scrape.
+
+    Dicts aninhados de formato fixo viram nomes (bytes.gzip →
+    blackbot_x_bytes_gzip). Mapas indexados por dado (phone_number_id,
+    tenant) precisam ser declarados em `labels`: a chave vira label de uma
+    família só, ex. ratelimit numbers → blackbot_ratelimit_tokens{phone_number_id=...}.
+    """
+
+    def __init__(self):
+        self._sources: Dict[str, Callable[[], Dict[str, Any]]] = {}
+        self._labels: Dict[str, Dict[str, str]] = {}
+
+    def register(self, name: str, fn: Callable[[], Dict[str, Any]],
+                 labels: Optional[Dict[str, str]] = None) -> None:
+        """labels: {campo do stats com mapa por id: nome do label}."""
+        self._sources[name] = fn
+        self._labels[name] = dict(labels or {})
+
+    def collect(self):
+        for name, fn in self._sources.items():
+            try:
+                data = fn()
+            except Exception:
+                logging.exception(f"[metrics] stats de {name} falhou")
+                continue
+            labeled = self._labels.get(name, {})
+            for key, value in _flatten({k: v for k, v in data.items() if k not in labeled}):
+                if _numeric(value):
+                    yield GaugeMetricFamily(f"blackbot_{name}_{key}", f"{name}.{key}", value=float(value))
+            for key, label in labeled.items():
+                yield from _labeled_families(name, key, label, data.get(key) or {})
+
+
+def _numeric(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _labeled_families(name: str, key: str, label: str, items: Dict[str, Any]):
+    """{id: {campo: n}} → uma família por campo; {id: n} → uma família só."""
+    families: Dict[str, GaugeMetricFamily] = {}
+
+    def family(metric: str, doc: str) -> GaugeMetricFamily:
+        if metric not in families:
+            families[metric] = GaugeMetricFamily(metric, doc, labels=[label])
+        return families[metric]
+
+    for ident, value in items.items():
+        if isinstance(value, dict):
+            for field, v in _flatten(value):
+                if _numeric(v):
+                    family(f"blackbot_{name}_{field}", f"{name}.{key}[{label}].{field}").add_metric([str(ident)], float(v))
+        elif _numeric(value):
+            family(f"blackbot_{name}_{key}", f"{name}.{key}[{label}]").add_metric([str(ident)], float(value))
+    yield from families.values()
+
+
+def _flatten(data: Dict[str, Any], prefix: str = ""):
+    for k, v in data.items():
+        key = f"{prefix}{k}".replace("-", "_").replace(".", "_").replace(":", "_")
+        if isinstance(v, dict):
+            yield from _flatten(v, f"{key}_")
+        else:
+            yield key, v
+
+
+stats_collector = StatsCollector()
+REGISTRY.register(stats_collector)
+
+
+def render_latest() -> bytes:
+    return generate_latest(REGISTRY)
+
+
+# -------------------------------------------------------------------
+# Log amostrado do webhook
+# -------------------------------------------------------------------
+def log_webhook_sample(data: Dict[str, Any], event_id: Any = None) -> None:
+    """
+    Loga 1 em cada ~1/WEBHOOK_LOG_SAMPLE_RATE webhooks, como JSON com um
+    resumo (tipos, contagens). O payload inteiro só entra com WEBHOOK_LOG_PAYLOAD=1.
+    """
+    if WEBHOOK_LOG_SAMPLE_RATE <= 0 or random.random() >= WEBHOOK_LOG_SAMPLE_RATE:
+        return
+    types: Dict[str, int] = {}
+    statuses = 0
+    for entry in data.get("entry", []) or []:
+        for change in entry.get("changes", []) or []:
+            value = change.get("value", {}) or {}
+            for msg in value.get("messages", []) or []:
+                t = msg.get("type") or "unknown"
+                types[t] = types.get(t, 0) + 1
+            statuses += len(value.get("statuses", []) or [])
+    record: Dict[str, Any] = {
+        "event": "webhook",
+        "event_id": event_id,
+        "object": data.get("object"),
+        "entries": len(data.get("entry", []) or []),
+        "messages": types,
+        "statuses": statuses,
+    }
+    if WEBHOOK_LOG_PAYLOAD:
+        record["payload"] = data
+    logging.info(json.dumps(record, ensure_ascii=False, default=str))
@@ -0,0 +1,154 @@
+# outbox.py
+"""
+Dispatcher da outbox: reenvia mensagens cuja entrega falhou.
+
+Em loop, reserva um lote vencido (storage.claim_outbox, FOR UPDATE SKIP LOCKED),
+envia em paralelo pelo cliente da Cloud API e grava o resultado do lote numa
+única transação. Falhas temporárias voltam para 'pending' com backoff
+exponencial; erros definitivos ou tentativas esgotadas viram 'dead'.
+"""
+import asyncio
+import logging
+import os
+import random
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from fastapi.concurrency import run_in_threadpool
+
+import storage
+from whatsapp import SendResult
+
+OUTBOX_DISPATCH_INTERVAL = float(os.getenv("OUTBOX_DISPATCH_INTERVAL", "5"))  # 0 desliga
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "50"))
+OUTBOX_CONCURRENCY = int(os.getenv("OUTBOX_CONCURRENCY", "10"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_BACKOFF_BASE = float(os.getenv("OUTBOX_BACKOFF_BASE", "5"))  # segundos
+OUTBOX_BACKOFF_MAX = float(os.getenv("OUTBOX_BACKOFF_MAX", "900"))
+OUTBOX_LEASE_SECONDS = float(os.getenv("OUTBOX_LEASE_SECONDS", "120"))
+OUTBOX_MAX_AGE_HOURS = float(os.getenv("OUTBOX_MAX_AGE_HOURS", "24"))
+
+# Códigos do Graph que indicam limite/instabilidade (vale tentar de novo)
+RETRYABLE_ERROR_CODES = {1, 2, 4, 80007, 130429, 131000, 131016, 131056}
+
+Sender = Callable[[str, str], Awaitable[SendResult]]
+
+
+def is_retryable(result: SendResult) -> bool:
+    if result.error_code in RETRYABLE_ERROR_CODES:
+        return True
+    return result.status >= 500 or result.status in (408, 429)
+
+
+def backoff_delay(attempts: int, base: float = OUTBOX_BACKOFF_BASE, cap: float = OUTBOX_BACKOFF_MAX) -> float:
+    # Exponencial com jitter: base * 2^(n-1), limitado a `cap`
+    delay = min(cap, base * (2 ** max(0, attempts - 1)))
+    return delay * random.uniform(0.8, 1.2)
+
+
+class OutboxDispatcher:
+    def __init__(
+        self,
+        sender: Sender,
+        interval: float = OUTBOX_DISPATCH_INTERVAL,
+        batch_size: int = OUTBOX_BATCH_SIZE,
+        concurrency: int = OUTBOX_CONCURRENCY,
+        max_attempts: int = OUTBOX_MAX_ATTEMPTS,
+    ):
+        self.sender = sender
+        self.interval = float(interval)
+        self.batch_size = max(1, int(batch_size))
+        self.concurrency = max(1, int(concurrency))
+        self.max_attempts = max(1, int(max_attempts))
+        self._task: Optional[asyncio.Task] = None
+        self.sent = 0
+        self.retried = 0
+        self.dead = 0
+        self.expired = 0
+        self.last_lag_s = 0.0
+        # (timestamp, qtd enviada) para calcular vazão recente
+        self._window: deque = deque(maxlen=120)
+
+    @property
+    def enabled(self) -> bool:
+        return self.interval > 0
+
+    def start(self) -> None:
+        if not self.enabled or self._task is not None:
+            return
+        self._task = asyncio.create_task(self._loop(), name="outbox-dispatcher")
+        logging.info(f"[outbox] dispatcher iniciado batch={self.batch_size} a cada {self.interval:g}s")
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def _loop(self) -> None:
+        last_expire = 0.0
+        while True:
+            try:
+                if time.monotonic() - last_expire > 300:
+                    self.expired += await run_in_threadpool(storage.expire_outbox, OUTBOX_MAX_AGE_HOURS)
+                    last_expire = time.monotonic()
+                claimed = await self.dispatch_once()
+            except Exception:
+                logging.exception("[outbox] falha no ciclo do dispatcher")
+                claimed = 0
+            # Lote cheio: provavelmente há mais pendências, segue sem dormir
+            if claimed < self.batch_size:
+                await asyncio.sleep(self.interval)
+
+    async def dispatch_once(self) -> int:
+        rows = await run_in_threadpool(storage.claim_outbox, self.batch_size, OUTBOX_LEASE_SECONDS)
+        if not rows:
+            self.last_lag_s = 0.0
+            return 0
+
+        now = time.time()
+        self.last_lag_s = max(now - r["created_at"].timestamp() for r in rows)
+
+        sem = asyncio.Semaphore(self.concurrency)
+
+        async def send(row: Dict[str, Any]):
+            async with sem:
+                return row, await self.sender(row["wa_id"], row["message"])
+
+        sent, retry, dead = [], [], []
+        for row, result in await asyncio.gather(*(send(r) for r in rows)):
+            if result.ok:
+                sent.append((row["id"], result.message_id))
+                continue
+            err = f"{result.status} {result.error_code or ''} {result.error or ''}".strip()[:500]
+            if is_retryable(result) and row["attempts"] < self.max_attempts:
+                retry.append((row["id"], err, backoff_delay(row["attempts"])))
+            else:
+                dead.append((row["id"], err))
+
+        await run_in_threadpool(storage.complete_outbox, sent, retry, dead)
+        self.sent += len(sent)
+        self.retried += len(retry)
+        self.dead += len(dead)
+        self._window.append((time.monotonic(), len(sent)))
+        logging.info(f"[outbox] lote={len(rows)} enviados={len(sent)} retry={len(retry)} dead={len(dead)}")
+        return len(rows)
+
+    def throughput(self, window_s: float = 60.0) -> float:
+        cutoff = time.monotonic() - window_s
+        return sum(n for ts, n in self._window if ts >= cutoff) / window_s
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "running": self._task is not None,
+            "batch_size": self.batch_size,
+            "sent": self.sent,
+            "retried": self.retried,
+            "dead": self.dead,
+            "expired": self.expired,
+            "sent_per_s_1m": round(self.throughput(), 3),
+            "last_batch_lag_s": round(self.last_lag_s, 3),
+        }
@@ -0,0 +1,274 @@
+# pipeline.py
+"""
+Pipeline assíncrona do webhook.
+
+No modo "queue" o webhook só valida e enfileira as mensagens; workers asyncio
+fazem idempotência, FSM e envio fora do caminho da resposta ao Meta.
+
+Uma etapa de entrada (intake) junta os payloads que chegaram e roda o filtro
+de idempotência em lote (um round-trip ao banco por lote, não por mensagem).
+Depois o trabalho é particionado (sharding) por wa_id: cada shard tem sua fila
+limitada e um único worker, então as mensagens de um contato são processadas
+em ordem enquanto contatos diferentes rodam em paralelo. As filas são
+drenadas no shutdown.
+"""
+import asyncio
+import logging
+import os
+import zlib
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+# "inline" (padrão, processa dentro do request) | "queue" (ack imediato + workers)
+WEBHOOK_MODE = os.getenv("WEBHOOK_MODE", "inline").strip().lower()
+# Nº de shards (= workers). PIPELINE_WORKERS mantido por compatibilidade.
+PIPELINE_SHARDS = int(os.getenv("PIPELINE_SHARDS", os.getenv("PIPELINE_WORKERS", "8")))
+# Capacidade de CADA fila de shard
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "500"))
+# Quanto o webhook espera por espaço na fila antes de devolver 503 ao Meta
+PIPELINE_ENQUEUE_TIMEOUT = float(os.getenv("PIPELINE_ENQUEUE_TIMEOUT", "2"))
+# Máx. de mensagens que o intake junta numa única checagem de idempotência
+PIPELINE_INTAKE_BATCH = int(os.getenv("PIPELINE_INTAKE_BATCH", "500"))
+# Quanto o shutdown espera as filas esvaziarem antes de cancelar os workers
+PIPELINE_DRAIN_TIMEOUT = float(os.getenv("PIPELINE_DRAIN_TIMEOUT", "25"))
+
+Handler = Callable[[Dict[str, Any]], Awaitable[None]]
+# Recebe um lote de itens e devolve só os que devem ser processados
+Prefilter = Callable[[List[Dict[str, Any]]], Awaitable[List[Dict[str, Any]]]]
+# Item descartado sem processar (prefilter falhou): o dono decide o que fazer
+OnDrop = Callable[[Dict[str, Any]], None]
+
+
+class PipelineFull(Exception):
+    """Fila cheia: o chamador deve sinalizar backpressure (ex.: HTTP 503)."""
+
+
+class PipelineClosed(Exception):
+    """Pipeline parada/drenando: não aceita novos itens."""
+
+
+def shard_for(key: Optional[str], shards: int) -> int:
+    # crc32 é estável entre processos (hash() de str não é)
+    return zlib.crc32((key or "").encode("utf-8")) % shards
+
+
+class KeyedLocks:
+    """
+    Um asyncio.Lock por chave (wa_id), liberado da memória quando ninguém o usa.
+    Serializa o processamento de um mesmo contato no modo inline.
+    """
+
+    def __init__(self):
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._refs: Dict[str, int] = defaultdict(int)
+
+    @asynccontextmanager
+    async def hold(self, key: str):
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        self._refs[key] += 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._refs[key] -= 1
+            if self._refs[key] <= 0:
+                self._refs.pop(key, None)
+                self._locks.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+
+class WebhookPipeline:
+    def __init__(
+        self,
+        handler: Handler,
+        prefilter: Optional[Prefilter] = None,
+        shards: int = PIPELINE_SHARDS,
+        maxsize: int = PIPELINE_QUEUE_SIZE,
+        key: Callable[[Dict[str, Any]], Optional[str]] = lambda item: item.get("from"),
+        on_drop: Optional[OnDrop] = None,
+    ):
+        self.handler = handler
+        self.prefilter = prefilter
+        self.on_drop = on_drop
+        self.shards = max(1, int(shards))
+        self.maxsize = max(1, int(maxsize))
+        self.key = key
+        self.locks = KeyedLocks()
+        self._intake: Optional[asyncio.Queue] = None
+        self._intake_task: Optional[asyncio.Task] = None
+        self._queues: List[asyncio.Queue] = []
+        self._tasks: List[asyncio.Task] = []
+        self._accepting = False
+        self.filtered = 0
+        self.processed = 0
+        self.failed = 0
+        self.dropped = 0
+        self.rejected = 0
+
+    @property
+    def running(self) -> bool:
+        return self._accepting
+
+    async def start(self) -> None:
+        if self._tasks:
+            return
+        self._intake = asyncio.Queue(maxsize=self.maxsize)
+        self._queues = [asyncio.Queue(maxsize=self.maxsize) for _ in range(self.shards)]
+        self._tasks = [
+            asyncio.create_task(self._worker(i), name=f"pipeline-shard-{i}")
+            for i in range(self.shards)
+        ]
+        self._intake_task = asyncio.create_task(self._intake_loop(), name="pipeline-intake")
+        self._accepting = True
+        logging.info(f"[pipeline] iniciada shards={self.shards} maxsize/shard={self.maxsize}")
+
+    async def submit(self, items: List[Dict[str, Any]], timeout: float = PIPELINE_ENQUEUE_TIMEOUT) -> None:
+        """
+        Enfileira os itens de um payload na etapa de intake. Espera até
+        `timeout` segundos por espaço; se a fila continuar cheia, levanta
+        PipelineFull.
+        """
+        if not self._accepting or self._intake is None:
+            raise PipelineClosed()
+        if not items:
+            return
+        try:
+            await asyncio.wait_for(self._intake.put(items), timeout=timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise PipelineFull()
+
+    async def _apply_prefilter(self, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        if self.prefilter is None or not items:
+            return items
+        kept = await self.prefilter(items)
+        self.filtered += len(items) - len(kept)
+        return kept
+
+    async def _prefilter_or_drop(self, items: List[Dict[str, Any]], attempts: int, where: str) -> List[Dict[str, Any]]:
+        """
+        Prefilter com retentativas; se todas falharem, o lote é descartado e
+        cada item passa pelo on_drop (ex.: journal marca como falho para o
+        replay entregar de novo).
+        """
+        for attempt in range(attempts):
+            try:
+                return await self._apply_prefilter(items)
+            except Exception:
+                logging.exception(f"[pipeline:{where}] prefilter falhou (tentativa {attempt + 1})")
+                if attempt + 1 < attempts:
+                    await asyncio.sleep(0.5 * (attempt + 1))
+        self.failed += len(items)
+        self.dropped += len(items)
+        if self.on_drop is not None:
+            for item in items:
+                try:
+                    self.on_drop(item)
+                except Exception:
+                    logging.exception(f"[pipeline:{where}] on_drop falhou")
+        return []
+
+    async def _intake_loop(self) -> None:
+        assert self._intake is not None
+        while True:
+            batches = [await self._intake.get()]
+            # Junta o que mais estiver esperando numa única checagem
+            size = len(batches[0])
+            while size < PIPELINE_INTAKE_BATCH and not self._intake.empty():
+                b = self._intake.get_nowait()
+                batches.append(b)
+                size += len(b)
+            try:
+                items = await self._prefilter_or_drop([it for b in batches for it in b], 3, "intake")
+                # Distribui nos shards preservando a ordem de chegada
+                for item in items:
+                    await self._queues[shard_for(self.key(item), self.shards)].put(item)
+            finally:
+                for _ in batches:
+                    self._intake.task_done()
+
+    async def run_inline(self, items: Iterable[Dict[str, Any]]) -> None:
+        """
+        Processa os itens dentro do request: em ordem por contato, contatos
+        diferentes em paralelo. O lock por wa_id evita que dois webhooks
+        simultâneos do mesmo contato corram sobre a mesma sessão.
+        Prefilter com falha: os itens vão para o on_drop (sem retentativa,
+        o request está esperando) e o webhook responde normalmente.
+        """
+        groups: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        for item in await self._prefilter_or_drop(list(items), 1, "inline"):
+            groups[self.key(item) or ""].append(item)
+
+        async def run_group(k: str, group: List[Dict[str, Any]]):
+            async with self.locks.hold(k):
+                for item in group:
+                    try:
+                        await self.handler(item)
+                        self.processed += 1
+                    except Exception:
+                        self.failed += 1
+                        logging.exception("[pipeline:inline] falha ao processar item")
+
+        await asyncio.gather(*(run_group(k, g) for k, g in groups.items()))
+
+    async def stop(self, timeout: float = PIPELINE_DRAIN_TIMEOUT) -> None:
+        """
+        Para de aceitar itens, espera as filas esvaziarem (até `timeout`) e
+        encerra os workers.
+        """
+        self._accepting = False
+        if self._tasks and self._intake is not None:
+            async def drain():
+                await self._intake.join()
+                await asyncio.gather(*(q.join() for q in self._queues))
+            try:
+                await asyncio.wait_for(drain(), timeout=timeout)
+            except asyncio.TimeoutError:
+                logging.warning(
+                    f"[pipeline] drain expirou com {self.queue_depth()} itens pendentes"
+                )
+        tasks = self._tasks + ([self._intake_task] if self._intake_task else [])
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = []
+        self._intake_task = None
+        logging.info("[pipeline] parada")
+
+    async def _worker(self, idx: int) -> None:
+        q = self._queues[idx]
+        while True:
+            item = await q.get()
+            try:
+                await self.handler(item)
+                self.processed += 1
+            except Exception:
+                self.failed += 1
+                logging.exception(f"[pipeline:shard-{idx}] falha ao processar item")
+            finally:
+                q.task_done()
+
+    def queue_depth(self) -> int:
+        return sum(q.qsize() for q in self._queues)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "mode": WEBHOOK_MODE,
+            "running": self._accepting,
+            "shards": self.shards,
+            "maxsize_per_shard": self.maxsize,
+            "intake_depth": self._intake.qsize() if self._intake is not None else 0,
+            "queue_depth": self.queue_depth(),
+            "shard_depths": [q.qsize() for q in self._queues],
+            "inline_contacts_locked": len(self.locks),
+            "filtered": self.filtered,
+            "processed": self.processed,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "rejected": self.rejected,
+        }
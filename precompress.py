@@ -0,0 +1,69 @@
+# precompress.py
+"""
+Compressão feita uma vez e servida muitas: variantes gzip/brotli de um
+conteúdo e a escolha da variante pelo Accept-Encoding do cliente. Também o
+If-None-Match, igual em todos os endpoints com ETag.
+
+brotli é opcional: sem o pacote, só gzip.
+"""
+import gzip
+from typing import Dict, Optional
+
+try:
+    import brotli
+except ImportError:  # pacote opcional
+    brotli = None
+
+# Preferência do servidor quando o cliente aceita mais de uma
+ENCODINGS = ("br", "gzip")
+
+
+def compress_variants(data: bytes, min_size: int = 256) -> Dict[str, bytes]:
+    """{"identity": data, "gzip": ..., "br": ...}; pequeno demais fica só identity."""
+    out = {"identity": data}
+    if len(data) < min_size:
+        return out
+    out["gzip"] = gzip.compress(data, compresslevel=9, mtime=0)
+    if brotli is not None:
+        out["br"] = brotli.compress(data, quality=11)
+    return out
+
+
+def accepted_encodings(accept_encoding: Optional[str]) -> Dict[str, float]:
+    """Accept-Encoding → {codificação: q}."""
+    accepted: Dict[str, float] = {}
+    for part in (accept_encoding or "").split(","):
+        token, _, params = part.strip().partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[token] = q
+    return accepted
+
+
+def pick_encoding(accept_encoding: Optional[str], available) -> str:
+    """Melhor variante disponível que o cliente aceita; senão identity."""
+    accepted = accepted_encodings(accept_encoding)
+    wildcard = accepted.get("*", 0.0)
+    for enc in ENCODINGS:
+        if enc in available and accepted.get(enc, wildcard) > 0:
+            return enc
+    return "identity"
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match: lista separada por vírgula, aceita W/ e '*'."""
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*" or tag == etag or tag.removeprefix("W/") == etag:
+            return True
+    return False
@@ -10,6 +10,8 @@ R2_ACCESS_KEY_ID = os.getenv("R2_ACCESS_KEY_ID")
 R2_SECRET_ACCESS_KEY = os.getenv("R2_SECRET_ACCESS_KEY")
 R2_BUCKET = os.getenv("R2_BUCKET")
 R2_PUBLIC_BASE = os.getenv("R2_PUBLIC_BASE")  # ex.: https://pub-XXXXX.r2.dev/blackbot-assets
+# Endpoint S3 alternativo (MinIO/moto locais em dev/teste); vazio = R2 da conta
+R2_ENDPOINT_URL = os.getenv("R2_ENDPOINT_URL") or None
 
 missing = [k for k, v in {
     "R2_ACCOUNT_ID": R2_ACCOUNT_ID,
@@ -24,7 +26,7 @@ if missing:
 _session = boto3.session.Session()
 _s3 = _session.client(
     "s3",
-    endpoint_url=f"https://{R2_ACCOUNT_ID}.r2.cloudflarestorage.com",
+    endpoint_url=R2_ENDPOINT_URL or f"https://{R2_ACCOUNT_ID}.r2.cloudflarestorage.com",
     aws_access_key_id=R2_ACCESS_KEY_ID,
     aws_secret_access_key=R2_SECRET_ACCESS_KEY,
     config=Config(signature_version="s3v4"),
@@ -65,4 +67,44 @@ def presign_put_url(key: str, content_type: str, expires_in: int = 600) -> str:
         ExpiresIn=expires_in,
         HttpMethod="PUT",
     )
-    return url
\ No newline at end of file
+    return url
+
+def put_object(key: str, body: bytes, content_type: str, cache_control: str = None,
+               content_encoding: str = None) -> None:
+    """Upload direto pelo servidor (snapshots, variantes de imagem)."""
+    params = {
+        "Bucket": R2_BUCKET,
+        "Key": key,
+        "Body": body,
+        "ContentType": content_type,
+    }
+    if cache_control:
+        params["CacheControl"] = cache_control
+    if content_encoding:
+        params["ContentEncoding"] = content_encoding
+    _s3.put_object(**params)
+
+def list_keys(prefix: str) -> list:
+    keys = []
+    paginator = _s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=R2_BUCKET, Prefix=prefix):
+        keys.extend(obj["Key"] for obj in page.get("Contents") or [])
+    return keys
+
+def delete_keys(keys: list) -> None:
+    # delete_objects aceita até 1000 chaves por chamada
+    for i in range(0, len(keys), 1000):
+        chunk = keys[i:i + 1000]
+        _s3.delete_objects(Bucket=R2_BUCKET, Delete={"Objects": [{"Key": k} for k in chunk], "Quiet": True})
+
+class ObjectTooLarge(Exception):
+    """Objeto maior que o limite pedido em get_object."""
+
+
+def get_object(key: str, max_bytes: int = None) -> bytes:
+    """Lê um objeto inteiro (ex.: original de uma foto); ObjectTooLarge acima de max_bytes."""
+    obj = _s3.get_object(Bucket=R2_BUCKET, Key=key)
+    if max_bytes is not None and obj.get("ContentLength", 0) > max_bytes:
+        obj["Body"].close()
+        raise ObjectTooLarge(f"objeto acima de {max_bytes} bytes")
+    return obj["Body"].read()
@@ -0,0 +1,190 @@
+# ratelimit.py
+"""
+Limitador de envio para a Cloud API.
+
+Token bucket por PHONE_NUMBER_ID (vazão do número) e por par
+número→destinatário (limite de pares do WhatsApp). Quem não tem token espera
+numa fila FIFO em vez de falhar; a fila é limitada e, se lotar, o envio
+volta como 429 local (e cai na outbox). Respostas de throttling da API
+(429, 130429, 131056) pausam o bucket pelo Retry-After informado e o envio
+é reenfileirado.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict
+
+from whatsapp import SendResult, WhatsAppClient
+
+# Vazão por número (msgs/s) e rajada
+SEND_RATE_PER_SECOND = float(os.getenv("SEND_RATE_PER_SECOND", "80"))
+SEND_BURST = float(os.getenv("SEND_BURST", "80"))
+# Limite por par número→contato
+SEND_PAIR_RATE_PER_MINUTE = float(os.getenv("SEND_PAIR_RATE_PER_MINUTE", "10"))
+SEND_PAIR_BURST = float(os.getenv("SEND_PAIR_BURST", "45"))
+# Máx. de envios esperando token (por bucket) antes de recusar localmente
+SEND_QUEUE_MAX = int(os.getenv("SEND_QUEUE_MAX", "1000"))
+# Reenfileiramentos após throttling da API antes de desistir (outbox assume)
+SEND_THROTTLE_RETRIES = int(os.getenv("SEND_THROTTLE_RETRIES", "3"))
+SEND_DEFAULT_RETRY_AFTER = float(os.getenv("SEND_DEFAULT_RETRY_AFTER", "2"))
+SEND_PAIR_BUCKETS_MAX = int(os.getenv("SEND_PAIR_BUCKETS_MAX", "10000"))
+
+# Throttling do número (global) x do par (destinatário)
+NUMBER_THROTTLE_CODES = {4, 80007, 130429}
+PAIR_THROTTLE_CODES = {131056}
+
+
+class QueueOverflow(Exception):
+    pass
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float, max_waiting: int = SEND_QUEUE_MAX):
+        self.rate = max(1e-6, float(rate))
+        self.burst = max(1.0, float(burst))
+        self.max_waiting = max_waiting
+        self.tokens = self.burst
+        self.blocked_until = 0.0
+        self.waiting = 0
+        self._last = time.monotonic()
+        # Lock do asyncio é FIFO: quem chegou antes recebe o token antes
+        self._lock = asyncio.Lock()
+        self.acquired = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def penalize(self, seconds: float) -> None:
+        """Pausa o bucket (Retry-After da API) e zera os tokens."""
+        now = time.monotonic()
+        self.blocked_until = max(self.blocked_until, now + seconds)
+        self.tokens = 0.0
+        self._last = now
+
+    async def acquire(self) -> float:
+        if self.waiting >= self.max_waiting:
+            raise QueueOverflow()
+        self.waiting += 1
+        t0 = time.monotonic()
+        try:
+            async with self._lock:
+                while True:
+                    now = time.monotonic()
+                    if now < self.blocked_until:
+                        await asyncio.sleep(self.blocked_until - now)
+                        continue
+                    self._refill(now)
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        break
+                    await asyncio.sleep((1 - self.tokens) / self.rate)
+        finally:
+            self.waiting -= 1
+        waited = time.monotonic() - t0
+        self.acquired += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+        return waited
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        tokens = min(self.burst, self.tokens + (now - self._last) * self.rate)
+        return {
+            "tokens": round(tokens, 3),
+            "rate": self.rate,
+            "burst": self.burst,
+            "queue": self.waiting,
+            "blocked_for_s": round(max(0.0, self.blocked_until - now), 3),
+            "acquired": self.acquired,
+            "avg_wait_s": round(self.total_wait / self.acquired, 4) if self.acquired else 0.0,
+            "max_wait_s": round(self.max_wait, 4),
+        }
+
+
+class SendLimiter:
+    def __init__(
+        self,
+        rate: float = SEND_RATE_PER_SECOND,
+        burst: float = SEND_BURST,
+        pair_rate_per_minute: float = SEND_PAIR_RATE_PER_MINUTE,
+        pair_burst: float = SEND_PAIR_BURST,
+        throttle_retries: int = SEND_THROTTLE_RETRIES,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.pair_rate = pair_rate_per_minute / 60.0
+        self.pair_burst = pair_burst
+        self.throttle_retries = throttle_retries
+        self._numbers: Dict[str, TokenBucket] = {}
+        self._pairs: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self.throttled = 0
+        self.overflows = 0
+
+    def _number_bucket(self, phone_number_id: str) -> TokenBucket:
+        b = self._numbers.get(phone_number_id)
+        if b is None:
+            b = self._numbers[phone_number_id] = TokenBucket(self.rate, self.burst)
+        return b
+
+    def _pair_bucket(self, phone_number_id: str, to_wa_id: str) -> TokenBucket:
+        key = f"{phone_number_id}:{to_wa_id}"
+        b = self._pairs.get(key)
+        if b is None:
+            b = self._pairs[key] = TokenBucket(self.pair_rate, self.pair_burst)
+            # Descarta pares ociosos mais antigos (sem ninguém esperando)
+            while len(self._pairs) > SEND_PAIR_BUCKETS_MAX:
+                old_key, old = next(iter(self._pairs.items()))
+                if old.waiting:
+                    break
+                self._pairs.pop(old_key)
+        else:
+            self._pairs.move_to_end(key)
+        return b
+
+    async def send_text(self, client: WhatsAppClient, to_wa_id: str, text: str) -> SendResult:
+        number = self._number_bucket(client.phone_number_id or "")
+        pair = self._pair_bucket(client.phone_number_id or "", to_wa_id)
+
+        for attempt in range(self.throttle_retries + 1):
+            try:
+                await pair.acquire()
+                await number.acquire()
+            except QueueOverflow:
+                self.overflows += 1
+                logging.warning(f"[ratelimit] fila local cheia, recusando envio para {to_wa_id}")
+                return SendResult(status=429, error="local send queue full")
+
+            result = await client.send_text(to_wa_id, text)
+            if not self._is_throttled(result) or attempt == self.throttle_retries:
+                return result
+
+            # Throttling da API: pausa o bucket certo e reenfileira
+            self.throttled += 1
+            delay = result.retry_after or SEND_DEFAULT_RETRY_AFTER * (2 ** attempt)
+            target = pair if result.error_code in PAIR_THROTTLE_CODES else number
+            target.penalize(delay)
+            logging.warning(
+                f"[ratelimit] throttled status={result.status} code={result.error_code} "
+                f"retry_after={delay:g}s tentativa={attempt + 1}"
+            )
+        return result
+
+    @staticmethod
+    def _is_throttled(result: SendResult) -> bool:
+        code = result.error_code
+        return result.status == 429 or code in NUMBER_THROTTLE_CODES or code in PAIR_THROTTLE_CODES
+
+    def stats(self) -> Dict[str, Any]:
+        pairs_waiting = sum(b.waiting for b in self._pairs.values())
+        return {
+            "numbers": {k: b.snapshot() for k, b in self._numbers.items()},
+            "pairs": len(self._pairs),
+            "pairs_queue": pairs_waiting,
+            "throttled": self.throttled,
+            "overflows": self.overflows,
+        }
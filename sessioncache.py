@@ -0,0 +1,142 @@
+# sessioncache.py
+"""
+Cache em memória das sessões da FSM (frente da tabela sessions).
+
+LRU limitado por wa_id, com TTL igual ao timeout da conversa: uma sessão
+parada há mais que isso volta para START de qualquer jeito. É write-through:
+toda escrita vai ao Postgres e, depois do commit, atualiza o cache.
+
+Cada linha de sessions tem um `version` que sobe a cada escrita. O cache
+guarda a versão que leu; a gravação do turno só é aplicada se a versão no
+banco ainda for essa e o bot não tiver sido pausado. Com acerto de cache o
+begin_turn não vai ao banco: a conferência acontece no commit do turno,
+feito ANTES do envio da resposta. Se outro worker gravou antes (ou pausou),
+o turno é descartado sem responder e refeito sobre o estado do banco.
+
+Entradas mais velhas que SESSION_PAUSE_TTL, e as pausadas (o humano pode ter
+devolvido a conversa), são relidas do banco no begin_turn.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+from stores import SESSION_TIMEOUT_MINUTES
+
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "10000"))  # 0 desliga
+SESSION_CACHE_TTL = float(os.getenv("SESSION_CACHE_TTL", str(SESSION_TIMEOUT_MINUTES * 60)))
+
+# Idade máx. do pause/version em cache usado pelo begin_turn sem reler o banco
+SESSION_PAUSE_TTL = float(os.getenv("SESSION_PAUSE_TTL", "30"))
+# Turno refeito até N vezes quando a sessão muda no meio (conflito de versão)
+SESSION_CONFLICT_RETRIES = int(os.getenv("SESSION_CONFLICT_RETRIES", "2"))
+
+SESSION_TIMEOUT = timedelta(minutes=SESSION_TIMEOUT_MINUTES)
+
+# Varredura de sessões expiradas (storage.sweep_sessions)
+SESSION_SWEEP_INTERVAL = float(os.getenv("SESSION_SWEEP_INTERVAL", "600"))  # 0 desliga
+SESSION_SWEEP_BATCH = int(os.getenv("SESSION_SWEEP_BATCH", "5000"))
+
+
+class CachedSession(NamedTuple):
+    state: Optional[str]            # None = ainda não existe linha no banco
+    data: Dict[str, Any]
+    updated_at: Optional[datetime]  # timestamptz do banco (aware)
+    pause_bot: bool
+    version: int                    # 0 = ainda não existe linha no banco
+
+
+class SessionCache:
+    """
+    LRU limitado com TTL. Thread-safe (usado do event loop e do threadpool).
+    """
+
+    def __init__(self, maxsize: int = SESSION_CACHE_SIZE, ttl: float = SESSION_CACHE_TTL):
+        self.maxsize = max(0, int(maxsize))
+        self.ttl = float(ttl)
+        self._items: "OrderedDict[str, Tuple[CachedSession, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+        self.conflicts = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.maxsize > 0
+
+    @staticmethod
+    def is_active(entry: CachedSession) -> bool:
+        """Mesma regra do SQL (updated_at > now() - timeout), para acertos do cache."""
+        if entry.updated_at is None:
+            return False
+        return entry.updated_at > datetime.now(timezone.utc) - SESSION_TIMEOUT
+
+    def get(self, wa_id: str, max_age: Optional[float] = None) -> Optional[CachedSession]:
+        """Entrada do cache; com max_age, só se foi gravada/lida há no máximo isso."""
+        if not self.enabled:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            item = self._items.get(wa_id)
+            if item is not None and max_age is not None and now - item[1] > max_age:
+                self.misses += 1
+                return None
+            if item is not None and now - item[1] <= self.ttl:
+                self._items.move_to_end(wa_id)
+                self.hits += 1
+                return item[0]
+            if item is not None:
+                del self._items[wa_id]
+                self.expired += 1
+            self.misses += 1
+            return None
+
+    def put(self, wa_id: str, entry: CachedSession) -> None:
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        with self._lock:
+            current = self._items.get(wa_id)
+            # Nunca volta para uma versão mais antiga (leituras concorrentes)
+            if current is not None and current[0].version > entry.version:
+                return
+            self._items[wa_id] = (entry, now)
+            self._items.move_to_end(wa_id)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, wa_id: str) -> None:
+        with self._lock:
+            self._items.pop(wa_id, None)
+
+    def conflict(self, wa_id: str) -> None:
+        """Outro worker gravou a sessão antes: descarta a entrada."""
+        with self._lock:
+            self._items.pop(wa_id, None)
+            self.conflicts += 1
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "size": len(self._items),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "evictions": self.evictions,
+            "expired": self.expired,
+            "conflicts": self.conflicts,
+        }
+
+
+session_cache = SessionCache()
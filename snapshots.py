@@ -0,0 +1,202 @@
+# snapshots.py
+"""
+Snapshots do cardápio público no R2.
+
+Depois de uma escrita em products (storage.add_products_listener) o tenant
+entra na fila com debounce: quando fica SNAPSHOT_DEBOUNCE segundos sem
+novas escritas (ou passa de SNAPSHOT_MAX_DELAY desde a primeira), o catálogo
+inteiro é renderizado no mesmo JSON de /m/{tenant}/products.json e enviado
+ao R2 em duas chaves:
+
+    snapshots/{tenant}/catalog-v{versão}.json   imutável, cache de 1 ano
+    snapshots/{tenant}/latest.json              ponteiro {version, url}, cache curto
+
+O menu.js lê o ponteiro e depois a versão; só cai no products.json se o
+snapshot não existir. Assim o tráfego público do link não chega ao Postgres.
+
+Só ligue (SNAPSHOT_ENABLED=1) depois de liberar GET no CORS do bucket para
+a origem do app; sem isso toda visita faz um fetch que falha e cai no
+products.json.
+
+O upload usa o cliente boto3 do r2_client (R2_ENDPOINT_URL aponta para um
+S3 local, ex.: moto/MinIO, em teste).
+"""
+import gzip
+import json
+import logging
+import os
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import storage
+from catalog import public_item
+
+# Desligado por padrão: o menu.js busca o snapshot no domínio público do R2
+# (outra origem), o que exige a regra de CORS do bucket (ver README)
+SNAPSHOT_ENABLED = os.getenv("SNAPSHOT_ENABLED", "0").strip().lower() in ("1", "true", "yes")
+SNAPSHOT_DEBOUNCE = float(os.getenv("SNAPSHOT_DEBOUNCE", "5"))
+SNAPSHOT_MAX_DELAY = float(os.getenv("SNAPSHOT_MAX_DELAY", "60"))  # edição contínua não segura para sempre
+SNAPSHOT_TICK = float(os.getenv("SNAPSHOT_TICK", "1"))
+SNAPSHOT_PREFIX = os.getenv("SNAPSHOT_PREFIX", "snapshots").strip("/")
+SNAPSHOT_KEEP = max(2, int(os.getenv("SNAPSHOT_KEEP", "3")))  # versões antigas mantidas (ponteiros em cache)
+SNAPSHOT_CACHE_CONTROL = os.getenv("SNAPSHOT_CACHE_CONTROL", "public, max-age=31536000, immutable")
+SNAPSHOT_POINTER_CACHE_CONTROL = os.getenv(
+    "SNAPSHOT_POINTER_CACHE_CONTROL", "public, max-age=30, stale-while-revalidate=300"
+)
+
+_VERSION_RE = re.compile(r"catalog-v(\d+)\.json$")
+
+
+def pointer_key(tenant_slug: str) -> str:
+    return f"{SNAPSHOT_PREFIX}/{tenant_slug}/latest.json"
+
+
+def version_key(tenant_slug: str, version: int) -> str:
+    return f"{SNAPSHOT_PREFIX}/{tenant_slug}/catalog-v{version}.json"
+
+
+def pointer_url(tenant_slug: str) -> str:
+    import r2_client  # só com R2 configurado
+
+    return r2_client.build_public_url(pointer_key(tenant_slug))
+
+
+def render_snapshot(tenant_slug: str, attempts: int = 3) -> Tuple[int, Dict[str, Any]]:
+    """
+    Catálogo completo num snapshot consistente: se a versão mudar entre as
+    páginas (escrita no meio), recomeça.
+    """
+    for _ in range(attempts):
+        page = storage.page_products(tenant_slug, limit=200)
+        version, items = page.version, list(page.items)
+        while page.next_cursor and page.version == version:
+            page = storage.page_products(tenant_slug, limit=200, cursor=page.next_cursor)
+            items.extend(page.items)
+        if page.version == version:
+            return version, {
+                "tenant": tenant_slug,
+                "version": version,
+                "generated_at": datetime.now(timezone.utc).isoformat(),
+                "items": [public_item(p) for p in items],
+                "total": page.total,
+                "next_cursor": None,
+            }
+    raise RuntimeError(f"catálogo de {tenant_slug} mudou durante o snapshot")
+
+
+class SnapshotPublisher:
+    """
+    Fila com debounce por tenant + publicação síncrona (roda no threadpool
+    via PeriodicTask). Falha no upload mantém o tenant na fila.
+    """
+
+    def __init__(self, debounce: float = SNAPSHOT_DEBOUNCE, max_delay: float = SNAPSHOT_MAX_DELAY,
+                 uploader=None):
+        self.debounce = float(debounce)
+        self.max_delay = float(max_delay)
+        self._uploader = uploader
+        self._pending: Dict[str, Tuple[float, float]] = {}  # tenant → (primeira, última) escrita
+        self._lock = threading.Lock()
+        self.published: Dict[str, int] = {}
+        self.publishes = 0
+        self.skipped = 0
+        self.errors = 0
+
+    @property
+    def uploader(self):
+        if self._uploader is None:
+            import r2_client
+
+            self._uploader = r2_client
+        return self._uploader
+
+    def schedule(self, tenant_slug: str, version: Optional[int] = None) -> None:
+        now = time.monotonic()
+        with self._lock:
+            first, _ = self._pending.get(tenant_slug, (now, now))
+            self._pending[tenant_slug] = (first, now)
+
+    def due(self, now: Optional[float] = None) -> List[str]:
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            return [
+                t for t, (first, last) in self._pending.items()
+                if now - last >= self.debounce or now - first >= self.max_delay
+            ]
+
+    def publish(self, tenant_slug: str) -> Optional[int]:
+        """Renderiza e sobe o snapshot; None se essa versão já estava publicada."""
+        version, snapshot = render_snapshot(tenant_slug)
+        if self.published.get(tenant_slug) == version:
+            self.skipped += 1
+            return None
+        up = self.uploader
+        key = version_key(tenant_slug, version)
+        body = json.dumps(snapshot, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        up.put_object(key, gzip.compress(body), "application/json",
+                      cache_control=SNAPSHOT_CACHE_CONTROL, content_encoding="gzip")
+        # Ponteiro por último: nunca aponta para algo que ainda não subiu
+        pointer = {"version": version, "url": up.build_public_url(key), "generated_at": snapshot["generated_at"]}
+        up.put_object(pointer_key(tenant_slug), json.dumps(pointer).encode("utf-8"), "application/json",
+                      cache_control=SNAPSHOT_POINTER_CACHE_CONTROL)
+        self._prune(tenant_slug, version)
+        self.published[tenant_slug] = version
+        self.publishes += 1
+        logging.info(f"[snapshots] {tenant_slug} v{version} publicado ({len(snapshot['items'])} itens)")
+        return version
+
+    def _prune(self, tenant_slug: str, version: int) -> None:
+        try:
+            keys = self.uploader.list_keys(f"{SNAPSHOT_PREFIX}/{tenant_slug}/catalog-v")
+            versions = sorted(
+                ((int(m.group(1)), k) for k in keys if (m := _VERSION_RE.search(k))), reverse=True
+            )
+            old = [k for v, k in versions[SNAPSHOT_KEEP:] if v < version]
+            if old:
+                self.uploader.delete_keys(old)
+        except Exception:
+            logging.exception(f"[snapshots] falha ao limpar versões antigas de {tenant_slug}")
+
+    def run_due(self) -> Dict[str, Any]:
+        """Publica os tenants vencidos (chamado pela PeriodicTask)."""
+        done, failed = [], []
+        for tenant in self.due():
+            with self._lock:
+                stamp = self._pending.get(tenant)
+            try:
+                self.publish(tenant)
+                done.append(tenant)
+            except Exception:
+                self.errors += 1
+                failed.append(tenant)
+                logging.exception(f"[snapshots] falha ao publicar {tenant}")
+                # Tenta de novo depois de outro debounce (não a cada tick)
+                now = time.monotonic()
+                with self._lock:
+                    self._pending[tenant] = (now, now)
+                continue
+            with self._lock:
+                # Escrita durante a publicação: fica na fila para a próxima
+                if self._pending.get(tenant) == stamp:
+                    del self._pending[tenant]
+        return {"published": done, "failed": failed}
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": SNAPSHOT_ENABLED,
+            "pending": len(self._pending),
+            "debounce": self.debounce,
+            "max_delay": self.max_delay,
+            "publishes": self.publishes,
+            "skipped": self.skipped,
+            "errors": self.errors,
+            "tenants": len(self.published),
+        }
+
+
+snapshot_publisher = SnapshotPublisher()
+if SNAPSHOT_ENABLED:
+    storage.add_products_listener(snapshot_publisher.schedule)
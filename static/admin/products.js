@@ -146,16 +146,41 @@ async function presignAndUpload(file) {
     throw new Error(`Falha no upload R2: ${putRes.status} ${err}`);
   }
 
-  return public_url;
+  return { public_url, key: presign.key };
+}
+
+// Gera as variantes (miniatura/média) e grava no produto. Se falhar, o
+// produto segue com o original.
+async function confirmUpload(upload, productId) {
+  if (!upload) return;
+  try {
+    await api(`/api/t/:tenant/uploads/confirm`, {
+      method: "POST",
+      body: { key: upload.key, product_id: productId },
+    });
+  } catch (e) {
+    console.warn(e);
+    toast(`Foto salva sem miniaturas: ${e.message}`, "warn");
+  }
 }
 
 /* ======================
    CRUD
 ====================== */
 async function listProducts() {
-  const data = await api(`/api/t/:tenant/products`);
+  // Segue o next_cursor até a última página (keyset, sem offset); com busca, só os achados
+  const q = ($("#searchQuery")?.value || "").trim();
+  const items = [];
+  let cursor = null;
+  do {
+    let qs = cursor ? `&cursor=${encodeURIComponent(cursor)}` : "";
+    if (q) qs += `&q=${encodeURIComponent(q)}`;
+    const data = await api(`/api/t/:tenant/products?limit=200${qs}`);
+    items.push(...(data.items || []));
+    cursor = data.next_cursor || null;
+  } while (cursor);
   renderBrandFromStorage();  // 🔥 garante banner sempre visível
-  renderProducts(data.items || []);
+  renderProducts(items);
 }
 
 async function createProduct() {
@@ -172,10 +197,10 @@ async function createProduct() {
   $("#btnCreate").textContent = "Enviando...";
 
   try {
-    let image_url = null;
-    if (file) image_url = await presignAndUpload(file);
+    const upload = file ? await presignAndUpload(file) : null;
+    const image_url = upload ? upload.public_url : null;
 
-    await api(`/api/t/:tenant/products`, {
+    const created = await api(`/api/t/:tenant/products`, {
       method: "POST",
       body: {
         sku: sku || null,
@@ -187,6 +212,7 @@ async function createProduct() {
       },
     });
 
+    await confirmUpload(upload, created.id);
     toast("Produto criado!", "success");
     await listProducts();
     resetForm();
@@ -341,11 +367,11 @@ function openEditor(card, p) {
     };
 
     const imgFile = editor.querySelector(".ed_image").files?.[0];
-    if (imgFile) {
-      fields.image_url = await presignAndUpload(imgFile);
-    }
+    const upload = imgFile ? await presignAndUpload(imgFile) : null;
+    if (upload) fields.image_url = upload.public_url;
 
     await updateProduct(p.id, fields);
+    await confirmUpload(upload, p.id);
     toast("Atualizado!", "success");
     await listProducts();
     editor.remove();
@@ -381,6 +407,12 @@ function bindEvents() {
     toast("Config limpa", "info");
   };
 
+  let searchTimer = null;
+  $("#searchQuery")?.addEventListener("input", () => {
+    clearTimeout(searchTimer);
+    searchTimer = setTimeout(() => listProducts().catch((e) => toast(e.message, "error")), 300);
+  });
+
   $("#btnRefresh").onclick = () => {
     if (!ensureCfg()) return toast("Configure Token Admin", "warn");
     listProducts().catch((e) => toast(e.message, "error"));
@@ -425,7 +457,9 @@ function bindEvents() {
     if (!file) return toast("Escolha uma imagem", "warn");
 
     try {
-      const url = await presignAndUpload(file);
+      const { public_url: url } = await presignAndUpload(file);
+      // Servidor: o cardápio público (SSR) usa esta marca
+      await api(`/api/t/:tenant/branding`, { method: "PUT", body: { banner_url: url } });
       brand.url = url;
       renderBrandFromStorage();
       toast("Logotipo atualizado!", "success");
@@ -435,7 +469,12 @@ function bindEvents() {
     }
   };
 
-  $("#btnClearBrand").onclick = () => {
+  $("#btnClearBrand").onclick = async () => {
+    try {
+      await api(`/api/t/:tenant/branding`, { method: "PUT", body: { banner_url: null } });
+    } catch (e) {
+      return toast(e.message, "error");
+    }
     brand.url = "";
     $("#brandPreview").src = "";
     $("#brandPreview").style.display = "none";
@@ -46,7 +46,7 @@
     const row = document.createElement("div");
     row.className = "cart-item";
     row.innerHTML = `
-      <img src="${it.image_url || ""}" alt="${it.name || "Produto"}" />
+      <img src="${it.image_url || ""}" alt="${it.name || "Produto"}" loading="lazy" decoding="async" />
       <div class="info">
         <h3>${it.name || "Produto"}</h3>
         <div class="meta">SKU: ${it.sku || "-"}</div>
@@ -5,17 +5,28 @@
     console.warn("Tenant não detectado na URL. Esperado: /m/{tenant}");
   }
 
-  // --- Branding (MVP pelo localStorage) ---
-  const brandName = localStorage.getItem("bb_brand_name") || tenant || "Loja";
-  const bannerUrl = localStorage.getItem("bb_banner_url") || "";
+  // --- Dados do SSR: marca + primeira página já vieram no HTML ---
+  let initial = null;
+  try {
+    const el = document.getElementById("bb-initial");
+    if (el) initial = JSON.parse(el.textContent);
+  } catch (e) {
+    console.warn("bb-initial inválido", e);
+  }
+
+  // --- Branding (MVP pelo localStorage; com SSR a marca vem do servidor) ---
+  if (!initial) {
+    const brandName = localStorage.getItem("bb_brand_name") || tenant || "Loja";
+    const bannerUrl = localStorage.getItem("bb_banner_url") || "";
 
-  // Tente popular elementos existentes:
-  const brandNameEl = document.getElementById("brandName");
-  const brandBannerEl = document.getElementById("brandBanner");
-  if (brandNameEl) brandNameEl.textContent = brandName;
-  if (brandBannerEl && bannerUrl) {
-    brandBannerEl.src = bannerUrl;
-    brandBannerEl.style.display = "block";
+    // Tente popular elementos existentes:
+    const brandNameEl = document.getElementById("storeName");
+    const brandBannerEl = document.getElementById("banner");
+    if (brandNameEl) brandNameEl.textContent = brandName;
+    if (brandBannerEl && bannerUrl) {
+      brandBannerEl.src = bannerUrl;
+      brandBannerEl.style.display = "block";
+    }
   }
 
   // --- Botão flutuante do carrinho ---
@@ -64,7 +75,7 @@
         id: product.id,
         name: product.name,
         price_cents: product.price_cents,
-        image_url: product.image_url || "",
+        image_url: product.images?.thumb?.jpeg || product.image_url || "",
         sku: product.sku || "",
         qty: 1,
       });
@@ -78,7 +89,26 @@
   }
 
   // --- Render dos cards ---
+  // Foto do card: variantes (thumb/medium, webp + jpeg) via srcset; sem elas, o original
+  const CARD_IMAGE_SIZES = "110px";
+  function imageHtml(p) {
+    const alt = p.name || "Produto";
+    const sizes = [p.images?.thumb, p.images?.medium].filter(Boolean);
+    if (!sizes.length) {
+      return `<img src="${p.image_url || ""}" alt="${alt}" loading="lazy" decoding="async" />`;
+    }
+    const srcset = (fmt) => sizes.map((v) => `${v[fmt]} ${v.width}w`).join(", ");
+    return `
+        <picture>
+          <source type="image/webp" srcset="${srcset("webp")}" sizes="${CARD_IMAGE_SIZES}" />
+          <img src="${sizes[0].jpeg}" srcset="${srcset("jpeg")}" sizes="${CARD_IMAGE_SIZES}"
+               width="${sizes[0].width}" height="${sizes[0].height}" alt="${alt}" loading="lazy" decoding="async" />
+        </picture>`;
+  }
+
+  let shown = [];  // itens na grade agora (o clique do carrinho procura aqui)
   function renderProducts(items) {
+    shown = Array.isArray(items) ? items : [];
     grid.innerHTML = "";
     if (!Array.isArray(items) || items.length === 0) {
       grid.innerHTML = `<div style="color:#94a3b8">Nenhum produto disponível no momento.</div>`;
@@ -93,7 +123,7 @@
       const card = document.createElement("div");
       card.className = "product-card";
       card.innerHTML = `
-        <img src="${p.image_url || ""}" alt="${p.name || "Produto"}" />
+        ${imageHtml(p)}
         <div class="product-info">
           <h3>${p.name || "Produto"}</h3>
           <p class="desc">${p.description || ""}</p>
@@ -106,30 +136,104 @@
       frag.appendChild(card);
     });
     grid.appendChild(frag);
+  }
 
-    grid.addEventListener("click", (ev) => {
-      const btn = ev.target.closest(".add-btn");
-      if (!btn) return;
-      const id = Number(btn.dataset.id);
-      const p = items.find((x) => Number(x.id) === id);
-      if (!p) return;
-      addToCart(p);
-      // Feedback básico
-      const prev = btn.textContent;
-      btn.textContent = "Adicionado!";
-      setTimeout(() => (btn.textContent = prev), 900);
-    });
+  // Um listener só (renderProducts roda de novo a cada busca)
+  grid.addEventListener("click", (ev) => {
+    const btn = ev.target.closest(".add-btn");
+    if (!btn) return;
+    const id = Number(btn.dataset.id);
+    const p = shown.find((x) => Number(x.id) === id);
+    if (!p) return;
+    addToCart(p);
+    // Feedback básico
+    const prev = btn.textContent;
+    btn.textContent = "Adicionado!";
+    setTimeout(() => (btn.textContent = prev), 900);
+  });
+
+  // --- Busca (servidor: ranqueada, sem acento, tolera erro de digitação) ---
+  let allItems = [];
+  let searchTimer = null;
+  let searchSeq = 0;
+  const searchInput = document.createElement("input");
+  searchInput.type = "search";
+  searchInput.id = "productSearch";
+  searchInput.className = "search";
+  searchInput.placeholder = "Buscar no cardápio…";
+  searchInput.setAttribute("aria-label", "Buscar no cardápio");
+  grid.parentNode.insertBefore(searchInput, grid);
+
+  async function runSearch(q) {
+    const seq = ++searchSeq;
+    if (!q) return renderProducts(allItems);
+    try {
+      const res = await fetch(`/m/${tenant}/search.json?q=${encodeURIComponent(q)}`);
+      if (!res.ok) throw new Error(`busca ${res.status}`);
+      const data = await res.json();
+      if (seq === searchSeq) renderProducts(data.items || []);
+    } catch (e) {
+      console.error(e);
+    }
+  }
+  searchInput.addEventListener("input", () => {
+    clearTimeout(searchTimer);
+    searchTimer = setTimeout(() => runSearch(searchInput.value.trim()), 250);
+  });
+
+  // --- Snapshot no R2 (ponteiro → versão imutável); null = usar a API ---
+  async function loadSnapshot(minVersion = 0) {
+    const meta = document.querySelector('meta[name="bb-snapshot"]');
+    const pointerUrl = meta?.content;
+    if (!pointerUrl) return null;
+    try {
+      const ptr = await fetch(pointerUrl);
+      if (!ptr.ok) return null;
+      const { url } = await ptr.json();
+      if (!url) return null;
+      const res = await fetch(url);
+      if (!res.ok) return null;
+      const data = await res.json();
+      // Snapshot mais velho que o HTML (ponteiro em cache): usa a API
+      if (Number(data?.version || 0) < minVersion) return null;
+      return Array.isArray(data?.items) ? data.items : null;
+    } catch (e) {
+      console.warn("Snapshot indisponível, usando a API", e);
+      return null;
+    }
+  }
+
+  // --- API: páginas por cursor (next_cursor) até acabar ---
+  // Sem no-store: o navegador revalida com If-None-Match (304 sai sem corpo)
+  async function loadFromApi(startCursor = null) {
+    const items = [];
+    let cursor = startCursor;
+    do {
+      const qs = cursor ? `?cursor=${encodeURIComponent(cursor)}` : "";
+      const res = await fetch(`/m/${tenant}/products.json${qs}`);
+      if (!res.ok) throw new Error("Falha ao carregar products.json");
+      const data = await res.json();
+      if (Array.isArray(data?.items)) items.push(...data.items);
+      cursor = data?.next_cursor || null;
+    } while (cursor);
+    return items;
   }
 
   // --- Boot ---
   async function load() {
     try {
       updateCartCount();
-      const res = await fetch(`/m/${tenant}/products.json`, { cache: "no-store" });
-      if (!res.ok) throw new Error("Falha ao carregar products.json");
-      const data = await res.json();
-      const items = Array.isArray(data?.items) ? data.items : [];
-      renderProducts(items);
+      if (initial) {
+        // Cards já estão na grade; só busca o resto se houver mais páginas
+        shown = allItems = Array.isArray(initial.items) ? initial.items : [];
+        if (!initial.next_cursor) return;
+        allItems = (await loadSnapshot(initial.version || 0))
+          || allItems.concat(await loadFromApi(initial.next_cursor));
+        if (!searchInput.value.trim()) renderProducts(allItems);
+        return;
+      }
+      allItems = (await loadSnapshot()) || (await loadFromApi());
+      renderProducts(allItems);
     } catch (e) {
       console.error(e);
       grid.innerHTML = `<div style="color:#ef4444">Erro ao carregar o cardápio.</div>`;
@@ -1,9 +1,23 @@
 # storage.py (Neon / Postgres)
+import base64
+import json
+import logging
 import os
+import re
+import sys
+import time
+import unicodedata
+from contextlib import contextmanager
 from datetime import datetime, timezone
-from typing import List, Tuple, Optional
-from psycopg_pool import ConnectionPool
+from typing import Callable, Iterable, Iterator, List, NamedTuple, Tuple, Optional, Set
+from psycopg_pool import ConnectionPool, PoolTimeout
+from psycopg.errors import UniqueViolation
 from psycopg.rows import dict_row
+from psycopg.types.json import Jsonb
+
+from dbprofile import CALLER_ATTR, DB_PROFILE, ProfiledCursor, profiler
+from sessioncache import SESSION_PAUSE_TTL, CachedSession, session_cache
+from stores import SESSION_TIMEOUT_MINUTES
 
 # -------------------------------------------------------------------
 # Configuração do Postgres/Neon
@@ -17,19 +31,76 @@ if DATABASE_URL.startswith(("postgres://", "postgresql://")) and "sslmode=" not
     sep = "&" if "?" in DATABASE_URL else "?"
     DATABASE_URL = f"{DATABASE_URL}{sep}sslmode=require"
 
+# Pool ajustável por env (dimensionar com os números do /admin/db)
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))          # espera máx. por conexão
+DB_POOL_MAX_WAITING = int(os.getenv("DB_POOL_MAX_WAITING", "0"))     # 0 = fila ilimitada
+DB_POOL_MAX_IDLE = float(os.getenv("DB_POOL_MAX_IDLE", "600"))
+DB_POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", "3600"))
+
 pool = ConnectionPool(
     conninfo=DATABASE_URL,
-    min_size=1,
-    max_size=10,
-    kwargs={},  # ex.: {"autocommit": False}
+    min_size=DB_POOL_MIN_SIZE,
+    max_size=max(DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE),
+    timeout=DB_POOL_TIMEOUT,
+    max_waiting=DB_POOL_MAX_WAITING,
+    max_idle=DB_POOL_MAX_IDLE,
+    max_lifetime=DB_POOL_MAX_LIFETIME,
+    kwargs={"cursor_factory": ProfiledCursor} if DB_PROFILE else {},
 )
 
+
+@contextmanager
 def get_conn():
     """
     Mantém compatibilidade com 'with get_conn() as conn:' do seu código.
-    Retorna um context manager de conexão do pool.
+    Mede a espera pelo pool e marca a conexão com a função que a pediu
+    (as queries dela são atribuídas a essa função no profiler).
     """
-    return pool.connection()
+    if not DB_PROFILE:
+        with pool.connection() as conn:
+            yield conn
+        return
+
+    code = sys._getframe(2).f_code
+    caller = getattr(code, "co_qualname", code.co_name)
+    cm = pool.connection()
+    t0 = time.perf_counter()
+    try:
+        conn = cm.__enter__()
+    except PoolTimeout:
+        profiler.timeout(caller)
+        raise
+    profiler.checkout(caller, time.perf_counter() - t0)
+    setattr(conn, CALLER_ATTR, caller)
+    try:
+        yield conn
+    except BaseException:
+        if not cm.__exit__(*sys.exc_info()):
+            raise
+    else:
+        cm.__exit__(None, None, None)
+
+
+def pool_stats() -> dict:
+    """Estado do pool (tamanho, ociosas, fila, timeouts de checkout)."""
+    s = pool.get_stats()
+    return {
+        "min_size": s.get("pool_min", DB_POOL_MIN_SIZE),
+        "max_size": s.get("pool_max", DB_POOL_MAX_SIZE),
+        "size": s.get("pool_size", 0),
+        "idle": s.get("pool_available", 0),
+        "waiting": s.get("requests_waiting", 0),
+        "requests": s.get("requests_num", 0),
+        "requests_queued": s.get("requests_queued", 0),
+        "requests_wait_ms": s.get("requests_wait_ms", 0),
+        "checkout_timeouts": s.get("requests_errors", 0),
+        "connections_opened": s.get("connections_num", 0),
+        "connections_errors": s.get("connections_errors", 0),
+        "connections_lost": s.get("connections_lost", 0),
+        "timeout_s": DB_POOL_TIMEOUT,
+    }
 
 
 # -------------------------------------------------------------------
@@ -43,7 +114,7 @@ def init_db():
                 CREATE TABLE IF NOT EXISTS sessions (
                     wa_id TEXT PRIMARY KEY,
                     state TEXT NOT NULL,
-                    data_json TEXT NOT NULL,
+                    data_json JSONB NOT NULL DEFAULT '{}'::jsonb,
                     updated_at TIMESTAMPTZ NOT NULL,
                     pause_bot INTEGER DEFAULT 0
                 )
@@ -94,17 +165,202 @@ def init_db():
             # Índices úteis
             c.execute("CREATE INDEX IF NOT EXISTS idx_messages_wa_id ON messages (wa_id)")
             c.execute("CREATE INDEX IF NOT EXISTS idx_messages_created_at ON messages (created_at)")
+            c.execute(
+                "CREATE INDEX IF NOT EXISTS idx_messages_wa_message_id ON messages (wa_message_id) "
+                "WHERE wa_message_id IS NOT NULL"
+            )
             c.execute("CREATE INDEX IF NOT EXISTS idx_orders_wa_id ON orders (wa_id)")
             c.execute("CREATE INDEX IF NOT EXISTS idx_orders_created_at ON orders (created_at)")
+            c.execute(
+                "CREATE INDEX IF NOT EXISTS idx_processed_messages_created_at "
+                "ON processed_messages (created_at)"
+            )
         conn.commit()
 
+    # Sessões: JSONB, versão e índice de expiração
+    migrate_sessions()
+
+    # Outbox com retry + tabela de auditoria
+    migrate_outbox()
+
+    # Journal bruto dos webhooks (replay após crash)
+    create_journal_table()
+
     # Cria a tabela de produtos (MVP multi-tenant por slug)
     create_products_table()
+    migrate_product_search()
+
+    # Fluxos de conversa por tenant
+    create_flows_table()
+
+    # Marca do cardápio público por tenant
+    create_branding_table()
+
+
+# -------------------------------------------------------------------
+# SESSÕES — migração
+# -------------------------------------------------------------------
+def migrate_sessions():
+    """
+    data_json TEXT -> JSONB, coluna version (escrita concorrente entre
+    workers) e índice em updated_at para a varredura de expiradas.
+    Idempotente: pode rodar a cada boot.
+    """
+    with get_conn() as conn:
+        with conn.cursor() as c:
+            c.execute(
+                "SELECT data_type FROM information_schema.columns "
+                "WHERE table_name = 'sessions' AND column_name = 'data_json'"
+            )
+            row = c.fetchone()
+            if row and row[0] != "jsonb":
+                c.execute("UPDATE sessions SET data_json = '{}' WHERE data_json IS NULL OR btrim(data_json) = ''")
+                c.execute("ALTER TABLE sessions ALTER COLUMN data_json TYPE JSONB USING data_json::jsonb")
+                c.execute("ALTER TABLE sessions ALTER COLUMN data_json SET DEFAULT '{}'::jsonb")
+            c.execute("ALTER TABLE sessions ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT 0")
+            c.execute("CREATE INDEX IF NOT EXISTS idx_sessions_updated_at ON sessions (updated_at)")
+        conn.commit()
+
+
+# -------------------------------------------------------------------
+# BUSCA DE PRODUTOS — migração
+# -------------------------------------------------------------------
+# Sem a extensão unaccent, blackbot_unaccent() cai num translate() com os
+# acentos do português (IMMUTABLE nos dois casos: pode ir em coluna gerada).
+_ACCENTED = "áàâãäéèêëíìîïóòôõöúùûüçñÁÀÂÃÄÉÈÊËÍÌÎÏÓÒÔÕÖÚÙÛÜÇÑ"
+_PLAIN = "aaaaaeeeeiiiiooooouuuucnAAAAAEEEEIIIIOOOOOUUUUCN"
+
+# Extensões disponíveis (preenchido por migrate_product_search / _search_features)
+_search_ext: Optional[Set[str]] = None
+
+
+def _try_extension(conn, c, name: str) -> bool:
+    try:
+        with conn.transaction():
+            c.execute(f"CREATE EXTENSION IF NOT EXISTS {name}")
+        return True
+    except Exception as exc:
+        logging.warning(f"[search] extensão {name} indisponível ({exc.__class__.__name__}); seguindo sem ela")
+        return False
+
+
+def migrate_product_search():
+    """
+    Busca por tenant: coluna gerada search_vector (config portuguese sobre o
+    texto sem acento; nome/SKU peso A, descrição peso B) com índice GIN, e
+    índice de trigramas no nome sem acento para erros de digitação — este
+    só com pg_trgm. Idempotente: pode rodar a cada boot.
+    """
+    global _search_ext
+    with get_conn() as conn:
+        with conn.cursor() as c:
+            ext = {name for name in ("unaccent", "pg_trgm") if _try_extension(conn, c, name)}
+            if "unaccent" in ext:
+                body = "SELECT public.unaccent('public.unaccent'::regdictionary, $1)"
+            else:
+                body = f"SELECT translate($1, '{_ACCENTED}', '{_PLAIN}')"
+            c.execute(f"""
+                CREATE OR REPLACE FUNCTION blackbot_unaccent(text) RETURNS text
+                LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT AS $$ {body} $$
+            """)
+            c.execute("""
+                ALTER TABLE products ADD COLUMN IF NOT EXISTS search_vector tsvector
+                GENERATED ALWAYS AS (
+                    setweight(to_tsvector('portuguese', blackbot_unaccent(coalesce(name, '') || ' ' || coalesce(sku, ''))), 'A') ||
+                    setweight(to_tsvector('portuguese', blackbot_unaccent(coalesce(description, ''))), 'B')
+                ) STORED
+            """)
+            c.execute("CREATE INDEX IF NOT EXISTS idx_products_search ON products USING GIN (search_vector)")
+            if "pg_trgm" in ext:
+                c.execute("""
+                    CREATE INDEX IF NOT EXISTS idx_products_name_trgm ON products
+                    USING GIN (blackbot_unaccent(lower(name)) gin_trgm_ops)
+                """)
+        conn.commit()
+    _search_ext = ext
+
+
+def _search_features() -> Set[str]:
+    global _search_ext
+    if _search_ext is None:
+        with get_conn() as conn:
+            with conn.cursor() as c:
+                c.execute("SELECT extname FROM pg_extension WHERE extname IN ('unaccent', 'pg_trgm')")
+                _search_ext = {r[0] for r in c.fetchall()}
+    return _search_ext
+
+
+# -------------------------------------------------------------------
+# OUTBOX/AUDIT — migração
+# -------------------------------------------------------------------
+def migrate_outbox():
+    """
+    Acrescenta à outbox o controle de reenvio (status, tentativas, próxima
+    tentativa) e move os registros de auditoria de presign para audit_log.
+    Idempotente: pode rodar a cada boot.
+    """
+    with get_conn() as conn:
+        with conn.cursor() as c:
+            c.execute("""
+                CREATE TABLE IF NOT EXISTS audit_log (
+                    id BIGSERIAL PRIMARY KEY,
+                    actor TEXT NOT NULL,
+                    action TEXT NOT NULL,
+                    detail TEXT,
+                    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+                )
+            """)
+            c.execute("CREATE INDEX IF NOT EXISTS idx_audit_log_created_at ON audit_log (created_at)")
+
+            # status: pending | sending | sent | dead | expired
+            c.execute("ALTER TABLE outbox ADD COLUMN IF NOT EXISTS status TEXT NOT NULL DEFAULT 'pending'")
+            c.execute("ALTER TABLE outbox ADD COLUMN IF NOT EXISTS attempts INT NOT NULL DEFAULT 0")
+            c.execute("ALTER TABLE outbox ADD COLUMN IF NOT EXISTS next_attempt_at TIMESTAMPTZ NOT NULL DEFAULT NOW()")
+            c.execute("ALTER TABLE outbox ADD COLUMN IF NOT EXISTS last_error TEXT")
+            c.execute("ALTER TABLE outbox ADD COLUMN IF NOT EXISTS wa_message_id TEXT")
+            c.execute("ALTER TABLE outbox ADD COLUMN IF NOT EXISTS sent_at TIMESTAMPTZ")
+            c.execute(
+                "CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (next_attempt_at) "
+                "WHERE status IN ('pending', 'sending')"
+            )
+
+            # Auditoria de presign antiga (gravada na outbox) vai para audit_log
+            c.execute("""
+                WITH moved AS (
+                    DELETE FROM outbox
+                     WHERE wa_id = 'admin' AND message LIKE 'presign:%%'
+                    RETURNING message, reason, created_at
+                )
+                INSERT INTO audit_log(actor, action, detail, created_at)
+                SELECT 'admin', message, reason, created_at FROM moved
+            """)
+        conn.commit()
 
 
 # -------------------------------------------------------------------
 # PRODUCTS — criação da tabela
 # -------------------------------------------------------------------
+class DuplicateSkus(Exception):
+    """SKU repetido no catálogo: sem o índice único o upsert do import não funciona."""
+
+
+def _ensure_sku_index(conn, c) -> None:
+    """Cria uq_products_tenant_sku se faltar; DuplicateSkus se a base ainda tem SKU repetido."""
+    c.execute("SELECT to_regclass('uq_products_tenant_sku') IS NOT NULL")
+    if c.fetchone()[0]:
+        return
+    try:
+        with conn.transaction():
+            c.execute("""
+                CREATE UNIQUE INDEX IF NOT EXISTS uq_products_tenant_sku
+                ON products (tenant_slug, sku) WHERE sku IS NOT NULL
+            """)
+    except UniqueViolation:
+        raise DuplicateSkus(
+            "há SKUs repetidos no catálogo; remova os duplicados para liberar o import"
+        ) from None
+
+
 def create_products_table():
     with get_conn() as conn:
         with conn.cursor() as c:
@@ -122,69 +378,387 @@ def create_products_table():
                     updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
                 )
             """)
-            c.execute("CREATE INDEX IF NOT EXISTS idx_products_tenant ON products (tenant_slug)")
+            # URLs das variantes da foto (images.py): {thumb|medium: {width, height, webp, jpeg}}
+            c.execute("ALTER TABLE products ADD COLUMN IF NOT EXISTS image_variants JSONB")
+            # Paginação por cursor: WHERE tenant_slug = ? AND id < ? ORDER BY id DESC
+            c.execute("CREATE INDEX IF NOT EXISTS idx_products_tenant_id ON products (tenant_slug, id DESC)")
+            # O índice composto cobre o antigo (só tenant_slug)
+            c.execute("DROP INDEX IF EXISTS idx_products_tenant")
+            # Chave do import em massa (upsert por SKU). Base antiga com SKU
+            # repetido: o índice fica de fora e o import recusa (409) até a limpeza.
+            try:
+                _ensure_sku_index(conn, c)
+            except DuplicateSkus as exc:
+                logging.warning(f"[products] {exc}")
+            # Versão do catálogo por tenant (sobe a cada escrita em products)
+            # e contador de produtos mantido na mesma transação (sem COUNT(*))
+            c.execute("""
+                CREATE TABLE IF NOT EXISTS catalog_versions (
+                    tenant_slug TEXT PRIMARY KEY,
+                    version BIGINT NOT NULL DEFAULT 1,
+                    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+                )
+            """)
+            # Vários workers sobem juntos: o lock (solto no commit) serializa a
+            # checagem + backfill, e só quem acrescentou a coluna faz a contagem
+            c.execute("SELECT pg_advisory_xact_lock(hashtext('catalog_versions.product_count'))")
+            c.execute("""
+                SELECT 1 FROM information_schema.columns
+                WHERE table_name = 'catalog_versions' AND column_name = 'product_count'
+            """)
+            if c.fetchone() is None:
+                c.execute("ALTER TABLE catalog_versions ADD COLUMN IF NOT EXISTS product_count BIGINT NOT NULL DEFAULT 0")
+                # Backfill: a partir daqui só create/delete_product mexem no contador
+                c.execute("""
+                    INSERT INTO catalog_versions (tenant_slug, product_count)
+                    SELECT tenant_slug, COUNT(*) FROM products GROUP BY tenant_slug
+                    ON CONFLICT (tenant_slug) DO UPDATE SET product_count = EXCLUDED.product_count
+                """)
+        conn.commit()
+
+
+# -------------------------------------------------------------------
+# JOURNAL DO WEBHOOK — criação da tabela
+# -------------------------------------------------------------------
+def create_journal_table():
+    with get_conn() as conn:
+        with conn.cursor() as c:
+            c.execute("""
+                CREATE TABLE IF NOT EXISTS webhook_events (
+                    id BIGSERIAL PRIMARY KEY,
+                    received_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                    payload JSONB NOT NULL,
+                    processed_at TIMESTAMPTZ
+                )
+            """)
+            c.execute(
+                "CREATE INDEX IF NOT EXISTS idx_webhook_events_unprocessed ON webhook_events (id) "
+                "WHERE processed_at IS NULL"
+            )
+            c.execute("CREATE INDEX IF NOT EXISTS idx_webhook_events_received_at ON webhook_events (received_at)")
+        conn.commit()
+
+
+def create_flows_table():
+    with get_conn() as conn:
+        with conn.cursor() as c:
+            c.execute("""
+                CREATE TABLE IF NOT EXISTS flows (
+                    tenant_slug TEXT PRIMARY KEY,
+                    definition JSONB NOT NULL,
+                    version INT NOT NULL DEFAULT 1,
+                    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+                )
+            """)
+        conn.commit()
+
+
+def create_branding_table():
+    with get_conn() as conn:
+        with conn.cursor() as c:
+            c.execute("""
+                CREATE TABLE IF NOT EXISTS tenant_branding (
+                    tenant_slug TEXT PRIMARY KEY,
+                    brand_name TEXT,
+                    subtitle TEXT,
+                    banner_url TEXT,
+                    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+                )
+            """)
         conn.commit()
 
 
 # -------------------------------------------------------------------
 # IDEMPOTÊNCIA
 # -------------------------------------------------------------------
-def mark_processed(message_id: str, wa_id: str) -> bool:
+def mark_processed_many(items: List[Tuple[str, str]]) -> Set[str]:
     """
-    Retorna True se for novo (inseriu), False se já existia (não processar de novo).
-    Usa ON CONFLICT DO NOTHING para idempotência.
+    Recebe [(message_id, wa_id), ...] e insere tudo num único statement
+    (ON CONFLICT DO NOTHING). Retorna o conjunto de message_ids que eram
+    novos; os demais já tinham sido processados e não devem rodar de novo.
     """
+    if not items:
+        return set()
+    # Remove repetidos do próprio lote preservando o primeiro wa_id
+    uniq: dict = {}
+    for message_id, wa_id in items:
+        uniq.setdefault(message_id, wa_id)
+
     with get_conn() as conn:
         with conn.cursor() as c:
             c.execute(
                 """
                 INSERT INTO processed_messages(message_id, wa_id, created_at)
-                VALUES (%s, %s, %s)
+                SELECT t.message_id, t.wa_id, %s
+                  FROM unnest(%s::text[], %s::text[]) AS t(message_id, wa_id)
                 ON CONFLICT (message_id) DO NOTHING
+                RETURNING message_id
                 """,
-                (message_id, wa_id, datetime.now(timezone.utc)),
+                (datetime.now(timezone.utc), list(uniq.keys()), list(uniq.values())),
             )
-            inserted = c.rowcount == 1
+            inserted = {r[0] for r in c.fetchall()}
         conn.commit()
         return inserted
 
 
+def prune_processed_messages(older_than_days: float, batch_size: int = 5000, max_batches: int = 100) -> int:
+    """
+    Apaga registros de idempotência mais antigos que a janela, em lotes
+    (uma transação curta por lote para não segurar locks). Retorna o total apagado.
+    """
+    total = 0
+    for _ in range(max_batches):
+        with get_conn() as conn:
+            with conn.cursor() as c:
+                c.execute(
+                    """
+                    DELETE FROM processed_messages
+                     WHERE message_id IN (
+                        SELECT message_id FROM processed_messages
+                         WHERE created_at < NOW() - make_interval(secs => %s)
+                         LIMIT %s
+                     )
+                    """,
+                    (older_than_days * 86400, batch_size),
+                )
+                deleted = c.rowcount
+            conn.commit()
+        total += deleted
+        if deleted < batch_size:
+            break
+    return total
+
+
+def filter_handled_message_ids(message_ids: List[str]) -> Set[str]:
+    """
+    Dos ids informados, devolve os que já têm a mensagem de entrada gravada
+    em messages (o turno foi concluído). Usado no replay do journal.
+    """
+    if not message_ids:
+        return set()
+    with get_conn() as conn:
+        with conn.cursor() as c:
+            c.execute(
+                "SELECT DISTINCT wa_message_id FROM messages WHERE wa_message_id = ANY(%s)",
+                (list(message_ids),),
+            )
+            return {r[0] for r in c.fetchall()}
+
+
+# -------------------------------------------------------------------
+# JOURNAL DO WEBHOOK
+# -------------------------------------------------------------------
+def journal_append_many(payloads: List[str]) -> List[int]:
+    """
+    Grava N corpos de webhook (JSON cru) num único INSERT.
+    Retorna os ids na mesma ordem dos payloads.
+    """
+    if not payloads:
+        return []
+    with get_conn() as conn:
+        with conn.cursor() as c:
+            c.execute(
+                """
+                INSERT INTO webhook_events(payload)
+                SELECT t.p::jsonb
+                  FROM unnest(%s::text[]) WITH ORDINALITY AS t(p, n)
+                 ORDER BY t.n
+                RETURNING id
+                """,
+                (payloads,),
+            )
+            # Ids do BIGSERIAL saem crescentes na ordem de inserção
+            ids = sorted(r[0] for r in c.fetchall())
+        conn.commit()
+        return ids
+
+
+def journal_mark_processed(event_ids: List[int]):
+    if not event_ids:
+        return
+    with get_conn() as conn:
+        with conn.cursor() as c:
+            c.execute(
+                "UPDATE webhook_events SET processed_at = NOW() WHERE id = ANY(%s) AND processed_at IS NULL",
+                (list(event_ids),),
+            )
+        conn.commit()
+
+
+def journal_load_unprocessed(older_than_seconds: float, after_id: int = 0, limit: int = 500) -> List[Tuple[int, dict]]:
+    """
+    Eventos ainda não processados, recebidos há mais de `older_than_seconds`
+    (evita pegar o que outra instância viva ainda está processando).
+    """
+    with get_conn() as conn:
+        with conn.cursor() as c:
+            c.execute(
+                """
+                SELECT id, payload FROM webhook_events
+                 WHERE processed_at IS NULL
+                   AND id > %s
+                   AND received_at < NOW() - make_interval(secs => %s)
+                 ORDER BY id
+                 LIMIT %s
+                """,
+                (after_id, older_than_seconds, limit),
+            )
+            return c.fetchall()
+
+
+def journal_load_range(since: datetime, until: datetime, limit: int = 5000) -> List[Tuple[int, dict]]:
+    with get_conn() as conn:
+        with conn.cursor() as c:
+            c.execute(
+                """
+                SELECT id, payload FROM webhook_events
+                 WHERE received_at >= %s AND received_at < %s
+                 ORDER BY id
+                 LIMIT %s
+                """,
+                (since, until, limit),
+            )
+            return c.fetchall()
+
+
+def prune_journal(older_than_days: float, batch_size: int = 5000, max_batches: int = 100) -> int:
+    """
+    Apaga eventos JÁ processados mais antigos que a janela, em lotes.
+    """
+    total = 0
+    for _ in range(max_batches):
+        with get_conn() as conn:
+            with conn.cursor() as c:
+                c.execute(
+                    """
+                    DELETE FROM webhook_events
+                     WHERE id IN (
+                        SELECT id FROM webhook_events
+                         WHERE processed_at IS NOT NULL
+                           AND received_at < NOW() - make_interval(secs => %s)
+                         LIMIT %s
+                     )
+                    """,
+                    (older_than_days * 86400, batch_size),
+                )
+                deleted = c.rowcount
+            conn.commit()
+        total += deleted
+        if deleted < batch_size:
+            break
+    return total
+
+
 # -------------------------------------------------------------------
 # SESSÕES (FSM)
 # -------------------------------------------------------------------
-def load_session_full(wa_id: str) -> Optional[Tuple[str, str, str]]:
+# Sessões passam pelo session_cache (write-through); `version` sobe a cada
+# escrita para detectar gravações de outro worker. A expiração (sessão parada
+# há mais de SESSION_TIMEOUT_MINUTES volta ao início) é decidida no SQL.
+SESSION_TIMEOUT_S = SESSION_TIMEOUT_MINUTES * 60
+
+
+def _read_session(wa_id: str) -> Tuple[CachedSession, bool]:
+    """Lê sessão + pause_bot + version do banco e atualiza o cache. Devolve (entrada, ativa)."""
+    with get_conn() as conn:
+        with conn.cursor() as c:
+            c.execute(
+                """
+                SELECT state, data_json, updated_at, pause_bot, version,
+                       updated_at > NOW() - make_interval(secs => %s) AS active
+                FROM sessions WHERE wa_id=%s
+                """,
+                (SESSION_TIMEOUT_S, wa_id),
+            )
+            row = c.fetchone()
+    if not row:
+        entry = CachedSession(None, {}, None, False, 0)
+        session_cache.put(wa_id, entry)
+        return entry, False
+    entry = CachedSession(row[0], row[1] or {}, row[2], bool(row[3]), row[4])
+    session_cache.put(wa_id, entry)
+    return entry, bool(row[5])
+
+
+def _cached_session(wa_id: str) -> Tuple[CachedSession, bool]:
+    entry = session_cache.get(wa_id)
+    if entry is not None:
+        return entry, session_cache.is_active(entry)
+    return _read_session(wa_id)
+
+
+def _fresh_session(wa_id: str) -> Tuple[CachedSession, bool]:
     """
-    Retorna (state, data_json, updated_at_iso) da sessão; None se não existir.
+    pause_bot + version sempre do banco (uma leitura por PK): a pausa pode
+    ter sido ligada por outro worker/instância. state/data só vêm na
+    resposta se a versão mudou desde a que está no cache.
     """
+    cached = session_cache.get(wa_id)
+    known = cached.version if cached is not None else -1
     with get_conn() as conn:
         with conn.cursor() as c:
             c.execute(
-                "SELECT state, data_json, to_char(updated_at, 'YYYY-MM-DD\"T\"HH24:MI:SS.MS\"Z\"') "
-                "FROM sessions WHERE wa_id=%s",
-                (wa_id,),
+                """
+                SELECT pause_bot, version, updated_at,
+                       updated_at > NOW() - make_interval(secs => %s) AS active,
+                       CASE WHEN version = %s THEN NULL ELSE state END,
+                       CASE WHEN version = %s THEN NULL ELSE data_json END
+                FROM sessions WHERE wa_id=%s
+                """,
+                (SESSION_TIMEOUT_S, known, known, wa_id),
             )
             row = c.fetchone()
-            return row if row else None
+    if not row:
+        entry = CachedSession(None, {}, None, False, 0)
+        session_cache.put(wa_id, entry)
+        return entry, False
+    pause, version, updated_at, active = bool(row[0]), row[1], row[2], bool(row[3])
+    if cached is not None and version == known:
+        # state/data iguais aos do cache; pause_bot sempre o do banco (um
+        # UPDATE direto, ex.: painel/SQL, não sobe a versão)
+        entry = cached if cached.pause_bot == pause else cached._replace(pause_bot=pause)
+    else:
+        entry = CachedSession(row[4], row[5] or {}, updated_at, pause, version)
+    session_cache.put(wa_id, entry)
+    return entry, active
 
 
-def save_session(wa_id: str, state: str, data_json: str):
+def _session_view(entry: CachedSession, active: bool) -> Optional[Tuple[str, dict]]:
+    if entry.state is None or not active:
+        return None
+    # Cópia: o engine altera o dict e o cache não pode mudar antes do commit
+    return entry.state, dict(entry.data)
+
+
+def load_session(wa_id: str) -> Optional[Tuple[str, dict]]:
     """
-    Upsert da sessão (state, data_json, updated_at).
+    Retorna (state, data) da sessão; None se não existir ou tiver expirado.
+    """
+    return _session_view(*_cached_session(wa_id))
+
+
+def save_session(wa_id: str, state: str, data: dict):
+    """
+    Upsert da sessão (state, data, updated_at).
     """
     with get_conn() as conn:
         with conn.cursor() as c:
             c.execute(
                 """
-                INSERT INTO sessions(wa_id, state, data_json, updated_at)
-                VALUES (%s, %s, %s, %s)
+                INSERT INTO sessions(wa_id, state, data_json, updated_at, version)
+                VALUES (%s, %s, %s, NOW(), 1)
                 ON CONFLICT (wa_id) DO UPDATE SET
                   state = EXCLUDED.state,
                   data_json = EXCLUDED.data_json,
-                  updated_at = EXCLUDED.updated_at
+                  updated_at = EXCLUDED.updated_at,
+                  version = sessions.version + 1
+                RETURNING updated_at, pause_bot, version
                 """,
-                (wa_id, state, data_json, datetime.now(timezone.utc)),
+                (wa_id, state, Jsonb(data)),
             )
+            updated_at, pause, version = c.fetchone()
         conn.commit()
+    session_cache.put(wa_id, CachedSession(state, dict(data), updated_at, bool(pause), version))
 
 
 def set_pause_bot(wa_id: str, pause: bool):
@@ -193,24 +767,129 @@ def set_pause_bot(wa_id: str, pause: bool):
     """
     with get_conn() as conn:
         with conn.cursor() as c:
-            c.execute("UPDATE sessions SET pause_bot=%s WHERE wa_id=%s", (1 if pause else 0, wa_id))
-            if c.rowcount == 0:
+            c.execute(
+                """
+                INSERT INTO sessions(wa_id, state, data_json, updated_at, pause_bot, version)
+                VALUES (%s, 'START', '{}'::jsonb, NOW(), %s, 1)
+                ON CONFLICT (wa_id) DO UPDATE SET
+                  pause_bot = EXCLUDED.pause_bot,
+                  version = sessions.version + 1
+                RETURNING state, data_json, updated_at, version
+                """,
+                (wa_id, 1 if pause else 0),
+            )
+            row = c.fetchone()
+        conn.commit()
+    session_cache.put(wa_id, CachedSession(row[0], row[1] or {}, row[2], pause, row[3]))
+
+
+def get_pause_bot(wa_id: str) -> bool:
+    # Sem cache: a pausa (atendimento humano) vale na hora em qualquer worker
+    return _fresh_session(wa_id)[0].pause_bot
+
+
+def sweep_sessions(batch_size: int = 5000, max_batches: int = 100) -> dict:
+    """
+    Varre sessões expiradas em lotes (índice em updated_at). As sem pausa são
+    apagadas; as pausadas (o humano ainda atende) só voltam ao início, para
+    não perder o pause_bot.
+    """
+    deleted = reset = 0
+    for _ in range(max_batches):
+        with get_conn() as conn:
+            with conn.cursor() as c:
                 c.execute(
                     """
-                    INSERT INTO sessions(wa_id, state, data_json, updated_at, pause_bot)
-                    VALUES (%s, %s, %s, %s, %s)
+                    DELETE FROM sessions
+                    WHERE wa_id IN (
+                        SELECT wa_id FROM sessions
+                        WHERE updated_at < NOW() - make_interval(secs => %s) AND pause_bot = 0
+                        LIMIT %s
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING wa_id
                     """,
-                    (wa_id, "START", "{}", datetime.now(timezone.utc), 1 if pause else 0),
+                    (SESSION_TIMEOUT_S, batch_size),
                 )
-        conn.commit()
+                ids = [r[0] for r in c.fetchall()]
+            conn.commit()
+        for wa_id in ids:
+            session_cache.invalidate(wa_id)
+        deleted += len(ids)
+        if len(ids) < batch_size:
+            break
 
+    for _ in range(max_batches):
+        with get_conn() as conn:
+            with conn.cursor() as c:
+                c.execute(
+                    """
+                    UPDATE sessions SET state = 'START', data_json = '{}'::jsonb, version = version + 1
+                    WHERE wa_id IN (
+                        SELECT wa_id FROM sessions
+                        WHERE updated_at < NOW() - make_interval(secs => %s) AND pause_bot <> 0
+                          AND (state <> 'START' OR data_json <> '{}'::jsonb)
+                        LIMIT %s
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING wa_id
+                    """,
+                    (SESSION_TIMEOUT_S, batch_size),
+                )
+                ids = [r[0] for r in c.fetchall()]
+            conn.commit()
+        for wa_id in ids:
+            session_cache.invalidate(wa_id)
+        reset += len(ids)
+        if len(ids) < batch_size:
+            break
+    return {"deleted": deleted, "reset": reset}
 
-def get_pause_bot(wa_id: str) -> bool:
+
+# -------------------------------------------------------------------
+# FLUXOS (definição por tenant)
+# -------------------------------------------------------------------
+def get_flow(tenant_slug: str) -> Optional[Tuple[dict, int]]:
+    """
+    Retorna (definition, version) do fluxo do tenant; None se usa o padrão.
+    """
     with get_conn() as conn:
         with conn.cursor() as c:
-            c.execute("SELECT pause_bot FROM sessions WHERE wa_id=%s", (wa_id,))
+            c.execute("SELECT definition, version FROM flows WHERE tenant_slug=%s", (tenant_slug,))
             row = c.fetchone()
-            return bool(row[0]) if row else False
+            return (row[0], row[1]) if row else None
+
+
+def save_flow(tenant_slug: str, definition: dict) -> int:
+    """
+    Grava o fluxo do tenant e devolve a nova versão.
+    """
+    with get_conn() as conn:
+        with conn.cursor() as c:
+            c.execute(
+                """
+                INSERT INTO flows(tenant_slug, definition)
+                VALUES (%s, %s)
+                ON CONFLICT (tenant_slug) DO UPDATE SET
+                  definition = EXCLUDED.definition,
+                  version = flows.version + 1,
+                  updated_at = NOW()
+                RETURNING version
+                """,
+                (tenant_slug, Jsonb(definition)),
+            )
+            version = c.fetchone()[0]
+        conn.commit()
+        return version
+
+
+def delete_flow(tenant_slug: str) -> bool:
+    with get_conn() as conn:
+        with conn.cursor() as c:
+            c.execute("DELETE FROM flows WHERE tenant_slug=%s", (tenant_slug,))
+            deleted = c.rowcount > 0
+        conn.commit()
+        return deleted
 
 
 # -------------------------------------------------------------------
@@ -245,6 +924,142 @@ def add_outbox(wa_id: str, message: str, reason: str = None):
         conn.commit()
 
 
+def claim_outbox(batch_size: int = 50, lease_seconds: float = 60) -> List[dict]:
+    """
+    Reserva um lote de envios vencidos para ESTE processo.
+    FOR UPDATE SKIP LOCKED deixa várias instâncias drenarem a fila em paralelo
+    sem pegar a mesma linha. A linha fica 'sending' com um lease: se o
+    processo morrer, ela volta a ser elegível quando o lease vencer.
+    """
+    with get_conn() as conn:
+        with conn.cursor(row_factory=dict_row) as c:
+            c.execute(
+                """
+                WITH due AS (
+                    SELECT id FROM outbox
+                     WHERE status IN ('pending', 'sending')
+                       AND next_attempt_at <= NOW()
+                     ORDER BY next_attempt_at
+                     LIMIT %s
+                     FOR UPDATE SKIP LOCKED
+                )
+                UPDATE outbox o
+                   SET status = 'sending',
+                       attempts = o.attempts + 1,
+                       next_attempt_at = NOW() + make_interval(secs => %s)
+                  FROM due
+                 WHERE o.id = due.id
+                RETURNING o.id, o.wa_id, o.message, o.attempts, o.created_at
+                """,
+                (batch_size, lease_seconds),
+            )
+            rows = c.fetchall()
+        conn.commit()
+        return rows
+
+
+def complete_outbox(
+    sent: List[Tuple[int, Optional[str]]],
+    retry: List[Tuple[int, str, float]],
+    dead: List[Tuple[int, str]],
+):
+    """
+    Grava o resultado de um lote numa transação:
+      sent  = [(id, wa_message_id), ...]
+      retry = [(id, erro, atraso_em_segundos), ...]
+      dead  = [(id, erro), ...]
+    """
+    with get_conn() as conn:
+        with conn.cursor() as c:
+            if sent:
+                c.execute(
+                    """
+                    UPDATE outbox o
+                       SET status = 'sent', sent_at = NOW(), wa_message_id = t.mid, last_error = NULL
+                      FROM unnest(%s::bigint[], %s::text[]) AS t(id, mid)
+                     WHERE o.id = t.id
+                    """,
+                    ([r[0] for r in sent], [r[1] for r in sent]),
+                )
+            if retry:
+                c.execute(
+                    """
+                    UPDATE outbox o
+                       SET status = 'pending',
+                           last_error = t.err,
+                           next_attempt_at = NOW() + make_interval(secs => t.delay)
+                      FROM unnest(%s::bigint[], %s::text[], %s::float8[]) AS t(id, err, delay)
+                     WHERE o.id = t.id
+                    """,
+                    ([r[0] for r in retry], [r[1] for r in retry], [r[2] for r in retry]),
+                )
+            if dead:
+                c.execute(
+                    """
+                    UPDATE outbox o
+                       SET status = 'dead', last_error = t.err
+                      FROM unnest(%s::bigint[], %s::text[]) AS t(id, err)
+                     WHERE o.id = t.id
+                    """,
+                    ([r[0] for r in dead], [r[1] for r in dead]),
+                )
+        conn.commit()
+
+
+def expire_outbox(max_age_hours: float) -> int:
+    """
+    Marca como 'expired' o que está pendente há mais que max_age_hours
+    (fora da janela de 24h do WhatsApp não adianta reenviar texto livre).
+    """
+    with get_conn() as conn:
+        with conn.cursor() as c:
+            c.execute(
+                """
+                UPDATE outbox SET status = 'expired'
+                 WHERE status IN ('pending', 'sending')
+                   AND created_at < NOW() - make_interval(secs => %s)
+                """,
+                (max_age_hours * 3600,),
+            )
+            n = c.rowcount
+        conn.commit()
+        return n
+
+
+def outbox_stats() -> dict:
+    """
+    Contagem por status + atraso (segundos) do envio pendente mais antigo.
+    """
+    with get_conn() as conn:
+        with conn.cursor() as c:
+            c.execute("""
+                SELECT status, COUNT(*),
+                       EXTRACT(EPOCH FROM NOW() - MIN(created_at) FILTER (WHERE status IN ('pending', 'sending')))
+                  FROM outbox
+                 GROUP BY status
+            """)
+            rows = c.fetchall()
+    by_status = {r[0]: int(r[1]) for r in rows}
+    lags = [float(r[2]) for r in rows if r[2] is not None]
+    return {"by_status": by_status, "oldest_pending_age_s": max(lags) if lags else 0.0}
+
+
+# -------------------------------------------------------------------
+# AUDITORIA (ações administrativas)
+# -------------------------------------------------------------------
+def add_audit(actor: str, action: str, detail: str = None):
+    with get_conn() as conn:
+        with conn.cursor() as c:
+            c.execute(
+                """
+                INSERT INTO audit_log(actor, action, detail, created_at)
+                VALUES (%s, %s, %s, %s)
+                """,
+                (actor, action, detail, datetime.now(timezone.utc)),
+            )
+        conn.commit()
+
+
 # -------------------------------------------------------------------
 # INBOX — histórico
 # -------------------------------------------------------------------
@@ -310,34 +1125,503 @@ def list_messages(wa_id: str, limit: int = 200) -> List[Tuple[str, str, str, Opt
             return rows
 
 
+# -------------------------------------------------------------------
+# TURNO DE CONVERSA (unit of work)
+# -------------------------------------------------------------------
+class ConversationTurn:
+    """
+    Unidade de trabalho de UMA mensagem recebida.
+
+    begin_turn() monta o turno do session_cache (ou de uma query por PK);
+    as escritas do turno (sessão, mensagens, pedido, outbox) ficam em
+    memória e commit() grava tudo numa única transação, conferindo a versão
+    da sessão. Implementa stores.SessionStore e stores.OrderSink, então o
+    engine usa o turno como qualquer outro store.
+    """
+
+    def __init__(self, wa_id: str):
+        self.wa_id = wa_id
+        self.session: Optional[Tuple[str, dict]] = None  # None = sem sessão ativa
+        self.pause_bot = False
+        self.version = 0
+        # True se a gravação da sessão perdeu para a de outro worker
+        self.conflict = False
+        self._session_write: Optional[Tuple[str, str, datetime]] = None
+        self._messages: List[tuple] = []
+        self._orders: List[tuple] = []
+        self._outbox: List[tuple] = []
+
+    # ---------------- leituras (já carregadas) ----------------
+    def load_session(self, wa_id: str) -> Optional[Tuple[str, dict]]:
+        if self.session is None:
+            return None
+        state, data = self.session
+        return state, dict(data)
+
+    def get_pause_bot(self, wa_id: str) -> bool:
+        return self.pause_bot
+
+    # ---------------- escritas (bufferizadas) -----------------
+    def save_session(self, wa_id: str, state: str, data: dict):
+        # Última escrita do turno vence (igual a N upserts seguidos)
+        self._session_write = (state, dict(data))
+
+    def add_message(self, wa_id: str, direction: str, msg_type: str, body: str, wa_message_id: str = None):
+        self._messages.append(
+            (wa_id, direction, msg_type, body, wa_message_id, datetime.now(timezone.utc))
+        )
+
+    def save_order(self, wa_id: str, data: str, tipo: str, qtd: str, status: str = "NOVO"):
+        self._orders.append((wa_id, data, tipo, qtd, status, datetime.now(timezone.utc)))
+
+    def add_outbox(self, wa_id: str, message: str, reason: str = None):
+        self._outbox.append((wa_id, message, reason, datetime.now(timezone.utc)))
+
+    @property
+    def dirty(self) -> bool:
+        return bool(self._session_write or self._messages or self._orders or self._outbox)
+
+    def commit(self, check_version: bool = False) -> bool:
+        """
+        Grava tudo o que o turno acumulou numa única transação.
+
+        A gravação da sessão só vale se a linha ainda está na versão lida e o
+        pause_bot não mudou; com check_version a mesma conferência é feita
+        mesmo sem gravar a sessão (turno que vai responder). Em conflito nada
+        é gravado (rollback), self.conflict fica True e retorna False: o
+        chamador refaz o turno com begin_turn(fresh=True).
+        """
+        if not self.dirty and not check_version:
+            return True
+        new_version = None
+        conflict = False
+        with get_conn() as conn:
+            with conn.cursor() as c:
+                if self._session_write:
+                    state, data = self._session_write
+                    # Só aplica se ninguém gravou/pausou desde a leitura
+                    c.execute(
+                        """
+                        INSERT INTO sessions(wa_id, state, data_json, updated_at, version)
+                        VALUES (%s, %s, %s, NOW(), %s + 1)
+                        ON CONFLICT (wa_id) DO UPDATE SET
+                          state = EXCLUDED.state,
+                          data_json = EXCLUDED.data_json,
+                          updated_at = EXCLUDED.updated_at,
+                          version = sessions.version + 1
+                        WHERE sessions.version = %s
+                          AND (COALESCE(sessions.pause_bot, 0) <> 0) = %s
+                        RETURNING version, updated_at
+                        """,
+                        (self.wa_id, state, Jsonb(data), self.version, self.version, self.pause_bot),
+                    )
+                    row = c.fetchone()
+                    if row:
+                        new_version, updated_at = row
+                    else:
+                        conflict = True
+                elif check_version:
+                    # FOR SHARE: ninguém grava a linha até o commit deste turno
+                    c.execute("SELECT version, pause_bot FROM sessions WHERE wa_id=%s FOR SHARE", (self.wa_id,))
+                    row = c.fetchone()
+                    version, pause = (row[0], bool(row[1])) if row else (0, False)
+                    conflict = version != self.version or pause != self.pause_bot
+                if conflict:
+                    conn.rollback()
+                else:
+                    if self._messages:
+                        c.executemany(
+                            """
+                            INSERT INTO messages(wa_id, direction, msg_type, body, wa_message_id, created_at)
+                            VALUES (%s, %s, %s, %s, %s, %s)
+                            """,
+                            self._messages,
+                        )
+                    if self._orders:
+                        c.executemany(
+                            """
+                            INSERT INTO orders(wa_id, data, tipo, qtd, status, created_at)
+                            VALUES (%s, %s, %s, %s, %s, %s)
+                            """,
+                            self._orders,
+                        )
+                    if self._outbox:
+                        c.executemany(
+                            """
+                            INSERT INTO outbox(wa_id, message, reason, created_at)
+                            VALUES (%s, %s, %s, %s)
+                            """,
+                            self._outbox,
+                        )
+                    conn.commit()
+        if conflict:
+            # Outro worker gravou (ou pausou) antes: a versão do banco vence
+            self.conflict = True
+            session_cache.conflict(self.wa_id)
+            logging.warning(f"[session] conflito de versão em {self.wa_id}, turno descartado")
+        elif new_version is not None:
+            state, data = self._session_write
+            self.session = (state, data)
+            self.version = new_version
+            session_cache.put(
+                self.wa_id, CachedSession(state, dict(data), updated_at, self.pause_bot, new_version)
+            )
+        self._session_write = None
+        self._messages, self._orders, self._outbox = [], [], []
+        return not conflict
+
+
+def begin_turn(wa_id: str, fresh: bool = False) -> ConversationTurn:
+    """
+    Abre um turno. Com acerto no session_cache (entrada com menos de
+    SESSION_PAUSE_TTL e sem pausa) não vai ao banco: commit(check_version=True)
+    confere versão e pausa antes da resposta sair. Senão (ou com fresh, ao
+    refazer um turno em conflito) lê pause_bot + version por PK, e state/data
+    só se a versão mudou.
+    """
+    turn = ConversationTurn(wa_id)
+    entry = None if fresh else session_cache.get(wa_id, max_age=SESSION_PAUSE_TTL)
+    if entry is not None and not entry.pause_bot:
+        active = session_cache.is_active(entry)
+    else:
+        entry, active = _fresh_session(wa_id)
+    turn.session = _session_view(entry, active)
+    turn.pause_bot = entry.pause_bot
+    turn.version = entry.version
+    return turn
+
+
 # -------------------------------------------------------------------
 # PRODUCTS — CRUD (multi-tenant por tenant_slug)
 # -------------------------------------------------------------------
-def list_products(tenant_slug: str, limit: int = 50, offset: int = 0):
-    sql = """
-    SELECT id, tenant_slug, sku, name, description, price_cents, currency, image_url,
-           to_char(created_at, 'YYYY-MM-DD"T"HH24:MI:SS.MS"Z"') AS created_at,
-           to_char(updated_at, 'YYYY-MM-DD"T"HH24:MI:SS.MS"Z"') AS updated_at
+# Quem mantém derivados do catálogo (texto do bot, caches) se registra aqui;
+# cada escrita em products chama os listeners com (tenant, nova versão).
+_products_listeners: List[Callable[[str, int], None]] = []
+
+
+def add_products_listener(fn: Callable[[str, int], None]) -> None:
+    _products_listeners.append(fn)
+
+
+def _products_changed(tenant_slug: str, version: int) -> None:
+    for fn in _products_listeners:
+        try:
+            fn(tenant_slug, version)
+        except Exception:
+            logging.exception(f"[products] listener falhou para {tenant_slug}")
+
+
+def _bump_catalog_version(c, tenant_slug: str, count_delta: int = 0) -> int:
+    """
+    Sobe a versão do catálogo (e ajusta o contador de produtos) na mesma
+    transação da escrita em products.
+    """
+    c.execute(
+        """
+        INSERT INTO catalog_versions (tenant_slug, product_count) VALUES (%s, GREATEST(%s, 0))
+        ON CONFLICT (tenant_slug) DO UPDATE SET
+          version = catalog_versions.version + 1,
+          product_count = GREATEST(catalog_versions.product_count + %s, 0),
+          updated_at = NOW()
+        RETURNING version
+        """,
+        (tenant_slug, count_delta, count_delta),
+    )
+    row = c.fetchone()
+    return row["version"] if isinstance(row, dict) else row[0]
+
+
+def get_catalog_version(tenant_slug: str) -> int:
+    """Versão atual do catálogo (0 se o tenant nunca teve escrita)."""
+    with get_conn() as conn:
+        with conn.cursor() as c:
+            c.execute("SELECT version FROM catalog_versions WHERE tenant_slug = %s", (tenant_slug,))
+            row = c.fetchone()
+            return int(row[0]) if row else 0
+
+
+_PRODUCT_COLUMNS = """
+    id, tenant_slug, sku, name, description, price_cents, currency, image_url, image_variants,
+    to_char(created_at, 'YYYY-MM-DD"T"HH24:MI:SS.MS"Z"') AS created_at,
+    to_char(updated_at, 'YYYY-MM-DD"T"HH24:MI:SS.MS"Z"') AS updated_at
+"""
+
+
+def _products_where(tenant_slug: str, after_id: Optional[int]) -> Tuple[str, tuple]:
+    if after_id is not None:
+        return "tenant_slug = %s AND id < %s", (tenant_slug, after_id)
+    return "tenant_slug = %s", (tenant_slug,)
+
+
+def list_products(tenant_slug: str, limit: int = 50, offset: int = 0, after_id: Optional[int] = None):
+    """
+    Produtos do mais novo para o mais antigo. Com `after_id` pagina por
+    cursor (id < after_id, usa idx_products_tenant_id direto); `offset`
+    fica só por compatibilidade — páginas fundas leem e descartam linhas.
+    """
+    where, params = _products_where(tenant_slug, after_id)
+    sql = f"""
+    SELECT {_PRODUCT_COLUMNS}
     FROM products
-    WHERE tenant_slug = %s
+    WHERE {where}
     ORDER BY id DESC
     LIMIT %s OFFSET %s
     """
     with get_conn() as conn:
         with conn.cursor(row_factory=dict_row) as c:
-            c.execute(sql, (tenant_slug, limit, offset))
+            c.execute(sql, params + (limit, 0 if after_id is not None else offset))
             return c.fetchall()
 
+
+def encode_cursor(last_id: int) -> str:
+    """Cursor opaco para a próxima página (hoje só o último id visto)."""
+    return base64.urlsafe_b64encode(f"id:{int(last_id)}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> int:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        kind, _, value = raw.partition(":")
+        if kind != "id":
+            raise ValueError(kind)
+        return int(value)
+    except Exception:
+        raise ValueError("cursor inválido")
+
+
+class ProductPage(NamedTuple):
+    items: List[dict]
+    next_cursor: Optional[str]  # None na última página
+    total: int                  # catalog_versions.product_count
+    version: int                # versão do catálogo no mesmo snapshot dos itens
+
+
+def page_products(tenant_slug: str, limit: int = 50, cursor: Optional[str] = None,
+                  after_id: Optional[int] = None, offset: int = 0) -> ProductPage:
+    """
+    Uma página, o total e a versão do catálogo numa query só: a linha de
+    catalog_versions com LEFT JOIN LATERAL na página (sempre volta ao menos
+    uma linha, mesmo sem produtos). Lê limit+1 itens para saber se há mais.
+    """
+    if cursor:
+        after_id = decode_cursor(cursor)
+    where, params = _products_where(tenant_slug, after_id)
+    sql = f"""
+    SELECT COALESCE(cv.product_count, 0) AS _total, COALESCE(cv.version, 0) AS _version, p.*
+    FROM (SELECT %s::text AS tenant_slug) t
+    LEFT JOIN catalog_versions cv ON cv.tenant_slug = t.tenant_slug
+    LEFT JOIN LATERAL (
+        SELECT {_PRODUCT_COLUMNS}
+        FROM products
+        WHERE {where}
+        ORDER BY id DESC
+        LIMIT %s OFFSET %s
+    ) p ON TRUE
+    """
+    with get_conn() as conn:
+        with conn.cursor(row_factory=dict_row) as c:
+            c.execute(sql, (tenant_slug,) + params + (limit + 1, 0 if after_id is not None else offset))
+            rows = c.fetchall()
+    total, version = int(rows[0]["_total"]), int(rows[0]["_version"])
+    items = []
+    for r in rows:
+        if r["id"] is None:  # LEFT JOIN sem produtos
+            continue
+        del r["_total"], r["_version"]
+        items.append(r)
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = encode_cursor(items[-1]["id"])
+    return ProductPage(items, next_cursor, total, version)
+
+
+def _search_terms(q: str) -> List[str]:
+    decomposed = unicodedata.normalize("NFKD", q or "")
+    plain = "".join(ch for ch in decomposed if not unicodedata.combining(ch)).lower()
+    return re.findall(r"\w+", plain)[:8]
+
+
+def encode_search_cursor(rank: float, last_id: int) -> str:
+    return base64.urlsafe_b64encode(f"rank:{rank!r}:{int(last_id)}".encode()).decode().rstrip("=")
+
+
+def decode_search_cursor(cursor: str) -> Tuple[float, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        kind, rank, last_id = raw.split(":")
+        if kind != "rank":
+            raise ValueError(kind)
+        return float(rank), int(last_id)
+    except Exception:
+        raise ValueError("cursor inválido")
+
+
+def search_products(tenant_slug: str, q: str, limit: int = 20, cursor: Optional[str] = None) -> ProductPage:
+    """
+    Busca ranqueada no catálogo do tenant. Cada termo vira prefixo no
+    tsquery ("bol" acha "bolo", "brigadeiros" acha "brigadeiro") sobre
+    search_vector; com pg_trgm, nomes parecidos também entram (erros de
+    digitação) e a similaridade soma no rank. Paginação por (rank, id).
+    `total` e `version` não são calculados aqui (0).
+    """
+    terms = _search_terms(q)
+    if not terms:
+        return ProductPage([], None, 0, 0)
+    tsquery = " & ".join(f"{t}:*" for t in terms)
+    phrase = " ".join(terms)
+    fuzzy = "pg_trgm" in _search_features()
+    rank_sql, match_sql = "ts_rank(search_vector, query)", "search_vector @@ query"
+    if fuzzy:
+        # Termo contido no nome com erro de digitação ("brigadero" → "Brigadeiro gourmet")
+        rank_sql += " + word_similarity(%(phrase)s, blackbot_unaccent(lower(name)))"
+        match_sql += " OR %(phrase)s <%% blackbot_unaccent(lower(name))"
+    after = ""
+    params = {"tsquery": tsquery, "phrase": phrase, "tenant": tenant_slug, "limit": limit + 1}
+    if cursor:
+        params["rank"], params["after_id"] = decode_search_cursor(cursor)
+        after = "WHERE (s.rank, s.id) < (%(rank)s, %(after_id)s)"
+    sql = f"""
+    SELECT * FROM (
+        SELECT {_PRODUCT_COLUMNS}, ({rank_sql})::float8 AS rank
+        FROM products, to_tsquery('portuguese', %(tsquery)s) AS query
+        WHERE tenant_slug = %(tenant)s AND ({match_sql})
+    ) s
+    {after}
+    ORDER BY s.rank DESC, s.id DESC
+    LIMIT %(limit)s
+    """
+    with get_conn() as conn:
+        with conn.cursor(row_factory=dict_row) as c:
+            c.execute(sql, params)
+            rows = c.fetchall()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_search_cursor(rows[-1]["rank"], rows[-1]["id"])
+    return ProductPage(rows, next_cursor, 0, 0)
+
+
+# Colunas do import/export em massa (mesma ordem do COPY)
+BULK_FIELDS = ("sku", "name", "description", "price_cents", "currency", "image_url")
+
+
+def import_products(tenant_slug: str, rows: Iterable[tuple], dry_run: bool = False) -> dict:
+    """
+    Import em massa: `rows` (tuplas na ordem de BULK_FIELDS, já validadas)
+    vão por COPY para uma tabela temporária e entram em products com um
+    upsert por (tenant_slug, sku), tudo numa transação. Células vazias de
+    description/image_url não apagam o valor atual; linha idêntica não
+    conta como atualizada. `rows` pode ser um gerador (nada fica inteiro
+    em memória). Com dry_run, valida e desfaz. DuplicateSkus se a base
+    ainda não tem o índice único de SKU (dados antigos com repetição).
+    """
+    cols = ", ".join(BULK_FIELDS)
+    with get_conn() as conn:
+        with conn.cursor() as c:
+            _ensure_sku_index(conn, c)
+            c.execute(f"""
+                CREATE TEMP TABLE products_import (
+                    sku TEXT NOT NULL, name TEXT NOT NULL, description TEXT,
+                    price_cents INT NOT NULL, currency TEXT NOT NULL, image_url TEXT
+                ) ON COMMIT DROP
+            """)
+            with c.copy(f"COPY products_import ({cols}) FROM STDIN") as cp:
+                for row in rows:
+                    cp.write_row(row)
+            c.execute(f"""
+                WITH up AS (
+                    INSERT INTO products (tenant_slug, {cols})
+                    SELECT %s, {cols} FROM products_import
+                    ON CONFLICT (tenant_slug, sku) WHERE sku IS NOT NULL DO UPDATE SET
+                      name = EXCLUDED.name,
+                      description = COALESCE(EXCLUDED.description, products.description),
+                      price_cents = EXCLUDED.price_cents,
+                      currency = EXCLUDED.currency,
+                      image_url = COALESCE(EXCLUDED.image_url, products.image_url),
+                      image_variants = CASE
+                        WHEN COALESCE(EXCLUDED.image_url, products.image_url) IS DISTINCT FROM products.image_url
+                        THEN NULL ELSE products.image_variants END,
+                      updated_at = NOW()
+                    WHERE (products.name, products.description, products.price_cents,
+                           products.currency, products.image_url)
+                      IS DISTINCT FROM
+                          (EXCLUDED.name, COALESCE(EXCLUDED.description, products.description),
+                           EXCLUDED.price_cents, EXCLUDED.currency,
+                           COALESCE(EXCLUDED.image_url, products.image_url))
+                    RETURNING (xmax = 0) AS inserted
+                )
+                SELECT COUNT(*) FILTER (WHERE inserted), COUNT(*) FILTER (WHERE NOT inserted),
+                       (SELECT COUNT(*) FROM products_import)
+                FROM up
+            """, (tenant_slug,))
+            inserted, updated, staged = c.fetchone()
+            version = None
+            if dry_run:
+                conn.rollback()
+            elif inserted or updated:
+                version = _bump_catalog_version(c, tenant_slug, count_delta=inserted)
+                conn.commit()
+            else:
+                conn.commit()
+    if version is not None:
+        _products_changed(tenant_slug, version)
+    return {
+        "inserted": int(inserted),
+        "updated": int(updated),
+        "unchanged": int(staged - inserted - updated),
+        "version": version,
+    }
+
+
+def export_products(tenant_slug: str, fmt: str = "csv", chunk_rows: int = 2000) -> Iterator[bytes]:
+    """
+    Catálogo do tenant em CSV (COPY TO STDOUT, com cabeçalho) ou JSONL
+    (cursor no servidor), em pedaços: a conexão fica presa só enquanto o
+    cliente lê e a memória não cresce com o catálogo.
+    """
+    cols = ", ".join(("id",) + BULK_FIELDS)
+    with get_conn() as conn:
+        with conn.cursor() as c:
+            if fmt == "csv":
+                query = f"COPY (SELECT {cols} FROM products WHERE tenant_slug = %s ORDER BY id) TO STDOUT WITH (FORMAT csv, HEADER)"
+                # COPY entrega uma linha por bloco; junta em ~64KB por yield
+                buf, size = [], 0
+                with c.copy(query, (tenant_slug,)) as cp:
+                    for block in cp:
+                        buf.append(bytes(block))
+                        size += len(block)
+                        if size >= 65536:
+                            yield b"".join(buf)
+                            buf, size = [], 0
+                if buf:
+                    yield b"".join(buf)
+                return
+        with conn.transaction():
+            with conn.cursor(name="export_products", row_factory=dict_row) as c:
+                c.itersize = chunk_rows
+                c.execute(f"SELECT {cols} FROM products WHERE tenant_slug = %s ORDER BY id", (tenant_slug,))
+                buf = []
+                for row in c:
+                    buf.append(json.dumps(row, ensure_ascii=False))
+                    if len(buf) >= chunk_rows:
+                        yield ("\n".join(buf) + "\n").encode("utf-8")
+                        buf = []
+                if buf:
+                    yield ("\n".join(buf) + "\n").encode("utf-8")
+
+
 def count_products(tenant_slug: str) -> int:
+    """Total mantido em catalog_versions (O(1), sem COUNT(*) em products)."""
     with get_conn() as conn:
         with conn.cursor() as c:
-            c.execute("SELECT COUNT(*) FROM products WHERE tenant_slug = %s", (tenant_slug,))
-            (n,) = c.fetchone()
-            return int(n)
+            c.execute("SELECT product_count FROM catalog_versions WHERE tenant_slug = %s", (tenant_slug,))
+            row = c.fetchone()
+            return int(row[0]) if row else 0
 
 def get_product(tenant_slug: str, product_id: int):
     sql = """
-    SELECT id, tenant_slug, sku, name, description, price_cents, currency, image_url,
+    SELECT id, tenant_slug, sku, name, description, price_cents, currency, image_url, image_variants,
            to_char(created_at, 'YYYY-MM-DD"T"HH24:MI:SS.MS"Z"') AS created_at,
            to_char(updated_at, 'YYYY-MM-DD"T"HH24:MI:SS.MS"Z"') AS updated_at
     FROM products
@@ -352,7 +1636,7 @@ def create_product(tenant_slug: str, data: dict):
     sql = """
     INSERT INTO products (tenant_slug, sku, name, description, price_cents, currency, image_url)
     VALUES (%s, %s, %s, %s, %s, %s, %s)
-    RETURNING id, tenant_slug, sku, name, description, price_cents, currency, image_url,
+    RETURNING id, tenant_slug, sku, name, description, price_cents, currency, image_url, image_variants,
               to_char(created_at, 'YYYY-MM-DD"T"HH24:MI:SS.MS"Z"') AS created_at,
               to_char(updated_at, 'YYYY-MM-DD"T"HH24:MI:SS.MS"Z"') AS updated_at
     """
@@ -368,8 +1652,10 @@ def create_product(tenant_slug: str, data: dict):
                 data.get("image_url"),
             ))
             row = c.fetchone()
+            version = _bump_catalog_version(c, tenant_slug, count_delta=1)
         conn.commit()
-        return row
+    _products_changed(tenant_slug, version)
+    return row
 
 def update_product(tenant_slug: str, product_id: int, data: dict):
     allowed = ["sku", "name", "description", "price_cents", "currency", "image_url"]
@@ -382,13 +1668,17 @@ def update_product(tenant_slug: str, product_id: int, data: dict):
 
     if not fields:
         return get_product(tenant_slug, product_id)
+    if data.get("image_url") is not None:
+        # Foto nova: as variantes da antiga não servem mais (o confirm gera outras)
+        fields.append("image_variants = CASE WHEN image_url IS DISTINCT FROM %s THEN NULL ELSE image_variants END")
+        values.append(data["image_url"])
 
     set_clause = ", ".join(fields + ["updated_at = NOW()"])
     sql = f"""
     UPDATE products
        SET {set_clause}
      WHERE tenant_slug = %s AND id = %s
-     RETURNING id, tenant_slug, sku, name, description, price_cents, currency, image_url,
+     RETURNING id, tenant_slug, sku, name, description, price_cents, currency, image_url, image_variants,
                to_char(created_at, 'YYYY-MM-DD"T"HH24:MI:SS.MS"Z"') AS created_at,
                to_char(updated_at, 'YYYY-MM-DD"T"HH24:MI:SS.MS"Z"') AS updated_at
     """
@@ -398,13 +1688,79 @@ def update_product(tenant_slug: str, product_id: int, data: dict):
         with conn.cursor(row_factory=dict_row) as c:
             c.execute(sql, tuple(values))
             row = c.fetchone()
+            version = _bump_catalog_version(c, tenant_slug) if row else None
         conn.commit()
-        return row
+    if row:
+        _products_changed(tenant_slug, version)
+    return row
 
 def delete_product(tenant_slug: str, product_id: int) -> bool:
     with get_conn() as conn:
         with conn.cursor() as c:
             c.execute("DELETE FROM products WHERE tenant_slug = %s AND id = %s", (tenant_slug, product_id))
             deleted = c.rowcount > 0
+            version = _bump_catalog_version(c, tenant_slug, count_delta=-1) if deleted else None
+        conn.commit()
+    if deleted:
+        _products_changed(tenant_slug, version)
+    return deleted
+
+
+def set_product_image(tenant_slug: str, product_id: int, image_url: str, variants: Optional[dict]):
+    """Foto confirmada (original + variantes de images.py) num produto; None se não existe."""
+    sql = """
+    UPDATE products
+       SET image_url = %s, image_variants = %s, updated_at = NOW()
+     WHERE tenant_slug = %s AND id = %s
+     RETURNING id, tenant_slug, sku, name, description, price_cents, currency, image_url, image_variants,
+               to_char(created_at, 'YYYY-MM-DD"T"HH24:MI:SS.MS"Z"') AS created_at,
+               to_char(updated_at, 'YYYY-MM-DD"T"HH24:MI:SS.MS"Z"') AS updated_at
+    """
+    with get_conn() as conn:
+        with conn.cursor(row_factory=dict_row) as c:
+            c.execute(sql, (image_url, Jsonb(variants) if variants else None, tenant_slug, product_id))
+            row = c.fetchone()
+            version = _bump_catalog_version(c, tenant_slug) if row else None
+        conn.commit()
+    if row:
+        _products_changed(tenant_slug, version)
+    return row
+
+
+# -------------------------------------------------------------------
+# MARCA DO CARDÁPIO
+# -------------------------------------------------------------------
+BRANDING_FIELDS = ("brand_name", "subtitle", "banner_url")
+
+
+def get_branding(tenant_slug: str) -> Optional[dict]:
+    with get_conn() as conn:
+        with conn.cursor(row_factory=dict_row) as c:
+            c.execute(
+                "SELECT brand_name, subtitle, banner_url FROM tenant_branding WHERE tenant_slug = %s",
+                (tenant_slug,),
+            )
+            return c.fetchone()
+
+
+def set_branding(tenant_slug: str, data: dict) -> dict:
+    """
+    Grava a marca do cardápio (campos ausentes ficam como estão). Conta
+    como mudança do catálogo: sobe a versão e avisa os listeners (HTML do
+    cardápio, snapshots, ETags).
+    """
+    present = [k for k in BRANDING_FIELDS if k in data]
+    updates = ", ".join(f"{k} = EXCLUDED.{k}" for k in present) or "brand_name = tenant_branding.brand_name"
+    with get_conn() as conn:
+        with conn.cursor(row_factory=dict_row) as c:
+            c.execute(f"""
+                INSERT INTO tenant_branding (tenant_slug, brand_name, subtitle, banner_url)
+                VALUES (%s, %s, %s, %s)
+                ON CONFLICT (tenant_slug) DO UPDATE SET {updates}, updated_at = NOW()
+                RETURNING brand_name, subtitle, banner_url
+            """, (tenant_slug, *[data.get(k) for k in BRANDING_FIELDS]))
+            row = c.fetchone()
+            version = _bump_catalog_version(c, tenant_slug)
         conn.commit()
-        return deleted
\ No newline at end of file
+    _products_changed(tenant_slug, version)
+    return row
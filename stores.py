@@ -0,0 +1,78 @@
+# stores.py
+"""
+Interfaces que o engine usa para ler/gravar sessão e registrar pedidos.
+
+O engine não conhece o storage: ele recebe qualquer objeto com os métodos
+de SessionStore e OrderSink. Implementações:
+
+- storage.ConversationTurn: turno de uma mensagem (escritas num commit único);
+- PostgresStore: uma ida ao banco por chamada (importa o storage só quando usado);
+- MemoryStore: tudo em dicts, para testes, replay e benchmark sem Postgres.
+"""
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional, Protocol, Tuple
+
+# Sessão parada há mais que isso volta ao início do fluxo
+SESSION_TIMEOUT_MINUTES = float(os.getenv("SESSION_TIMEOUT_MINUTES", "90"))
+
+
+class SessionStore(Protocol):
+    def load_session(self, wa_id: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """(state, data) da sessão ativa; None se não existe ou expirou."""
+        ...
+
+    def save_session(self, wa_id: str, state: str, data: Dict[str, Any]) -> None:
+        ...
+
+
+class OrderSink(Protocol):
+    def save_order(self, wa_id: str, data: str, tipo: str, qtd: str, status: str = "NOVO") -> None:
+        ...
+
+
+class PostgresStore:
+    """Delegação direta para o storage (pool do Postgres)."""
+
+    def load_session(self, wa_id: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        import storage
+
+        return storage.load_session(wa_id)
+
+    def save_session(self, wa_id: str, state: str, data: Dict[str, Any]) -> None:
+        import storage
+
+        storage.save_session(wa_id, state, data)
+
+    def save_order(self, wa_id: str, data: str, tipo: str, qtd: str, status: str = "NOVO") -> None:
+        import storage
+
+        storage.save_order(wa_id, data, tipo, qtd, status)
+
+
+class MemoryStore:
+    """
+    Sessões e pedidos em memória (um processo, sem persistência).
+    `clock` permite simular o tempo (ex.: replay com os horários gravados).
+    """
+
+    def __init__(self, clock: Callable[[], datetime] = None, timeout_minutes: float = SESSION_TIMEOUT_MINUTES):
+        self.clock = clock or (lambda: datetime.now(timezone.utc))
+        self.timeout = timedelta(minutes=timeout_minutes)
+        self.sessions: Dict[str, Tuple[str, Dict[str, Any], datetime]] = {}
+        self.orders: List[dict] = []
+
+    def load_session(self, wa_id: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        row = self.sessions.get(wa_id)
+        if row is None or row[2] <= self.clock() - self.timeout:
+            return None
+        return row[0], dict(row[1])
+
+    def save_session(self, wa_id: str, state: str, data: Dict[str, Any]) -> None:
+        self.sessions[wa_id] = (state, dict(data), self.clock())
+
+    def save_order(self, wa_id: str, data: str, tipo: str, qtd: str, status: str = "NOVO") -> None:
+        self.orders.append({"wa_id": wa_id, "data": data, "tipo": tipo, "qtd": qtd, "status": status})
+
+
+postgres_store = PostgresStore()
@@ -0,0 +1,81 @@
+# tasks.py
+"""
+Tarefas periódicas em background (manutenção do banco, dispatchers etc.).
+
+Cada PeriodicTask roda uma função a cada `interval` segundos dentro do event
+loop do app: funções síncronas vão para o threadpool, corrotinas são
+aguardadas. start()/stop() são chamados no lifespan do FastAPI.
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Callable, Dict, Optional
+
+from fastapi.concurrency import run_in_threadpool
+
+
+class PeriodicTask:
+    def __init__(self, name: str, func: Callable[[], Any], interval: float, initial_delay: float = 0.0):
+        self.name = name
+        self.func = func
+        self.interval = float(interval)
+        self.initial_delay = float(initial_delay)
+        self._task: Optional[asyncio.Task] = None
+        self.runs = 0
+        self.errors = 0
+        self.last_result: Any = None
+        self.last_run_at: Optional[float] = None
+        self.last_duration: Optional[float] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.interval > 0
+
+    def start(self) -> None:
+        if not self.enabled or self._task is not None:
+            return
+        self._task = asyncio.create_task(self._loop(), name=f"task-{self.name}")
+        logging.info(f"[task:{self.name}] iniciada a cada {self.interval:g}s")
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def run_once(self) -> Any:
+        t0 = time.perf_counter()
+        try:
+            if asyncio.iscoroutinefunction(self.func):
+                self.last_result = await self.func()
+            else:
+                self.last_result = await run_in_threadpool(self.func)
+            return self.last_result
+        except Exception:
+            self.errors += 1
+            logging.exception(f"[task:{self.name}] falhou")
+            return None
+        finally:
+            self.runs += 1
+            self.last_run_at = time.time()
+            self.last_duration = time.perf_counter() - t0
+
+    async def _loop(self) -> None:
+        if self.initial_delay:
+            await asyncio.sleep(self.initial_delay)
+        while True:
+            await self.run_once()
+            await asyncio.sleep(self.interval)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "running": self._task is not None,
+            "interval": self.interval,
+            "runs": self.runs,
+            "errors": self.errors,
+            "last_result": self.last_result,
+            "last_run_at": self.last_run_at,
+            "last_duration": self.last_duration,
+        }
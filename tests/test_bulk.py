@@ -0,0 +1,84 @@
+import io
+import uuid
+
+import pytest
+
+import bulk
+from bulk import ImportReport, detect_format, iter_records, valid_rows, validate
+
+
+def _stream(text):
+    return io.BytesIO(text.encode("utf-8"))
+
+
+def test_validate_builds_row_in_bulk_field_order():
+    row, error = validate({"sku": " b1 ", "name": "Brigadeiro", "price_cents": "250", "currency": "brl",
+                           "description": "", "image_url": None})
+    assert error is None
+    assert row == ("b1", "Brigadeiro", None, 250, "BRL", None)
+
+
+@pytest.mark.parametrize("record,message", [
+    ({"name": "x", "price_cents": 1}, "sku obrigatório"),
+    ({"sku": "a", "name": "  ", "price_cents": 1}, "name obrigatório"),
+    ({"sku": "a", "name": "x", "price_cents": "1.5"}, "price_cents deve ser inteiro"),
+    ({"sku": "a", "name": "x", "price_cents": True}, "price_cents deve ser inteiro"),
+    ({"sku": "a", "name": "x", "price_cents": ""}, "price_cents deve ser inteiro"),
+    ({"sku": "a", "name": "x", "price_cents": -1}, "price_cents deve ser >= 0"),
+    ({"sku": "a", "name": "x", "price_cents": 1, "currency": "REAL"}, "currency deve ter 3 letras (ex.: BRL)"),
+])
+def test_validate_errors(record, message):
+    assert validate(record) == (None, message)
+
+
+def test_iter_records_csv_reports_file_lines():
+    text = '\ufeffsku,name,price_cents\na,"Bolo\nde pote",100\nb,Beijinho,50\n'
+    records = list(iter_records(_stream(text), "csv"))
+    assert [(line, r["sku"]) for line, r, _ in records] == [(3, "a"), (4, "b")]
+    assert records[0][1]["name"] == "Bolo\nde pote"
+
+
+def test_iter_records_jsonl_skips_blank_lines_and_flags_bad_ones():
+    text = '{"sku": "a"}\n\n[1, 2]\n{oops\n'
+    records = list(iter_records(_stream(text), "jsonl"))
+    assert records[0] == (1, {"sku": "a"}, None)
+    assert records[1] == (3, None, "cada linha deve ser um objeto JSON")
+    assert records[2][0] == 4 and records[2][2].startswith("JSON inválido")
+
+
+def test_valid_rows_keeps_first_duplicate_sku():
+    report = ImportReport(max_errors=1)
+    text = "sku,name,price_cents\na,A,1\na,A2,2\nb,,3\n"
+    rows = list(valid_rows(iter_records(_stream(text), "csv"), report))
+    assert [r[0] for r in rows] == ["a"]
+    out = report.to_dict()
+    assert (out["rows"], out["valid"], out["invalid"]) == (3, 1, 2)
+    assert out["errors"] == [{"line": 3, "sku": "a", "error": "sku repetido no arquivo"}]
+    assert out["errors_truncated"]
+
+
+def test_detect_format():
+    assert detect_format("application/x-ndjson; charset=utf-8") == "jsonl"
+    assert detect_format(None) == "csv"
+    assert detect_format("text/csv", "JSONL") == "jsonl"
+    with pytest.raises(ValueError):
+        detect_format(None, "xlsx")
+
+
+def test_import_upserts_by_sku(db):
+    tenant = f"test-bulk-{uuid.uuid4().hex[:8]}"
+    first = bulk.import_stream(tenant, _stream("sku,name,price_cents\na,A,100\nb,B,200\n"), "csv")
+    assert first["valid"] == 2 and not first["dry_run"]
+    bulk.import_stream(tenant, _stream('{"sku": "a", "name": "A+", "price_cents": 150}\n'), "jsonl")
+    products = {p["sku"]: p for p in db.list_products(tenant, limit=10)}
+    assert products["a"]["name"] == "A+" and products["a"]["price_cents"] == 150
+    assert set(products) == {"a", "b"}
+
+
+def test_duplicate_sku_on_create_raises_unique_violation(db):
+    from psycopg.errors import UniqueViolation
+
+    tenant = f"test-bulk-{uuid.uuid4().hex[:8]}"
+    db.create_product(tenant, {"sku": "a", "name": "A", "price_cents": 1})
+    with pytest.raises(UniqueViolation):
+        db.create_product(tenant, {"sku": "a", "name": "A de novo", "price_cents": 1})
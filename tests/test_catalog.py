@@ -0,0 +1,80 @@
+import pytest
+
+import catalog
+import engine
+import flows
+from catalog import CatalogCache, chunk_blocks, format_price, render_catalog
+from stores import MemoryStore
+
+
+def test_chunk_blocks_packs_without_splitting_blocks():
+    blocks = ["a" * 4, "b" * 4, "c" * 4]
+    assert chunk_blocks(blocks, limit=10, sep="\n\n") == ["aaaa\n\nbbbb", "cccc"]
+
+
+def test_chunk_blocks_splits_oversized_block_by_line():
+    block = "x" * 6 + "\n" + "y" * 3
+    chunks = chunk_blocks([block], limit=4, sep="\n")
+    assert all(len(c) <= 4 for c in chunks)
+    assert "".join(chunks).replace("\n", "") == "x" * 6 + "y" * 3
+
+
+def test_render_catalog_sorted_and_within_limit():
+    products = [{"name": f"Doce {i:03d}", "price_cents": 150 * i, "description": "d" * 300} for i in range(60)]
+    chunks = render_catalog(list(reversed(products)), limit=1000)
+    assert len(chunks) > 1 and all(len(c) <= 1000 for c in chunks)
+    assert chunks[0].startswith(catalog.CATALOG_HEADER)
+    assert chunks[-1].endswith(catalog.CATALOG_FOOTER)
+    text = "\n\n".join(chunks)
+    assert text.index("Doce 001") < text.index("Doce 059")
+    assert render_catalog([]) == []
+
+
+def test_format_price_brl():
+    assert format_price(123450) == "R$ 1.234,50"
+    assert format_price(99, "USD") == "USD 0.99"
+
+
+def test_failed_render_is_cached_for_error_ttl(monkeypatch):
+    calls = []
+
+    def broken(tenant):
+        calls.append(tenant)
+        raise RuntimeError("banco fora")
+
+    monkeypatch.setattr(catalog, "load_products", broken)
+    cache = CatalogCache(ttl=300, error_ttl=30)
+    assert cache.get("t") == []
+    assert cache.get("t") == []
+    assert calls == ["t"]
+    assert cache.stats()["errors"] == 1
+
+    # Expirado o cache negativo, tenta de novo
+    cache._items["t"] = ([], 0.0)
+    cache.get("t")
+    assert calls == ["t", "t"]
+
+
+def test_invalidate_drops_cached_catalog(monkeypatch):
+    monkeypatch.setattr(catalog, "load_products", lambda tenant: [{"name": "Brigadeiro", "price_cents": 250}])
+    cache = CatalogCache()
+    assert cache.get("t") == cache.cached("t")
+    cache.invalidate("t")
+    assert cache.cached("t") is None
+
+
+@pytest.mark.parametrize("text,expected", [("2", True), ("preços", True), ("1", False), ("menu", False)])
+def test_needs_catalog_only_for_catalog_action(text, expected):
+    flow = flows.registry.default
+    store = MemoryStore()
+    assert engine.needs_catalog("w", text, turn=store, flow=flow) is expected
+    # Só lê: a sessão não muda
+    assert store.sessions == {}
+
+
+def test_catalog_reply_uses_rendered_messages():
+    flow = flows.registry.default
+    store = MemoryStore()
+    assert engine.next_replies("w", "2", turn=store, flow=flow, catalog=["A", "B"]) == ["A", "B"]
+    # Sem catálogo (vazio/falha), vale o texto fixo da transição
+    assert engine.next_replies("w", "2", turn=store, flow=flow)[0].startswith("Certo!")
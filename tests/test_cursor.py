@@ -0,0 +1,40 @@
+import base64
+import uuid
+
+import pytest
+
+from storage import decode_cursor, encode_cursor
+
+
+@pytest.mark.parametrize("last_id", [1, 42, 2**40])
+def test_cursor_round_trip(last_id):
+    cursor = encode_cursor(last_id)
+    assert "=" not in cursor  # vai em query string sem escape
+    assert decode_cursor(cursor) == last_id
+
+
+@pytest.mark.parametrize("cursor", [
+    "",
+    "%%%",
+    base64.urlsafe_b64encode(b"offset:10").decode(),
+    base64.urlsafe_b64encode(b"id:abc").decode(),
+    base64.urlsafe_b64encode(b"\xff\xfe").decode(),
+])
+def test_invalid_cursor_raises_value_error(cursor):
+    with pytest.raises(ValueError, match="cursor inválido"):
+        decode_cursor(cursor)
+
+
+def test_paging_with_cursor(db):
+    tenant = f"test-cursor-{uuid.uuid4().hex[:8]}"
+    for i in range(5):
+        db.create_product(tenant, {"name": f"Produto {i}", "price_cents": 100 + i})
+
+    first = db.page_products(tenant, limit=2)
+    assert first.total == 5 and len(first.items) == 2 and first.next_cursor
+    seen = [p["id"] for p in first.items]
+    page = first
+    while page.next_cursor:
+        page = db.page_products(tenant, limit=2, cursor=page.next_cursor)
+        seen.extend(p["id"] for p in page.items)
+    assert seen == sorted(seen, reverse=True) and len(set(seen)) == 5
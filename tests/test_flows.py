@@ -0,0 +1,69 @@
+import copy
+
+import pytest
+
+from flows import DEFAULT_FLOW, CompiledFlow, FlowError
+
+
+def _flow(**changes):
+    definition = copy.deepcopy(DEFAULT_FLOW)
+    definition.update(changes)
+    return definition
+
+
+def _with_start(**spec):
+    definition = copy.deepcopy(DEFAULT_FLOW)
+    definition["states"]["START"].update(spec)
+    return definition
+
+
+def test_default_flow_compiles():
+    flow = CompiledFlow(DEFAULT_FLOW)
+    assert flow.start == "START"
+    assert flow.states["START"].index["2"].action == "catalog"
+    # Palavras normalizadas (sem acento/caixa)
+    assert flow.states["START"].index["precos"] is flow.states["START"].index["2"]
+    assert flow.globals["ajuda"].goto == "START"
+
+
+@pytest.mark.parametrize("definition", [
+    [],
+    _flow(states={}),
+    _flow(start="NAO_EXISTE"),
+    _flow(start=1),
+    _flow(menu=["x"]),
+    _flow(order="AGUARDANDO_HUMANO"),
+    _flow(order={"fields": {"data": 1}}),
+    _flow(globals={"keywords": ["x"], "reply": "y"}),
+    _flow(globals=[{"keywords": "ajuda", "reply": "y"}]),
+    _flow(globals=[{"keywords": [1], "reply": "y"}]),
+    _flow(globals=["ajuda"]),
+    _with_start(intents=[{"keywords": ["1"], "reply": 123}]),
+    _with_start(intents=[{"keywords": ["1"], "goto": ["DATA"]}]),
+    _with_start(intents=[{"keywords": ["1"], "goto": "NAO_EXISTE"}]),
+    _with_start(intents=[{"keywords": ["1"], "action": "pagar", "reply": "x"}]),
+    _with_start(intents=[{"keywords": ["1"]}]),
+    _with_start(default="oi"),
+    _with_start(prompt=["x"]),
+    _with_start(goto="DATA"),
+])
+def test_invalid_definitions_raise_flow_error(definition):
+    with pytest.raises(FlowError):
+        CompiledFlow(definition)
+
+
+def test_capture_state_checks_types():
+    definition = copy.deepcopy(DEFAULT_FLOW)
+    definition["states"]["OBS"]["empty_words"] = "não"
+    with pytest.raises(FlowError):
+        CompiledFlow(definition)
+    definition["states"]["OBS"]["empty_words"] = ["não"]
+    definition["states"]["OBS"]["capture"] = 1
+    with pytest.raises(FlowError):
+        CompiledFlow(definition)
+
+
+def test_render_keeps_unknown_placeholders():
+    flow = CompiledFlow(DEFAULT_FLOW)
+    assert flow.render("{data} {nada}", {"data": "15/02"}) == "15/02 —"
+    assert flow.render("{0}", {}) == "{0}"
@@ -0,0 +1,27 @@
+from idempotency import RecentIds
+
+
+def test_seen_only_after_add():
+    ids = RecentIds(maxsize=10, ttl=60)
+    assert not ids.seen("wamid.1")
+    ids.add_many(["wamid.1"])
+    assert ids.seen("wamid.1")
+    assert ids.stats()["hits"] == 1 and ids.stats()["misses"] == 1
+
+
+def test_lru_evicts_oldest():
+    ids = RecentIds(maxsize=2, ttl=60)
+    ids.add_many(["a", "b"])
+    assert ids.seen("a")  # "a" vira o mais recente
+    ids.add_many(["c"])
+    assert ids.seen("a") and ids.seen("c")
+    assert not ids.seen("b")
+    assert ids.evictions == 1
+
+
+def test_expired_entry_is_a_miss():
+    ids = RecentIds(maxsize=10, ttl=0)
+    ids.add_many(["a"])
+    ids._items["a"] -= 1  # envelhece a entrada
+    assert not ids.seen("a")
+    assert len(ids) == 0
@@ -0,0 +1,141 @@
+import asyncio
+import io
+import os
+import uuid
+
+import pytest
+from botocore.exceptions import ClientError
+
+import images
+from images import IMAGE_MEDIUM_SIZE, IMAGE_THUMB_SIZE, ImageError, ImageVariantPipeline, variant_key
+
+Image = pytest.importorskip("PIL.Image")
+
+
+def _png(width, height, mode="RGB"):
+    buf = io.BytesIO()
+    Image.new(mode, (width, height), (200, 30, 30, 128) if mode == "RGBA" else (200, 30, 30)).save(buf, "PNG")
+    return buf.getvalue()
+
+
+@pytest.fixture(scope="module")
+def pipeline(r2):
+    p = ImageVariantPipeline(workers=1, storage=r2)
+    yield p
+    p.shutdown()
+
+
+def _key(slug="loja"):
+    return f"{slug}/{uuid.uuid4().hex}.png"
+
+
+def test_variant_key():
+    assert variant_key("loja/abc.png", "thumb", "webp") == "loja/abc.thumb.webp"
+    assert variant_key("loja/abc", "medium", "jpeg") == "loja/abc.medium.jpg"
+    assert variant_key("lo.ja/abc", "thumb", "jpeg") == "lo.ja/abc.thumb.jpg"
+
+
+def test_process_uploads_every_variant(r2, pipeline):
+    key = _key()
+    r2.put_object(key, _png(2000, 1000), "image/png")
+    variants = asyncio.run(pipeline.process(key))
+
+    assert set(variants) == set(images.VARIANTS)
+    # thumb: menor lado = IMAGE_THUMB_SIZE; medium: maior lado = IMAGE_MEDIUM_SIZE
+    assert (variants["thumb"]["width"], variants["thumb"]["height"]) == (2 * IMAGE_THUMB_SIZE, IMAGE_THUMB_SIZE)
+    assert (variants["medium"]["width"], variants["medium"]["height"]) == (IMAGE_MEDIUM_SIZE, IMAGE_MEDIUM_SIZE // 2)
+    for name, entry in variants.items():
+        for fmt, pil_format in (("webp", "WEBP"), ("jpeg", "JPEG")):
+            vkey = variant_key(key, name, fmt)
+            assert entry[fmt] == r2.build_public_url(vkey)
+            img = Image.open(io.BytesIO(r2.get_object(vkey)))
+            assert img.format == pil_format
+            assert img.size == (entry["width"], entry["height"])
+
+
+def test_small_image_is_not_upscaled(r2, pipeline):
+    key = _key()
+    r2.put_object(key, _png(100, 80, "RGBA"), "image/png")
+    variants = asyncio.run(pipeline.process(key))
+    assert all((v["width"], v["height"]) == (100, 80) for v in variants.values())
+
+
+def test_invalid_image_raises_image_error(r2, pipeline):
+    key = _key()
+    r2.put_object(key, b"isto nao e uma imagem", "image/png")
+    failed = pipeline.failed
+    with pytest.raises(ImageError):
+        asyncio.run(pipeline.process(key))
+    assert pipeline.failed == failed + 1
+    assert r2.list_keys(key.rsplit(".", 1)[0] + ".") == [key]
+
+
+def test_missing_original_raises_no_such_key(r2, pipeline):
+    with pytest.raises(ClientError) as exc:
+        asyncio.run(pipeline.process(_key()))
+    assert exc.value.response["Error"]["Code"] == "NoSuchKey"
+
+
+def test_confirm_endpoint_status_codes(db, r2):
+    from fastapi.testclient import TestClient
+
+    import app as app_module
+
+    client = TestClient(app_module.app)
+    headers = {"X-Admin-Token": os.environ["ADMIN_TOKEN"]}
+    url = "/api/t/loja/uploads/confirm"
+
+    missing = client.post(url, json={"key": _key()}, headers=headers)
+    assert missing.status_code == 404
+
+    bad = _key()
+    r2.put_object(bad, b"lixo", "image/png")
+    assert client.post(url, json={"key": bad}, headers=headers).status_code == 422
+
+    assert client.post(url, json={"key": "outra/abc.png"}, headers=headers).status_code == 400
+
+    good = _key()
+    r2.put_object(good, _png(300, 300), "image/png")
+    ok = client.post(url, json={"key": good}, headers=headers)
+    assert ok.status_code == 200
+    assert ok.json()["variants"]["thumb"]["width"] == IMAGE_THUMB_SIZE
+    app_module.image_pipeline.shutdown()
+
+
+def test_confirm_unknown_product_uploads_nothing(db, r2):
+    from fastapi.testclient import TestClient
+
+    import app as app_module
+
+    client = TestClient(app_module.app)
+    key = _key()
+    r2.put_object(key, _png(300, 300), "image/png")
+    resp = client.post("/api/t/loja/uploads/confirm", json={"key": key, "product_id": 2**31 - 1},
+                       headers={"X-Admin-Token": os.environ["ADMIN_TOKEN"]})
+    assert resp.status_code == 404
+    assert r2.list_keys(key.rsplit(".", 1)[0] + ".") == [key]
+
+
+def test_confirm_error_mapping(db, r2, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    import app as app_module
+
+    client = TestClient(app_module.app)
+    headers = {"X-Admin-Token": os.environ["ADMIN_TOKEN"]}
+    url = "/api/t/loja/uploads/confirm"
+
+    big = _key()
+    r2.put_object(big, _png(300, 300), "image/png")
+    monkeypatch.setattr(images, "IMAGE_MAX_BYTES", 10)
+    assert client.post(url, json={"key": big}, headers=headers).status_code == 413
+
+    class HttpError(Exception):
+        response = "não é um dict"  # ex.: exceções de httpx/requests
+
+    async def broken(key):
+        raise HttpError("falhou")
+
+    monkeypatch.setattr(app_module.image_pipeline, "process", broken)
+    resp = client.post(url, json={"key": _key()}, headers=headers)
+    assert resp.status_code == 500 and "falhou" in resp.json()["detail"]
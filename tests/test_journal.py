@@ -0,0 +1,110 @@
+import asyncio
+import json
+
+from journal import EventJournal, tag_messages
+from pipeline import WebhookPipeline
+
+
+def _payload(*ids):
+    return {
+        "entry": [{"changes": [{"value": {
+            "metadata": {"phone_number_id": "111"},
+            "messages": [{"id": i, "from": "5511999", "type": "text", "text": {"body": "oi"}} for i in ids],
+        }}]}]
+    }
+
+
+async def _failing_prefilter(items):
+    raise RuntimeError("banco fora")
+
+
+def test_event_marked_only_when_all_messages_ok():
+    journal = EventJournal()
+    msgs = tag_messages(7, _payload("a", "b"))
+    journal.expect(7, len(msgs))
+    journal.ack(msgs[0])
+    assert journal.in_flight(7) and journal._done == []
+    journal.ack(msgs[1])
+    assert not journal.in_flight(7)
+    assert journal._done == [7]
+
+
+def test_failed_message_leaves_event_for_replay():
+    journal = EventJournal()
+    msgs = tag_messages(8, _payload("a", "b"))
+    journal.expect(8, len(msgs))
+    journal.ack(msgs[0], ok=False)
+    journal.ack(msgs[1])
+    assert not journal.in_flight(8)
+    assert journal._done == []
+
+
+def test_inline_prefilter_failure_acks_as_failed():
+    journal = EventJournal()
+    handled = []
+
+    async def handler(item):
+        handled.append(item)
+
+    pipeline = WebhookPipeline(handler=handler, prefilter=_failing_prefilter,
+                               on_drop=lambda m: journal.ack(m, ok=False))
+    msgs = tag_messages(9, _payload("a", "b"))
+    journal.expect(9, len(msgs))
+    asyncio.run(pipeline.run_inline(msgs))
+    assert handled == []
+    assert pipeline.dropped == 2
+    assert not journal.in_flight(9) and journal._done == []
+
+
+def test_queue_prefilter_failure_acks_as_failed():
+    journal = EventJournal()
+    dropped = []
+
+    async def handler(item):
+        raise AssertionError("item descartado não deveria ser processado")
+
+    def on_drop(item):
+        dropped.append(item["id"])
+        journal.ack(item, ok=False)
+
+    async def run():
+        pipeline = WebhookPipeline(handler=handler, prefilter=_failing_prefilter, shards=1, on_drop=on_drop)
+        await pipeline.start()
+        msgs = tag_messages(10, _payload("a"))
+        journal.expect(10, len(msgs))
+        await pipeline.submit(msgs)
+        await pipeline.stop(timeout=10)
+        return pipeline
+
+    pipeline = asyncio.run(run())
+    assert dropped == ["a"]
+    assert pipeline.failed == 1
+    assert not journal.in_flight(10) and journal._done == []
+
+
+def test_dropped_event_is_replayed(db):
+    journal = EventJournal()
+    raw = json.dumps(_payload("wamid.replay-drop"))
+    event_id = db.journal_append_many([raw])[0]
+
+    async def handler(item):
+        pass
+
+    async def run():
+        pipeline = WebhookPipeline(handler=handler, prefilter=_failing_prefilter,
+                                   on_drop=lambda m: journal.ack(m, ok=False))
+        msgs = tag_messages(event_id, json.loads(raw))
+        journal.expect(event_id, len(msgs))
+        await pipeline.run_inline(msgs)
+        await journal._flush_done()
+
+    asyncio.run(run())
+    pending = [eid for eid, _ in db.journal_load_unprocessed(0, after_id=event_id - 1)]
+    assert event_id in pending
+    db.journal_mark_processed([event_id])
+
+
+def test_event_without_messages_is_done():
+    journal = EventJournal()
+    journal.expect(11, 0)
+    assert journal._done == [11]
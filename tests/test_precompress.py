@@ -0,0 +1,86 @@
+import gzip
+import os
+
+import pytest
+
+import precompress
+from assets import AssetPipeline
+from menupage import MenuPageCache, RenderedMenu
+from precompress import accepted_encodings, compress_variants, etag_matches, pick_encoding
+
+ALL = ("identity", "gzip", "br")
+
+
+@pytest.mark.parametrize("header,available,expected", [
+    (None, ALL, "identity"),
+    ("", ALL, "identity"),
+    ("gzip, deflate, br", ALL, "br"),
+    ("gzip", ALL, "gzip"),
+    ("br;q=0, gzip", ALL, "gzip"),
+    ("br, gzip", ("identity", "gzip"), "gzip"),
+    ("*", ALL, "br"),
+    ("*;q=0, gzip", ALL, "gzip"),
+    ("GZIP;q=0.5", ("identity",), "identity"),
+    ("deflate", ALL, "identity"),
+])
+def test_pick_encoding(header, available, expected):
+    assert pick_encoding(header, available) == expected
+
+
+def test_accepted_encodings_parses_q_values():
+    assert accepted_encodings("gzip;q=0.8, br, x;q=bad") == {"gzip": 0.8, "br": 1.0, "x": 0.0}
+
+
+def test_compress_variants():
+    data = b"<p>cardapio</p>" * 100
+    variants = compress_variants(data)
+    assert gzip.decompress(variants["gzip"]) == data
+    assert ("br" in variants) == (precompress.brotli is not None)
+    assert compress_variants(b"tiny") == {"identity": b"tiny"}
+
+
+@pytest.mark.parametrize("header,expected", [
+    (None, False),
+    ('"a"', True),
+    ('W/"a"', True),
+    ('"b", W/"a"', True),
+    ("*", True),
+    ('"b"', False),
+])
+def test_etag_matches(header, expected):
+    assert etag_matches(header, '"a"') is expected
+
+
+def test_asset_html_revalidation_accepts_weak_and_star(tmp_path):
+    src = tmp_path / "src"
+    (src / "menu").mkdir(parents=True)
+    (src / "menu" / "index.html").write_text("<html>" + "x" * 2000 + "</html>", encoding="utf-8")
+    pipeline = AssetPipeline(source_dir=str(src), out_dir=str(tmp_path / "out"))
+    pipeline.build()
+
+    etag = pipeline.response("menu/index.html", None).headers["etag"]
+    for header in (etag, f"W/{etag}", "*"):
+        assert pipeline.response("menu/index.html", None, header).status_code == 304
+    gz = pipeline.response("menu/index.html", "gzip", etag)
+    assert gz.status_code == 200 and gz.headers["etag"] != etag
+
+
+def test_menu_etag_changes_with_template():
+    a = RenderedMenu(7, {}, "aaa")
+    assert a.etag == '"m7.aaa"'
+    assert a.etag != RenderedMenu(7, {}, "bbb").etag
+    assert a.etag != RenderedMenu(8, {}, "aaa").etag
+
+
+def test_template_tag_follows_file_content(tmp_path):
+    path = tmp_path / "menu.html"
+    path.write_text("<html>v1</html>", encoding="utf-8")
+    cache = MenuPageCache(template_path=str(path))
+    _, text, tag = cache.template()
+    assert text == "<html>v1</html>"
+
+    path.write_text("<html>v2</html>", encoding="utf-8")
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    _, text, new_tag = cache.template()
+    assert text == "<html>v2</html>" and new_tag != tag
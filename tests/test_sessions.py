@@ -0,0 +1,135 @@
+import asyncio
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from sessioncache import CachedSession, SessionCache
+
+
+def _entry(version, state="START", age=timedelta(0)):
+    return CachedSession(state, {"k": version}, datetime.now(timezone.utc) - age, False, version)
+
+
+def test_cache_never_goes_back_to_older_version():
+    cache = SessionCache(maxsize=10, ttl=60)
+    cache.put("w", _entry(3))
+    cache.put("w", _entry(2))
+    assert cache.get("w").version == 3
+
+
+def test_conflict_drops_entry():
+    cache = SessionCache(maxsize=10, ttl=60)
+    cache.put("w", _entry(1))
+    cache.conflict("w")
+    assert cache.get("w") is None
+    assert cache.stats()["conflicts"] == 1
+
+
+def test_is_active_follows_session_timeout():
+    assert SessionCache.is_active(_entry(1))
+    assert not SessionCache.is_active(_entry(1, age=timedelta(days=2)))
+    assert not SessionCache.is_active(CachedSession(None, {}, None, False, 0))
+
+
+def _wa_id():
+    return f"test-{uuid.uuid4().hex[:12]}"
+
+
+def test_turn_commit_bumps_version(db):
+    wa_id = _wa_id()
+    turn = db.begin_turn(wa_id)
+    assert turn.version == 0 and turn.session is None
+    turn.save_session(wa_id, "DATA", {"data": "15/02"})
+    turn.commit()
+    assert not turn.conflict and turn.version == 1
+
+    again = db.begin_turn(wa_id)
+    assert again.version == 1
+    assert again.session == ("DATA", {"data": "15/02"})
+
+
+def test_stale_turn_loses_to_concurrent_write(db):
+    wa_id = _wa_id()
+    first = db.begin_turn(wa_id)
+    first.save_session(wa_id, "DATA", {})
+    first.commit()
+
+    a, b = db.begin_turn(wa_id), db.begin_turn(wa_id)
+    a.save_session(wa_id, "TIPO", {"data": "a"})
+    a.commit()
+    b.save_session(wa_id, "TIPO", {"data": "b"})
+    b.commit()
+    assert not a.conflict and b.conflict
+    # A gravação que perdeu não sobrescreve a do banco
+    assert db.begin_turn(wa_id).session == ("TIPO", {"data": "a"})
+
+
+def test_cached_turn_skips_the_database(db):
+    wa_id = _wa_id()
+    turn = db.begin_turn(wa_id)
+    turn.save_session(wa_id, "DATA", {})
+    turn.commit()
+    before = db.pool.get_stats().get("requests_num", 0)
+    cached = db.begin_turn(wa_id)
+    assert db.pool.get_stats().get("requests_num", 0) == before
+    assert cached.session == ("DATA", {}) and cached.version == 1
+
+
+def test_pause_set_elsewhere_blocks_the_reply(db):
+    wa_id = _wa_id()
+    turn = db.begin_turn(wa_id)
+    turn.save_session(wa_id, "START", {})
+    turn.commit()
+
+    # Outra instância pausa direto no banco (sem subir a versão)
+    with db.get_conn() as conn:
+        conn.execute("UPDATE sessions SET pause_bot = 1 WHERE wa_id = %s", (wa_id,))
+        conn.commit()
+    # O turno do cache ainda não sabe, mas a conferência do commit pega
+    stale = db.begin_turn(wa_id)
+    stale.add_message(wa_id, "in", "text", "oi")
+    assert not stale.commit(check_version=True) and stale.conflict
+    assert db.begin_turn(wa_id, fresh=True).pause_bot
+    assert db.get_pause_bot(wa_id)
+
+
+def test_conflicting_turn_is_redone_before_sending(db, monkeypatch):
+    import app as app_module
+    from whatsapp import SendResult
+
+    wa_id = _wa_id()
+    msg_id = f"wamid.{uuid.uuid4().hex}"
+    sent = []
+
+    async def fake_send(to, text):
+        sent.append(text)
+        return SendResult(status=200, message_id="x")
+
+    real_next_replies = app_module.next_replies
+    calls = []
+
+    def racing_next_replies(*args, **kwargs):
+        if not calls:
+            # Outro worker processa uma mensagem do mesmo contato no meio do turno
+            other = db.begin_turn(wa_id, fresh=True)
+            other.save_session(wa_id, "DATA", {})
+            assert other.commit()
+        calls.append(args)
+        return real_next_replies(*args, **kwargs)
+
+    monkeypatch.setattr(app_module, "send_text", fake_send)
+    monkeypatch.setattr(app_module, "next_replies", racing_next_replies)
+    asyncio.run(app_module.process_message(
+        {"from": wa_id, "id": msg_id, "type": "text", "text": {"body": "1"}}
+    ))
+
+    flow = app_module.flows.registry.default
+    # Tentativa 1 (START → DATA) perdeu: só sai a resposta refeita sobre DATA
+    assert len(calls) == 2
+    assert sent == [flow.states["TIPO"].prompt]
+    assert flow.states["DATA"].prompt not in sent
+    assert db.begin_turn(wa_id, fresh=True).session == ("TIPO", {"data": "1"})
+    with db.get_conn() as conn:
+        rows = conn.execute(
+            "SELECT direction, body FROM messages WHERE wa_id = %s ORDER BY id", (wa_id,)
+        ).fetchall()
+    assert rows == [("in", "1"), ("out-bot", flow.states["TIPO"].prompt)]
@@ -0,0 +1,89 @@
+import gzip
+import json
+import uuid
+
+import pytest
+from botocore.exceptions import ClientError
+
+import snapshots
+from snapshots import SNAPSHOT_KEEP, SnapshotPublisher, pointer_key, version_key
+
+
+class RecordingUploader:
+    """r2_client de verdade (moto), anotando a ordem dos uploads."""
+
+    def __init__(self, r2):
+        self.r2 = r2
+        self.puts = []
+
+    def put_object(self, key, body, content_type, **kwargs):
+        self.puts.append(key)
+        self.r2.put_object(key, body, content_type, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.r2, name)
+
+
+@pytest.fixture
+def tenant():
+    return f"t-{uuid.uuid4().hex[:8]}"
+
+
+@pytest.fixture
+def versions(monkeypatch):
+    """render_snapshot sem Postgres: a versão é a que o teste define."""
+    current = {"version": 1}
+
+    def render(tenant_slug, attempts=3):
+        v = current["version"]
+        return v, {"tenant": tenant_slug, "version": v, "generated_at": "2026-01-01T00:00:00+00:00",
+                   "items": [{"id": v, "name": f"item {v}"}], "total": 1, "next_cursor": None}
+
+    monkeypatch.setattr(snapshots, "render_snapshot", render)
+    return current
+
+
+def test_publish_uploads_version_then_pointer(r2, tenant, versions):
+    up = RecordingUploader(r2)
+    publisher = SnapshotPublisher(uploader=up)
+    assert publisher.publish(tenant) == 1
+    assert up.puts == [version_key(tenant, 1), pointer_key(tenant)]
+
+    pointer = json.loads(r2.get_object(pointer_key(tenant)))
+    assert pointer["version"] == 1
+    assert pointer["url"] == r2.build_public_url(version_key(tenant, 1))
+    body = json.loads(gzip.decompress(r2.get_object(version_key(tenant, 1))))
+    assert body["items"] == [{"id": 1, "name": "item 1"}]
+
+
+def test_same_version_is_not_uploaded_again(r2, tenant, versions):
+    up = RecordingUploader(r2)
+    publisher = SnapshotPublisher(uploader=up)
+    publisher.publish(tenant)
+    assert publisher.publish(tenant) is None
+    assert len(up.puts) == 2 and publisher.skipped == 1
+
+
+def test_prune_keeps_latest_versions(r2, tenant, versions):
+    publisher = SnapshotPublisher(uploader=r2)
+    for v in range(1, SNAPSHOT_KEEP + 4):
+        versions["version"] = v
+        publisher.publish(tenant)
+    keys = r2.list_keys(f"{snapshots.SNAPSHOT_PREFIX}/{tenant}/catalog-v")
+    expected = [version_key(tenant, v) for v in range(4, SNAPSHOT_KEEP + 4)]
+    assert sorted(keys) == sorted(expected)
+    assert json.loads(r2.get_object(pointer_key(tenant)))["version"] == SNAPSHOT_KEEP + 3
+
+
+def test_failed_upload_keeps_tenant_pending(r2, tenant, versions):
+    class Broken(RecordingUploader):
+        def put_object(self, key, body, content_type, **kwargs):
+            raise RuntimeError("R2 fora")
+
+    publisher = SnapshotPublisher(debounce=0, uploader=Broken(r2))
+    publisher.schedule(tenant)
+    result = publisher.run_due()
+    assert result["failed"] == [tenant]
+    assert publisher.stats()["pending"] == 1
+    with pytest.raises(ClientError):
+        r2.get_object(pointer_key(tenant))
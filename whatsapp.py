@@ -0,0 +1,155 @@
+# whatsapp.py
+"""
+Cliente assíncrono da WhatsApp Cloud API (Graph API).
+
+Mantém um pool de conexões keep-alive reaproveitado entre envios (sem novo
+handshake TLS por resposta), HTTP/2 opcional e timeout por request.
+GRAPH_BASE_URL permite apontar para um servidor mock local.
+"""
+import json
+import logging
+import os
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+import httpx
+
+GRAPH_BASE_URL = os.getenv("GRAPH_BASE_URL", "https://graph.facebook.com").rstrip("/")
+GRAPH_VERSION = os.getenv("GRAPH_VERSION", "v22.0")
+ACCESS_TOKEN = os.getenv("WHATSAPP_ACCESS_TOKEN")
+PHONE_NUMBER_ID = os.getenv("WHATSAPP_PHONE_NUMBER_ID")
+
+GRAPH_TIMEOUT = float(os.getenv("GRAPH_TIMEOUT", "10"))
+GRAPH_CONNECT_TIMEOUT = float(os.getenv("GRAPH_CONNECT_TIMEOUT", "5"))
+GRAPH_MAX_CONNECTIONS = int(os.getenv("GRAPH_MAX_CONNECTIONS", "50"))
+GRAPH_MAX_KEEPALIVE = int(os.getenv("GRAPH_MAX_KEEPALIVE", "20"))
+GRAPH_HTTP2 = os.getenv("GRAPH_HTTP2", "0").strip().lower() in ("1", "true", "yes")
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+@dataclass
+class SendResult:
+    status: int
+    message_id: Optional[str] = None
+    error_code: Optional[int] = None
+    error: Optional[str] = None
+    body: str = ""
+    # Segundos sugeridos pela API (header Retry-After) quando há throttling
+    retry_after: Optional[float] = None
+
+    @property
+    def ok(self) -> bool:
+        return 200 <= self.status < 300
+
+
+def _parse_response(status: int, text: str) -> SendResult:
+    """
+    Extrai message_id (sucesso) ou error.code/message (falha) da resposta do Graph.
+    """
+    result = SendResult(status=status, body=text)
+    try:
+        data: Dict[str, Any] = json.loads(text)
+    except Exception:
+        if status >= 400:
+            result.error = text[:500]
+        return result
+
+    if not isinstance(data, dict):
+        return result
+
+    msgs = data.get("messages") or []
+    if msgs and isinstance(msgs, list):
+        result.message_id = (msgs[0] or {}).get("id")
+
+    err = data.get("error")
+    if isinstance(err, dict):
+        result.error_code = err.get("code")
+        result.error = err.get("message") or text[:500]
+    elif status >= 400:
+        result.error = text[:500]
+    return result
+
+
+class WhatsAppClient:
+    def __init__(
+        self,
+        access_token: Optional[str] = ACCESS_TOKEN,
+        phone_number_id: Optional[str] = PHONE_NUMBER_ID,
+        base_url: str = GRAPH_BASE_URL,
+        graph_version: str = GRAPH_VERSION,
+        timeout: float = GRAPH_TIMEOUT,
+        http2: bool = GRAPH_HTTP2,
+    ):
+        self.access_token = access_token
+        self.phone_number_id = phone_number_id
+        self.base_url = base_url.rstrip("/")
+        self.graph_version = graph_version
+        self.timeout = timeout
+        self.http2 = http2 and _http2_available()
+        if http2 and not self.http2:
+            logging.warning("[whatsapp] GRAPH_HTTP2 ativo mas pacote 'h2' ausente; usando HTTP/1.1")
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def messages_url(self) -> str:
+        return f"{self.base_url}/{self.graph_version}/{self.phone_number_id}/messages"
+
+    def _get_client(self) -> httpx.AsyncClient:
+        # Criado sob demanda para nascer no event loop em uso
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                http2=self.http2,
+                timeout=httpx.Timeout(self.timeout, connect=GRAPH_CONNECT_TIMEOUT),
+                limits=httpx.Limits(
+                    max_connections=GRAPH_MAX_CONNECTIONS,
+                    max_keepalive_connections=GRAPH_MAX_KEEPALIVE,
+                ),
+                headers={
+                    "Authorization": f"Bearer {self.access_token}",
+                    "Content-Type": "application/json",
+                },
+            )
+        return self._client
+
+    async def send_text(self, to_wa_id: str, text: str, timeout: Optional[float] = None) -> SendResult:
+        payload = {
+            "messaging_product": "whatsapp",
+            "to": to_wa_id,
+            "type": "text",
+            "text": {"body": text},
+        }
+        try:
+            r = await self._get_client().post(
+                self.messages_url,
+                json=payload,
+                timeout=timeout if timeout is not None else httpx.USE_CLIENT_DEFAULT,
+            )
+        except httpx.TimeoutException as e:
+            logging.error(f"[send_text:timeout] {e!r}")
+            return SendResult(status=504, error=f"timeout: {e!r}")
+        except Exception as e:
+            logging.error(f"[send_text:error] {e!r}")
+            return SendResult(status=500, error=str(e))
+
+        result = _parse_response(r.status_code, r.text)
+        try:
+            ra = r.headers.get("retry-after")
+            result.retry_after = float(ra) if ra else None
+        except ValueError:
+            result.retry_after = None
+        logging.info(
+            f"[send_text] {result.status} id={result.message_id} err={result.error_code}"
+        )
+        return result
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None